@@ -1,7 +1,14 @@
 from django.contrib import admin
-from .models import User, Challenge, Score
+from .models import User, Challenge, Score, FeedbackCacheEntry, UserChallengeBest, ChallengeScoreAggregate, UserChallengeScoreAggregate, UserStats, RescoreJob
 
 # Register your models here.
 admin.site.register(User)
 admin.site.register(Challenge)
-admin.site.register(Score)
\ No newline at end of file
+admin.site.register(Score)
+admin.site.register(FeedbackCacheEntry)
+
+admin.site.register(UserChallengeBest)
+admin.site.register(ChallengeScoreAggregate)
+admin.site.register(UserChallengeScoreAggregate)
+admin.site.register(UserStats)
+admin.site.register(RescoreJob)
\ No newline at end of file
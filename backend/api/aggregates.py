@@ -0,0 +1,137 @@
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Score, ChallengeScoreAggregate, UserChallengeScoreAggregate
+
+CHART_KEYS = ChallengeScoreAggregate.CHART_KEYS
+AGGREGATE_FIELDS = ['count', 'overall_sum'] + [f'{key}_{suffix}' for key in CHART_KEYS for suffix in ('sum', 'count')]
+
+
+def score_deltas(overall_score, chart_data, sign=1):
+    """Field increments contributed by one score (sign=-1 removes it)."""
+    deltas = {'count': sign, 'overall_sum': sign * overall_score}
+    for key in CHART_KEYS:
+        value = (chart_data or {}).get(key)
+        if value is not None:
+            deltas[f'{key}_sum'] = sign * float(value)
+            deltas[f'{key}_count'] = sign
+    return deltas
+
+
+def _aggregate_rows(user_id, challenge_id):
+    """The challenge-wide and the per-user aggregate rows a score contributes to."""
+    return [
+        (ChallengeScoreAggregate, {'challenge_id': challenge_id}),
+        (UserChallengeScoreAggregate, {'user_id': user_id, 'challenge_id': challenge_id}),
+    ]
+
+
+def apply_score(user_id, challenge_id, overall_score, chart_data, sign=1):
+    """Adds (or with sign=-1 subtracts) one score to its aggregates with atomic F() increments."""
+    deltas = score_deltas(overall_score, chart_data, sign)
+    for model, lookup in _aggregate_rows(user_id, challenge_id):
+        # 削除時は行を作らない（ユーザー・チャレンジの削除に伴う場合、行は先に消えていることがある）
+        if sign > 0:
+            model.objects.get_or_create(**lookup)
+        model.objects.filter(**lookup).update(**{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def _sql_totals():
+    """Aggregate expressions over the typed metric columns (Count ignores NULL like the running counters)."""
+    totals = {'count': Count('id'), 'overall_sum': Coalesce(Sum('overall_score'), 0.0)}
+    for key in CHART_KEYS:
+        totals[f'{key}_sum'] = Coalesce(Sum(key), 0.0)
+        totals[f'{key}_count'] = Count(key)
+    return totals
+
+
+def recompute_aggregates(user_id, challenge_id):
+    """Recomputes the two aggregates a user's scores contribute to (after an in-place score update)."""
+    for model, lookup in _aggregate_rows(user_id, challenge_id):
+        totals = Score.objects.filter(**lookup).aggregate(**_sql_totals())
+        model.objects.update_or_create(**lookup, defaults=totals)
+
+
+def compute_all_aggregates(challenge_id=None):
+    """
+    Aggregates recomputed from the Score table with two GROUP BY queries.
+    Returns ({challenge_id: totals}, {(user_id, challenge_id): totals}).
+    """
+    scores = Score.objects.all()
+    if challenge_id is not None:
+        scores = scores.filter(challenge_id=challenge_id)
+
+    challenge_totals = {
+        row.pop('challenge_id'): row
+        for row in scores.order_by().values('challenge_id').annotate(**_sql_totals())
+    }
+    user_totals = {
+        (row.pop('user_id'), row.pop('challenge_id')): row
+        for row in scores.order_by().values('user_id', 'challenge_id').annotate(**_sql_totals())
+    }
+    return challenge_totals, user_totals
+
+
+def _stored_aggregates(challenge_id=None):
+    challenge_rows = ChallengeScoreAggregate.objects.all()
+    user_rows = UserChallengeScoreAggregate.objects.all()
+    if challenge_id is not None:
+        challenge_rows = challenge_rows.filter(challenge_id=challenge_id)
+        user_rows = user_rows.filter(challenge_id=challenge_id)
+
+    stored_challenges = {
+        row['challenge_id']: row for row in challenge_rows.values('challenge_id', *AGGREGATE_FIELDS)
+    }
+    stored_users = {
+        (row['user_id'], row['challenge_id']): row for row in user_rows.values('user_id', 'challenge_id', *AGGREGATE_FIELDS)
+    }
+    return stored_challenges, stored_users
+
+
+def find_drift(challenge_id=None, tolerance=1e-6):
+    """
+    Compares the stored aggregates with a fresh computation.
+    Returns (model name, key, field, expected, stored) rows; empty aggregates count as absent.
+    """
+    expected = compute_all_aggregates(challenge_id)
+    stored = _stored_aggregates(challenge_id)
+    empty = dict.fromkeys(AGGREGATE_FIELDS, 0)
+
+    drift = []
+    for name, expected_rows, stored_rows in zip(
+        (ChallengeScoreAggregate.__name__, UserChallengeScoreAggregate.__name__), expected, stored,
+    ):
+        for key in sorted(expected_rows.keys() | stored_rows.keys()):
+            expected_row = expected_rows.get(key, empty)
+            stored_row = stored_rows.get(key, empty)
+            for field in AGGREGATE_FIELDS:
+                if abs(expected_row[field] - stored_row[field]) > tolerance * max(1, abs(expected_row[field])):
+                    drift.append((name, key, field, expected_row[field], stored_row[field]))
+    return drift
+
+
+@transaction.atomic
+def rebuild_aggregates(challenge_id=None):
+    """Replaces the aggregate tables with values recomputed from Score."""
+    challenge_totals, user_totals = compute_all_aggregates(challenge_id)
+
+    challenge_rows = ChallengeScoreAggregate.objects.all()
+    user_rows = UserChallengeScoreAggregate.objects.all()
+    if challenge_id is not None:
+        challenge_rows = challenge_rows.filter(challenge_id=challenge_id)
+        user_rows = user_rows.filter(challenge_id=challenge_id)
+    challenge_rows.delete()
+    user_rows.delete()
+
+    ChallengeScoreAggregate.objects.bulk_create(
+        [ChallengeScoreAggregate(challenge_id=cid, **totals) for cid, totals in challenge_totals.items()],
+        batch_size=1000,
+    )
+    UserChallengeScoreAggregate.objects.bulk_create(
+        [
+            UserChallengeScoreAggregate(user_id=user_id, challenge_id=cid, **totals)
+            for (user_id, cid), totals in user_totals.items()
+        ],
+        batch_size=1000,
+    )
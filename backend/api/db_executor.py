@@ -0,0 +1,28 @@
+"""
+Database work of the async views, off the event loop.
+
+`sync_to_async(..., thread_sensitive=True)` (and Django's async ORM methods such as `acreate`,
+which use it internally) runs every call of a uvicorn worker on one shared thread, so concurrent
+score submissions are saved one after another. `run_db` instead runs the call on a dedicated pool
+of `DB_WORKERS` threads; each call checks a connection out of the Postgres pool
+(settings.DB_POOL_*) and returns it when done, so concurrency is bounded by both.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+db_executor = ThreadPoolExecutor(max_workers=settings.DB_WORKERS, thread_name_prefix='db')
+
+
+def _call(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        # 接続をスレッドに持たせたままにせず、プールへ返す（プール無効時は期限切れ・エラー時のみ閉じる）
+        close_old_connections()
+
+
+async def run_db(fn, *args, **kwargs):
+    """Runs a blocking ORM call on the database thread pool."""
+    return await sync_to_async(_call, thread_sensitive=False, executor=db_executor)(fn, args, kwargs)
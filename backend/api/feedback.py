@@ -0,0 +1,231 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .feedback_cache import feedback_cache, make_cache_key
+from .instrumentation import LLM_DURATION, LLM_FIRST_TOKEN, record_span
+from .llm import get_llm_client
+from .prompts import advice_prompts, expert_knowledge, quotes_literal_values, render_advice
+from .models import Score
+from .response_cache import invalidate_on_commit
+
+logger = logging.getLogger(__name__)
+
+ADVICE_FAILED_MESSAGE = "（アドバイス生成に失敗しました。APIキーまたはネットワーク接続を確認してください。）"
+
+
+# --- Advice Generation ---
+
+def generate_advice(detailed_results, overall_score, client=None, on_text=None):
+    """
+    Generates advice with the configured LLM client, reusing a cached advice when a session
+    with the same quantized results was already analysed against the same knowledge base.
+    The advice quotes numbers as placeholders and is cached in that form; the returned text has the
+    values of this score filled in (see prompts.render_advice).
+    If `on_text` is given the client's streaming API is used and `on_text(text_so_far)` is called
+    as pieces arrive. Raises whatever the client raises; callers decide how to surface failures.
+    """
+    if not detailed_results:
+        return ""
+
+    knowledge = expert_knowledge.current()
+    cache_key = make_cache_key(detailed_results, overall_score, knowledge.hash)
+    cached_advice = feedback_cache.get(cache_key)
+    if cached_advice is not None:
+        return render_advice(cached_advice, detailed_results, overall_score)
+
+    prompt = advice_prompts.build(detailed_results, overall_score, knowledge)
+    client = client or get_llm_client()
+
+    backend = getattr(client, 'backend', type(client).__name__)
+    outcome = 'error'
+    start_time = time.perf_counter()
+    try:
+        if on_text is not None and hasattr(client, 'generate_stream'):
+            text = ''
+            for piece in client.generate_stream(prompt):
+                if not text:
+                    LLM_FIRST_TOKEN.observe(time.perf_counter() - start_time, backend=backend)
+                text += piece
+                on_text(render_advice(text, detailed_results, overall_score, partial=True))
+        else:
+            text = client.generate(prompt)
+        outcome = 'ok'
+    finally:
+        elapsed_time = time.perf_counter() - start_time
+        LLM_DURATION.observe(elapsed_time, backend=backend, outcome=outcome)
+        record_span('llm_generate', elapsed_time)
+        logger.info("LLM generation (%s, %s) took %.2f seconds.", backend, outcome, elapsed_time)
+
+    # プレースホルダを使わず数値をそのまま書いたアドバイスは、同じキーの別のスコアに見せられないためキャッシュしない
+    if quotes_literal_values(text, detailed_results, overall_score):
+        logger.info("Advice quotes literal values; not caching it.")
+    else:
+        feedback_cache.set(cache_key, text)
+    return render_advice(text, detailed_results, overall_score)
+
+
+def feedback_header(overall_score):
+    return f"総合スコアは {overall_score}点です！\n\n"
+
+
+def generate_feedback_text(detailed_results, overall_score, client=None):
+    """Generates feedback based on the overall score and advice (synchronously)."""
+    try:
+        advice = generate_advice(detailed_results, overall_score, client)
+    except Exception as e:
+        logger.warning("LLM API error: %s", e)
+        advice = ADVICE_FAILED_MESSAGE
+    return feedback_header(overall_score) + advice
+
+
+# --- Job Queue ---
+# Score 行そのものをキューとして扱う（feedback_status = pending の行がジョブ）。
+# 各プロセスのディスパッチャスレッドが pending 行を1件ずつ確保し、ワーカープールで実行する。
+
+def claim_next_job():
+    """Atomically moves the oldest pending score to `running`; returns its id or None."""
+    with transaction.atomic():
+        score_id = (
+            Score.objects.select_for_update(skip_locked=True)
+            .filter(feedback_status=Score.FeedbackStatus.PENDING)
+            .order_by('id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if score_id is None:
+            return None
+        claimed = Score.objects.filter(
+            pk=score_id, feedback_status=Score.FeedbackStatus.PENDING
+        ).update(feedback_status=Score.FeedbackStatus.RUNNING, feedback_claimed_at=timezone.now())
+    return score_id if claimed else None
+
+
+def requeue_stale_jobs(timeout=None):
+    """
+    Moves jobs that have been `running` for longer than `timeout` seconds (settings.FEEDBACK_JOB_TIMEOUT)
+    back to `pending`: their worker is assumed to have died (restart, crash) before finishing them.
+    Returns the number of re-queued jobs.
+    """
+    timeout = settings.FEEDBACK_JOB_TIMEOUT if timeout is None else timeout
+    stale_before = timezone.now() - timedelta(seconds=timeout)
+    return Score.objects.filter(feedback_status=Score.FeedbackStatus.RUNNING)\
+        .filter(Q(feedback_claimed_at__lt=stale_before) | Q(feedback_claimed_at__isnull=True))\
+        .update(feedback_status=Score.FeedbackStatus.PENDING, feedback_claimed_at=None)
+
+
+def _progressive_writer(score_id, header, interval):
+    """
+    Returns an `on_text` callback that writes the partial advice to the running score at most every
+    `interval` seconds (the first piece immediately), so /api/scores/<id>/feedback/stream/ can relay it.
+    """
+    flushed_at = None
+
+    def write(advice):
+        nonlocal flushed_at
+        now = time.monotonic()
+        if flushed_at is not None and now - flushed_at < interval:
+            return
+        flushed_at = now
+        Score.objects.filter(pk=score_id, feedback_status=Score.FeedbackStatus.RUNNING).update(
+            feedback_text=header + advice,
+        )
+
+    return write
+
+
+def run_feedback_job(score_id, client=None):
+    """Generates and stores the feedback for a claimed score, writing the partial text while the LLM streams."""
+    score = Score.objects.only('id', 'overall_score', 'detailed_results').get(pk=score_id)
+    on_text = _progressive_writer(score_id, feedback_header(score.overall_score), settings.FEEDBACK_STREAM_FLUSH_INTERVAL)
+    try:
+        advice = generate_advice(score.detailed_results, score.overall_score, client, on_text=on_text)
+        status = Score.FeedbackStatus.DONE
+    except Exception as e:
+        logger.warning("LLM API error: %s", e)
+        advice = ADVICE_FAILED_MESSAGE
+        status = Score.FeedbackStatus.FAILED
+
+    Score.objects.filter(pk=score_id).update(
+        feedback_text=feedback_header(score.overall_score) + advice,
+        feedback_status=status,
+    )
+    # update() はシグナルを送らないため、リザルトページのキャッシュをここで無効化する
+    invalidate_on_commit(f'score:{score_id}')
+    return status
+
+
+class FeedbackWorkerPool:
+    """
+    A per-process pool that drains pending feedback jobs from the database.
+    It is started with the server (config/asgi.py). `notify()` wakes the dispatcher immediately;
+    otherwise it polls every `poll_interval` seconds, which also picks up jobs left pending by other
+    processes, and re-queues jobs whose worker died while running them (`requeue_stale_jobs`).
+    """
+
+    def __init__(self, workers, poll_interval):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._executor = None
+        self._slots = threading.Semaphore(workers)
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='feedback')
+            threading.Thread(target=self._dispatch, name='feedback-dispatcher', daemon=True).start()
+
+    def notify(self):
+        self.start()
+        self._wakeup.set()
+
+    def _dispatch(self):
+        next_requeue = 0.0
+        while True:
+            self._slots.acquire()
+            try:
+                if time.monotonic() >= next_requeue:
+                    next_requeue = time.monotonic() + self.poll_interval
+                    requeued = requeue_stale_jobs()
+                    if requeued:
+                        logger.warning("Re-queued %d stale feedback job(s).", requeued)
+                score_id = claim_next_job()
+            except Exception as e:
+                logger.exception("Feedback queue error: %s", e)
+                score_id = None
+            finally:
+                close_old_connections()
+
+            if score_id is None:
+                self._slots.release()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._executor.submit(self._run, score_id)
+
+    def _run(self, score_id):
+        try:
+            run_feedback_job(score_id)
+        except Exception as e:
+            logger.exception("Feedback job %s failed: %s", score_id, e)
+        finally:
+            close_old_connections()
+            self._slots.release()
+
+
+worker_pool = FeedbackWorkerPool(settings.FEEDBACK_WORKERS, settings.FEEDBACK_POLL_INTERVAL)
+
+
+def enqueue_feedback(score_id):
+    """Wakes the worker pool once the transaction that created the pending score commits."""
+    transaction.on_commit(worker_pool.notify)
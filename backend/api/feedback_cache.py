@@ -0,0 +1,170 @@
+import hashlib
+import json
+import threading
+from datetime import timedelta
+from cachetools import TTLCache
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .instrumentation import registry
+from .models import FeedbackCacheEntry
+
+# expert_knowledge.md「項目別スコアランク」(各25点満点)
+METRIC_RANKS = [(21, 'S'), (17, 'A'), (12, 'B'), (6, 'C'), (0, 'D')]
+# expert_knowledge.md「総合スコア別評価ガイドライン」(100点満点)
+OVERALL_RANKS = [(95, 'SS'), (85, 'S'), (70, 'A'), (55, 'B'), (40, 'C'), (0, 'D')]
+
+
+def to_rank(score, bands):
+    for lower_bound, rank in bands:
+        if score >= lower_bound:
+            return rank
+    return bands[-1][1]
+
+
+def _direction(value):
+    """Sign of a tilt / sway direction (-1, 0, 1); the knowledge base only cares about the side."""
+    return (value > 0) - (value < 0)
+
+
+def quantize_results(detailed_results, overall_score, score_step):
+    """
+    Reduces the analysis results to what the advice actually depends on:
+    the S–D rank of every metric, its score bucketed to `score_step` points,
+    and the directions / comparisons used by the cross-analysis patterns.
+    """
+    def bucket(score):
+        return int(score // score_step)
+
+    features = {'overall': to_rank(overall_score, OVERALL_RANKS)}
+
+    for name, result in detailed_results.items():
+        if name == 'symmetry':
+            for part, part_result in result.items():
+                features[f'symmetry.{part}'] = (
+                    to_rank(part_result['score'], METRIC_RANKS),
+                    bucket(part_result['score']),
+                    _direction(part_result['avg_tilt_direction']),
+                )
+            continue
+
+        feature = [to_rank(result['score'], METRIC_RANKS), bucket(result['score'])]
+        if name == 'trunk_uprightness':
+            feature.append(_direction(result['avg_tilt_direction']))
+        elif name == 'gravity_stability':
+            feature.append(result['head_score'] < result['hip_score'])
+        features[name] = tuple(feature)
+
+    return features
+
+
+def make_cache_key(detailed_results, overall_score, knowledge_hash):
+    """Content address of the advice: quantized results plus the knowledge base version (sha256 of its text)."""
+    payload = {
+        'knowledge': knowledge_hash,
+        'results': quantize_results(detailed_results, overall_score, settings.FEEDBACK_CACHE_SCORE_STEP),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class BaseFeedbackCache:
+    """Advice cache with hit / miss counters (per process)."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def get(self, key):
+        advice = self._get(key)
+        with self._counter_lock:
+            if advice is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return advice
+
+    def set(self, key, advice):
+        self._set(key, advice)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def collect(self):
+        values = [({'outcome': 'hit'}, self.hits), ({'outcome': 'miss'}, self.misses)]
+        return [('runway_feedback_cache_requests_total', 'counter', 'Advice cache lookups by outcome.', values)]
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, advice):
+        raise NotImplementedError
+
+
+class NullFeedbackCache(BaseFeedbackCache):
+    """Disables caching; every request calls the LLM."""
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, advice):
+        pass
+
+
+class LocalFeedbackCache(BaseFeedbackCache):
+    """In-process LRU cache with TTL (cachetools). Not shared between uvicorn workers."""
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            return self._cache.get(key)
+
+    def _set(self, key, advice):
+        with self._lock:
+            self._cache[key] = advice
+
+
+class DatabaseFeedbackCache(BaseFeedbackCache):
+    """Cache shared by every process, stored in FeedbackCacheEntry with TTL and LRU eviction."""
+
+    def _get(self, key):
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        entry = FeedbackCacheEntry.objects.filter(key=key, created_at__gte=cutoff).only('advice').first()
+        if entry is None:
+            return None
+        FeedbackCacheEntry.objects.filter(pk=entry.pk).update(last_used_at=timezone.now(), hit_count=F('hit_count') + 1)
+        return entry.advice
+
+    def _set(self, key, advice):
+        FeedbackCacheEntry.objects.update_or_create(
+            key=key,
+            defaults={'advice': advice, 'created_at': timezone.now(), 'last_used_at': timezone.now()},
+        )
+        self._evict()
+
+    def _evict(self):
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        FeedbackCacheEntry.objects.filter(created_at__lt=cutoff).delete()
+
+        stale_ids = FeedbackCacheEntry.objects.order_by('-last_used_at').values_list('pk', flat=True)[self.maxsize:]
+        FeedbackCacheEntry.objects.filter(pk__in=list(stale_ids)).delete()
+
+
+FEEDBACK_CACHE_BACKENDS = {
+    'none': NullFeedbackCache,
+    'local': LocalFeedbackCache,
+    'database': DatabaseFeedbackCache,
+}
+
+feedback_cache = FEEDBACK_CACHE_BACKENDS[settings.FEEDBACK_CACHE_BACKEND](
+    maxsize=settings.FEEDBACK_CACHE_MAXSIZE,
+    ttl=settings.FEEDBACK_CACHE_TTL,
+)
+registry.register_collector(feedback_cache.collect)
@@ -0,0 +1,129 @@
+"""
+Duplicate score submissions.
+
+Clients on flaky connections retry `POST /api/score/`. A retry is recognised by its
+`Idempotency-Key` header or, without one, by a hash of what was submitted (user, challenge,
+video duration and the landmark frames), and answered with the score saved by the first
+request (within settings.SCORE_DEDUP_WINDOW) instead of scoring, saving and generating
+feedback again. Retries that arrive while the first request is still being scored wait for
+its result (`score_flights`) rather than starting a second computation.
+"""
+import asyncio
+import hashlib
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .instrumentation import registry
+from .models import Score
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different submission.'
+    default_code = 'idempotency_key_reused'
+
+
+def idempotency_key(request):
+    """The request's Idempotency-Key header (None if absent)."""
+    key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValidationError({IDEMPOTENCY_HEADER: f'Must be at most {MAX_KEY_LENGTH} characters.'})
+    return key
+
+
+class PayloadHasher:
+    """
+    SHA-256 of a submission. Frames are hashed as the float64 arrays the scoring pipeline uses,
+    so the JSON body and the NDJSON stream of the same session (and any whitespace / key order
+    differences) give the same hash.
+    """
+
+    def __init__(self, user_id, challenge_id, video_duration):
+        self._hash = hashlib.sha256(f'{user_id}:{challenge_id}:{float(video_duration)!r}:'.encode())
+
+    def update(self, frames):
+        self._hash.update(frames.tobytes())
+        return frames
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def payload_hash(user_id, challenge_id, video_duration, landmark_array):
+    hasher = PayloadHasher(user_id, challenge_id, video_duration)
+    hasher.update(landmark_array)
+    return hasher.hexdigest()
+
+
+def find_duplicate(user_id, payload_hash=None, key=None):
+    """The newest score of the user submitted within the window with the same key or payload hash."""
+    conditions = Q()
+    if key is not None:
+        conditions |= Q(idempotency_key=key)
+    if payload_hash is not None:
+        conditions |= Q(payload_hash=payload_hash)
+    if not conditions or settings.SCORE_DEDUP_WINDOW <= 0:
+        return None
+    since = timezone.now() - timedelta(seconds=settings.SCORE_DEDUP_WINDOW)
+    return Score.objects.defer('raw_landmarks', 'landmarks_blob')\
+        .filter(conditions, user_id=user_id, created_at__gte=since).order_by('-id').first()
+
+
+def check_same_payload(score, key, payload_hash):
+    """Raises IdempotencyKeyReused when a key-matched score was submitted with other data."""
+    if key is not None and score.idempotency_key == key and payload_hash is not None \
+            and score.payload_hash is not None and score.payload_hash != payload_hash:
+        raise IdempotencyKeyReused()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key onto one computation (per process / event loop).
+    The computation runs as its own task, so it completes even if the request that started it
+    is cancelled; every caller gets its result or exception.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def run(self, key, make_coroutine):
+        """Returns (result, shared): `shared` is True when the result came from another caller's computation."""
+        task = self._inflight.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+        task = asyncio.ensure_future(make_coroutine())
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._done(key, done))
+        return await asyncio.shield(task), False
+
+    def _done(self, key, task):
+        self._inflight.pop(key, None)
+        # 呼び出し元がすべて切断していても、例外が未取得の警告にならないようにする
+        if not task.cancelled():
+            task.exception()
+
+    def collect(self):
+        return [(
+            'runway_score_submissions_inflight', 'gauge',
+            'Distinct score submissions being scored in this process.',
+            [({}, len(self._inflight))],
+        )]
+
+
+score_flights = SingleFlight()
+registry.register_collector(score_flights.collect)
+
+SCORE_DEDUPLICATED = registry.counter(
+    'runway_score_submissions_deduplicated_total',
+    'Score submissions answered with an earlier result instead of being scored again.', ('reason',),
+)
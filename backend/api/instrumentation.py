@@ -0,0 +1,235 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 秒単位のバケット。プロキシのタイムアウト（120秒）付近まで区別できるようにしておく
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+# --- Metric types ---
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self, extra=()):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name + _format_labels(self.labelnames, key, extra), value) for key, value in items]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set (Prometheus histogram semantics)."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self, extra=()):
+        with self._lock:
+            items = sorted((key, dict(series, buckets=list(series['buckets']))) for key, series in self._series.items())
+        samples = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+                samples.append((self.name + '_bucket' + _format_labels(self.labelnames, key, [*extra, ('le', le)]), cumulative))
+            samples.append((self.name + '_sum' + _format_labels(self.labelnames, key, extra), series['sum']))
+            samples.append((self.name + '_count' + _format_labels(self.labelnames, key, extra), series['count']))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of this process. Each uvicorn worker has its own registry, so every sample carries
+    a `worker` label (the process id): a scrape returns the series of whichever worker answered, and
+    Prometheus keeps the workers' series apart instead of seeing one counter jump between their values.
+    Aggregate across workers in queries, e.g. `sum without (worker) (rate(runway_http_requests_total[5m]))`.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collect):
+        """`collect()` returns [(name, kind, documentation, [(labels_dict, value), ...]), ...] at scrape time."""
+        self._collectors.append(collect)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        # fork 後のプロセスで評価するため、ラベルは出力のたびに作る
+        worker = [('worker', os.getpid())]
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{sample} {_format_value(value)}' for sample, value in metric.samples(worker))
+        for collect in self._collectors:
+            for name, kind, documentation, values in collect():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in values:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values(), worker)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    'runway_http_request_duration_seconds', 'Time spent handling a request, per endpoint.', ('method', 'endpoint'),
+)
+REQUESTS = registry.counter(
+    'runway_http_requests_total', 'Handled requests by endpoint and status code.', ('method', 'endpoint', 'status'),
+)
+REQUEST_QUERIES = registry.histogram(
+    'runway_http_request_db_queries', 'Database queries executed while handling a request.', ('endpoint',),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_DURATION = registry.histogram(
+    'runway_http_request_db_duration_seconds', 'Time spent in database queries while handling a request.', ('endpoint',),
+)
+SPAN_DURATION = registry.histogram(
+    'runway_span_duration_seconds', 'Duration of the named steps of the scoring pipeline.', ('span',),
+)
+LLM_DURATION = registry.histogram(
+    'runway_llm_request_duration_seconds', 'LLM generation latency.', ('backend', 'outcome'),
+)
+LLM_FIRST_TOKEN = registry.histogram(
+    'runway_llm_first_token_seconds', 'Time until the first streamed piece of LLM output arrived.', ('backend',),
+)
+LLM_TOKENS = registry.counter(
+    'runway_llm_tokens_total', 'Tokens reported by the LLM API.', ('backend', 'kind'),
+)
+
+
+# --- Request traces and spans ---
+
+class RequestTrace:
+    """
+    Spans and query totals collected while one request is being handled.
+    The request's database calls may run on several run_db threads at once, so updates take a lock.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.queries = 0
+        self.query_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds):
+        with self._lock:
+            self.spans.append((name, seconds))
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+    def summary(self):
+        return ' '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in self.spans)
+
+
+# sync_to_async はコンテキストをコピーして別スレッドで実行するため、同じ RequestTrace に書き込まれる
+_current_trace = contextvars.ContextVar('runway_request_trace', default=None)
+
+
+def start_trace():
+    trace = RequestTrace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def record_span(name, seconds):
+    """Records an already measured duration (e.g. timings reported back by a scoring worker process)."""
+    SPAN_DURATION.observe(seconds, span=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, seconds)
+
+
+def record_spans(timings, prefix=''):
+    for name, seconds in timings.items():
+        record_span(prefix + name, seconds)
+
+
+@contextmanager
+def span(name):
+    """Times the enclosed block as one step of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Database execute wrapper that adds every query to the current request's totals."""
+    trace = _current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_query(time.perf_counter() - start)
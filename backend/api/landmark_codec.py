@@ -0,0 +1,187 @@
+"""
+Compact binary encoding of landmark arrays (frames × 33 × 4).
+
+Layout (little-endian):
+    header   : magic b'RWLM' | version u8 | dtype u8 | compression u8 | reserved u8
+    segment* : frame_count u32 | payload_size u32 | payload
+
+Each payload is an independently compressed block of `frame_count` frames, so a blob can be
+built incrementally (segments are simply appended) and a frame range can be decoded without
+touching the other segments.
+"""
+import struct
+import zlib
+import numpy as np
+
+from .landmarks import LANDMARK_COUNT, CHANNELS
+
+try:
+    import zstandard
+except ImportError:  # zstd は任意の依存関係
+    zstandard = None
+
+MAGIC = b'RWLM'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBx')
+SEGMENT_HEADER = struct.Struct('<II')
+FRAME_SHAPE = (LANDMARK_COUNT, len(CHANNELS))
+
+DTYPES = {
+    'float16': (1, np.dtype('<f2')),
+    'float32': (2, np.dtype('<f4')),
+}
+COMPRESSIONS = {'none': 0, 'zlib': 1, 'zstd': 2}
+
+# MediaPipe の出力は float32 なので float32 保存は実質ロスレス。float16 は約3桁精度
+DEFAULT_DTYPE = 'float32'
+DEFAULT_COMPRESSION = 'zlib'
+DEFAULT_SEGMENT_FRAMES = 256
+
+
+class LandmarkCodecError(ValueError):
+    pass
+
+
+def _compress(data, compression):
+    if compression == 'none':
+        return data
+    if compression == 'zlib':
+        return zlib.compress(data, 6)
+    if zstandard is None:
+        raise LandmarkCodecError('zstd compression requires the "zstandard" package.')
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _decompress(data, compression):
+    if compression == 'none':
+        return data
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    if zstandard is None:
+        raise LandmarkCodecError('zstd compression requires the "zstandard" package.')
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+class LandmarkEncoder:
+    """
+    Incremental encoder: feed (frames, 33, 4) chunks, then call `finish()` for the blob.
+    Only compressed segments and at most one partial segment are kept in memory.
+    """
+
+    def __init__(self, dtype=DEFAULT_DTYPE, compression=DEFAULT_COMPRESSION, segment_frames=DEFAULT_SEGMENT_FRAMES):
+        if dtype not in DTYPES:
+            raise LandmarkCodecError(f'Unknown dtype: {dtype}')
+        if compression not in COMPRESSIONS:
+            raise LandmarkCodecError(f'Unknown compression: {compression}')
+        self.dtype = dtype
+        self.compression = compression
+        self.segment_frames = segment_frames
+        self.frame_count = 0
+        self._parts = [HEADER.pack(MAGIC, VERSION, DTYPES[dtype][0], COMPRESSIONS[compression])]
+        self._pending = []
+        self._pending_frames = 0
+
+    def feed(self, frames):
+        frames = np.asarray(frames)
+        if not len(frames):
+            return
+        self._pending.append(frames)
+        self._pending_frames += len(frames)
+        self.frame_count += len(frames)
+        if self._pending_frames >= self.segment_frames:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending_frames:
+            return
+        frames = np.concatenate(self._pending) if len(self._pending) > 1 else self._pending[0]
+        payload = _compress(frames.astype(DTYPES[self.dtype][1], copy=False).tobytes(), self.compression)
+        self._parts.append(SEGMENT_HEADER.pack(len(frames), len(payload)))
+        self._parts.append(payload)
+        self._pending = []
+        self._pending_frames = 0
+
+    def finish(self):
+        self._flush()
+        return b''.join(self._parts)
+
+
+def encode_landmarks(frames, dtype=DEFAULT_DTYPE, compression=DEFAULT_COMPRESSION, segment_frames=DEFAULT_SEGMENT_FRAMES):
+    """Encodes a (frames, 33, 4) array into a blob."""
+    encoder = LandmarkEncoder(dtype, compression, segment_frames)
+    encoder.feed(frames)
+    return encoder.finish()
+
+
+def _read_header(blob):
+    if len(blob) < HEADER.size:
+        raise LandmarkCodecError('Landmark blob is truncated.')
+    magic, version, dtype_code, compression_code = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise LandmarkCodecError('Not a landmark blob (bad magic or version).')
+    dtype = next((name for name, (code, _) in DTYPES.items() if code == dtype_code), None)
+    compression = next((name for name, code in COMPRESSIONS.items() if code == compression_code), None)
+    if dtype is None or compression is None:
+        raise LandmarkCodecError('Unknown dtype or compression in landmark blob.')
+    return dtype, compression
+
+
+def iter_segments(blob):
+    """Yields (frame_offset, frame_count, decode) for every segment without decoding it."""
+    blob = memoryview(blob)
+    dtype, compression = _read_header(blob)
+    offset = HEADER.size
+    frame_offset = 0
+
+    while offset < len(blob):
+        frame_count, payload_size = SEGMENT_HEADER.unpack_from(blob, offset)
+        offset += SEGMENT_HEADER.size
+        payload = blob[offset:offset + payload_size]
+        offset += payload_size
+
+        def decode(payload=payload, frame_count=frame_count):
+            data = _decompress(bytes(payload), compression)
+            return np.frombuffer(data, dtype=DTYPES[dtype][1]).reshape((frame_count,) + FRAME_SHAPE)
+
+        yield frame_offset, frame_count, decode
+        frame_offset += frame_count
+
+
+def decode_landmarks(blob, start=0, stop=None):
+    """Decodes frames [start, stop) of a blob into a float64 (frames, 33, 4) array."""
+    chunks = []
+    for frame_offset, frame_count, decode in iter_segments(blob):
+        if stop is not None and frame_offset >= stop:
+            break
+        if frame_offset + frame_count <= start:
+            continue
+        frames = decode()
+        local_start = max(start - frame_offset, 0)
+        local_stop = frame_count if stop is None else min(stop - frame_offset, frame_count)
+        chunks.append(frames[local_start:local_stop])
+
+    if not chunks:
+        return np.zeros((0,) + FRAME_SHAPE, dtype=np.float64)
+    return np.concatenate(chunks).astype(np.float64)
+
+
+def frame_count(blob):
+    """Number of frames stored in a blob (reads only the segment headers)."""
+    return sum(count for _, count, _ in iter_segments(blob))
+
+
+def concat_blobs(blobs):
+    """
+    Joins blobs that share the same dtype / compression into one blob (frames in order).
+    Segments are copied as-is, nothing is decompressed.
+    """
+    blobs = [bytes(blob) for blob in blobs]
+    if not blobs:
+        return encode_landmarks(np.zeros((0,) + FRAME_SHAPE))
+
+    header = blobs[0][:HEADER.size]
+    for blob in blobs:
+        _read_header(blob)
+        if blob[:HEADER.size] != header:
+            raise LandmarkCodecError('Cannot concatenate blobs with different dtype or compression.')
+    return header + b''.join(blob[HEADER.size:] for blob in blobs)
@@ -0,0 +1,111 @@
+import numpy as np
+
+# MediaPipe Pose は1人あたり33点のランドマークを出力する
+LANDMARK_COUNT = 33
+
+# 列レイアウト: frames × LANDMARK_COUNT × len(CHANNELS)
+CHANNELS = ('x', 'y', 'z', 'visibility')
+X, Y, Z, VISIBILITY = range(len(CHANNELS))
+
+
+def landmarks_to_array(raw_landmarks):
+    """
+    Converts the `raw_landmarks` JSON structure (frames × poses × landmarks × dict)
+    into a float64 array of shape (frames, LANDMARK_COUNT, 4).
+
+    Only the first detected pose of each frame is kept, frames without any pose are
+    dropped, and missing landmarks are padded with visibility 0 so that they never
+    pass a visibility check.
+    """
+    frames = [frame[0] for frame in raw_landmarks if frame and frame[0]]
+    array = np.zeros((len(frames), LANDMARK_COUNT, len(CHANNELS)), dtype=np.float64)
+
+    for index, landmarks in enumerate(frames):
+        count = min(len(landmarks), LANDMARK_COUNT)
+        array[index, :count] = [
+            (lm.get('x', 0.0), lm.get('y', 0.0), lm.get('z', 0.0), lm.get('visibility', 0.0))
+            for lm in landmarks[:count]
+        ]
+
+    return array
+
+
+
+class LandmarkShapeError(ValueError):
+    """An uploaded `raw_landmarks` payload that is not frames × poses × 33 landmarks."""
+
+
+def validate_landmarks(raw_landmarks, max_frames=None, first_frame=0):
+    """
+    Checks an uploaded `raw_landmarks` structure (frames × poses × LANDMARK_COUNT ×
+    {x, y, z, visibility}) and converts it to a float64 (frames, LANDMARK_COUNT, 4) array
+    in the same pass. Raises LandmarkShapeError with the offending frame on bad input.
+
+    As in landmarks_to_array, frames without a pose are dropped and only the first pose of a
+    frame is used; unlike it, a pose must have exactly LANDMARK_COUNT landmarks with numeric
+    x / y / z (a missing visibility counts as 0, i.e. never visible). `first_frame` is the index
+    of the first frame, for error messages of chunked uploads.
+    """
+    if not isinstance(raw_landmarks, list):
+        raise LandmarkShapeError('Expected a list of frames.')
+    if max_frames is not None and len(raw_landmarks) > max_frames:
+        raise LandmarkShapeError(f'Too many frames ({len(raw_landmarks)}); at most {max_frames} are accepted.')
+
+    # 座標は平坦なリストに集める（タプルのリストより np.array への変換が速い）
+    values = []
+    extend = values.extend
+    for index, frame in enumerate(raw_landmarks, start=first_frame):
+        if not isinstance(frame, list):
+            raise LandmarkShapeError(f'Frame {index}: expected a list of poses.')
+        if not frame or not frame[0]:
+            continue  # 姿勢が検出されなかったフレーム
+        pose = frame[0]
+        if not isinstance(pose, list) or len(pose) != LANDMARK_COUNT:
+            found = len(pose) if isinstance(pose, list) else type(pose).__name__
+            raise LandmarkShapeError(f'Frame {index}: expected a pose of {LANDMARK_COUNT} landmarks, got {found}.')
+        try:
+            for lm in pose:
+                extend((lm['x'], lm['y'], lm['z'], lm.get('visibility', 0.0)))
+        except (KeyError, TypeError, AttributeError):
+            raise LandmarkShapeError(f'Frame {index}: every landmark must be an object with x, y and z (and optionally visibility).')
+
+    # np.array は '0.5' や True も数値に変換してしまうので、変換前に実数だけであることを確認する
+    # （値ごとではなく出てきた型ごとに調べる）
+    for kind in set(map(type, values)):
+        if not issubclass(kind, (int, float)) or issubclass(kind, bool):
+            raise LandmarkShapeError('Landmark coordinates must be numbers.')
+    try:
+        array = np.array(values, dtype=np.float64).reshape(-1, LANDMARK_COUNT, len(CHANNELS))
+    except OverflowError:
+        raise LandmarkShapeError('Landmark coordinates must be finite numbers.')
+    if not np.isfinite(array).all():
+        raise LandmarkShapeError('Landmark coordinates must be finite numbers.')
+    return array
+
+
+def iter_landmark_chunks(frames, chunk_frames=256, max_frames=None):
+    """
+    Groups an iterable of uploaded `raw_landmarks` frames (each a list of poses) into validated
+    (n, LANDMARK_COUNT, 4) arrays of at most `chunk_frames` frames, so a session can be
+    processed without materialising it as a whole. Raises LandmarkShapeError like validate_landmarks.
+    """
+    chunk = []
+    start = 0
+    for frame in frames:
+        chunk.append(frame)
+        if max_frames is not None and start + len(chunk) > max_frames:
+            raise LandmarkShapeError(f'Too many frames; at most {max_frames} are accepted.')
+        if len(chunk) >= chunk_frames:
+            yield validate_landmarks(chunk, first_frame=start)
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield validate_landmarks(chunk, first_frame=start)
+
+
+def array_to_landmarks(array):
+    """Inverse of `landmarks_to_array`: rebuilds the `raw_landmarks` JSON structure."""
+    return [
+        [[dict(zip(CHANNELS, landmark)) for landmark in frame]]
+        for frame in np.asarray(array, dtype=np.float64).tolist()
+    ]
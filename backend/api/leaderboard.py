@@ -0,0 +1,410 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from sortedcontainers import SortedList
+
+from .models import User, Score, UserChallengeBest
+
+logger = logging.getLogger(__name__)
+
+
+# --- Maintenance ---
+
+def record_best_score(score):
+    """Raises the user's best for the score's challenge if the new score beats it."""
+    user_id, challenge_id, value = score.user_id, score.challenge_id, score.overall_score
+
+    def raise_best():
+        return UserChallengeBest.objects.filter(
+            user_id=user_id, challenge_id=challenge_id, best_score__lt=value
+        ).update(best_score=value, score=score, updated_at=timezone.now())
+
+    if raise_best():
+        return
+    _, created = UserChallengeBest.objects.get_or_create(
+        user_id=user_id, challenge_id=challenge_id,
+        defaults={'best_score': value, 'score': score},
+    )
+    if not created:
+        # 同時に別のスコアが行を作成した場合に備えて、もう一度条件付きで更新する
+        raise_best()
+
+
+def refresh_user_best(user_id, challenge_id):
+    """Recomputes one user's best from the Score table (after deletions or rescoring)."""
+    best = Score.objects.filter(user_id=user_id, challenge_id=challenge_id).order_by('-overall_score', 'id').first()
+    if best is None:
+        UserChallengeBest.objects.filter(user_id=user_id, challenge_id=challenge_id).delete()
+        return
+    UserChallengeBest.objects.update_or_create(
+        user_id=user_id, challenge_id=challenge_id,
+        defaults={'best_score': best.overall_score, 'score': best, 'updated_at': timezone.now()},
+    )
+
+
+@transaction.atomic
+def rebuild_user_bests(challenge_id=None):
+    """Rebuilds the best-score table from scratch (optionally for one challenge)."""
+    scores = Score.objects.all()
+    bests = UserChallengeBest.objects.all()
+    if challenge_id is not None:
+        scores = scores.filter(challenge_id=challenge_id)
+        bests = bests.filter(challenge_id=challenge_id)
+    bests.delete()
+
+    # (user, challenge) ごとに最高スコアの行が先頭に来るよう並べ、先頭だけを拾う
+    rows = scores.order_by('user_id', 'challenge_id', '-overall_score', 'id')\
+        .values_list('id', 'user_id', 'challenge_id', 'overall_score')
+    bests = []
+    last_key = None
+    for score_id, user_id, challenge_id, overall_score in rows.iterator(chunk_size=2000):
+        if (user_id, challenge_id) == last_key:
+            continue
+        last_key = (user_id, challenge_id)
+        bests.append(UserChallengeBest(
+            user_id=user_id, challenge_id=challenge_id, best_score=overall_score, score_id=score_id,
+        ))
+    UserChallengeBest.objects.bulk_create(bests, batch_size=1000)
+    transaction.on_commit(lambda: leaderboard_backend.invalidate())
+
+
+# --- Query backends ---
+
+class BaseLeaderboard:
+    """
+    Leaderboard queries over UserChallengeBest. Entries are dicts (rank, user_id, score);
+    tied scores share a rank (1 + number of strictly higher bests).
+    """
+
+    def __init__(self, sync_interval, resync_interval):
+        self.sync_interval = sync_interval
+        self.resync_interval = resync_interval
+
+    def top(self, challenge_id, limit=10):
+        raise NotImplementedError
+
+    def rank(self, user_id, challenge_id):
+        """Returns the user's entry, or None if the user has not played the challenge."""
+        raise NotImplementedError
+
+    def neighborhood(self, user_id, challenge_id, radius=2):
+        """Entries of up to `radius` users directly above and below the user."""
+        raise NotImplementedError
+
+    def total_participants(self, challenge_id):
+        raise NotImplementedError
+
+    def sync_user(self, user_id, challenge_id):
+        """Called after a user's best has changed in the database."""
+
+    def refresh(self, challenge_id):
+        """Brings the challenge up to date with the database right now (before caching a response)."""
+
+    def invalidate(self):
+        """Drops any in-memory state (after bulk changes to UserChallengeBest)."""
+
+    def warm(self, challenge_ids=None):
+        """Loads in-memory state ahead of the first query. Backends without one have nothing to load."""
+
+    def warm_in_background(self):
+        """Runs `warm` in a daemon thread so server startup does not wait for it (see config/asgi.py)."""
+        def run():
+            try:
+                started = time.perf_counter()
+                self.warm()
+                logger.info("Leaderboard warmed in %.2f seconds.", time.perf_counter() - started)
+            except Exception as e:
+                # 読み込めなかったボードは従来どおり最初の問い合わせで読み込まれる
+                logger.exception("Leaderboard warm-up failed: %s", e)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run, name='leaderboard-warm', daemon=True)
+        thread.start()
+        return thread
+
+    def check_consistency(self, challenge_id=None):
+        """
+        Compares the in-memory state of this process with UserChallengeBest and returns the
+        (challenge_id, user_id, expected, actual) rows that differ. Backends without one have nothing to check.
+        """
+        return []
+
+
+class DatabaseLeaderboard(BaseLeaderboard):
+    """Answers every query with indexed SQL on UserChallengeBest."""
+
+    def _rank_of(self, challenge_id, best_score):
+        return UserChallengeBest.objects.filter(challenge_id=challenge_id, best_score__gt=best_score).count() + 1
+
+    def _entries(self, challenge_id, rows):
+        entries = []
+        for user_id, best_score in rows:
+            if entries and entries[-1]['score'] == best_score:
+                rank = entries[-1]['rank']
+            else:
+                rank = self._rank_of(challenge_id, best_score)
+            entries.append({"rank": rank, "user_id": user_id, "score": best_score})
+        return entries
+
+    def _ordered(self, challenge_id):
+        return UserChallengeBest.objects.filter(challenge_id=challenge_id).order_by('-best_score', 'user_id')
+
+    def top(self, challenge_id, limit=10):
+        rows = self._ordered(challenge_id).values_list('user_id', 'best_score')[:limit]
+        entries = []
+        for i, (user_id, best_score) in enumerate(rows):
+            rank = entries[-1]['rank'] if entries and entries[-1]['score'] == best_score else i + 1
+            entries.append({"rank": rank, "user_id": user_id, "score": best_score})
+        return entries
+
+    def rank(self, user_id, challenge_id):
+        best = UserChallengeBest.objects.filter(user_id=user_id, challenge_id=challenge_id)\
+            .values_list('best_score', flat=True).first()
+        if best is None:
+            return None
+        return {"rank": self._rank_of(challenge_id, best), "user_id": int(user_id), "score": best}
+
+    def neighborhood(self, user_id, challenge_id, radius=2):
+        me = self.rank(user_id, challenge_id)
+        if me is None:
+            return []
+        board = self._ordered(challenge_id)
+        # 並び順 (-best_score, user_id) で自分より前 / 後ろの行
+        above = board.filter(Q(best_score__gt=me['score']) | Q(best_score=me['score'], user_id__lt=me['user_id']))
+        below = board.filter(Q(best_score__lt=me['score']) | Q(best_score=me['score'], user_id__gt=me['user_id']))
+        above_rows = list(above.order_by('best_score', '-user_id').values_list('user_id', 'best_score')[:radius])[::-1]
+        below_rows = list(below.values_list('user_id', 'best_score')[:radius])
+        rows = above_rows + [(me['user_id'], me['score'])] + below_rows
+        return self._entries(challenge_id, rows)
+
+    def total_participants(self, challenge_id):
+        return UserChallengeBest.objects.filter(challenge_id=challenge_id).count()
+
+
+class _ChallengeBoard:
+    """Order-statistics view of one challenge: keys (-best_score, user_id) in a SortedList."""
+    __slots__ = ('keys', 'scores', 'loaded_at', 'synced_at', 'synced_until')
+
+    def __init__(self):
+        self.keys = SortedList()
+        self.scores = {}
+
+    def set(self, user_id, best_score):
+        old = self.scores.get(user_id)
+        if old == best_score:
+            return
+        if old is not None:
+            self.keys.remove((-old, user_id))
+        self.scores[user_id] = best_score
+        self.keys.add((-best_score, user_id))
+
+    def discard(self, user_id):
+        old = self.scores.pop(user_id, None)
+        if old is not None:
+            self.keys.remove((-old, user_id))
+
+    def rank_of(self, best_score):
+        # 自分より高いスコアのキーは (-best_score, -inf) より前に並ぶ
+        return self.keys.bisect_left((-best_score, float('-inf'))) + 1
+
+    def entries(self, start, stop):
+        entries = []
+        for neg_score, user_id in self.keys.islice(max(start, 0), stop):
+            if entries and entries[-1]['score'] == -neg_score:
+                rank = entries[-1]['rank']
+            else:
+                rank = self.rank_of(-neg_score)
+            entries.append({"rank": rank, "user_id": user_id, "score": -neg_score})
+        return entries
+
+
+class MemoryLeaderboard(BaseLeaderboard):
+    """
+    Per-process leaderboard kept in memory (O(log n) rank / top-N / neighborhood queries).
+
+    A challenge is loaded from the database on first use. Saves made in this process are
+    applied right after commit; saves made by other workers are picked up by a delta sync
+    on UserChallengeBest.updated_at at most every `sync_interval` seconds, and the whole
+    board is reloaded every `resync_interval` seconds (this also catches deleted rows).
+    """
+    # 他トランザクションのコミット遅延で updated_at の取りこぼしが起きないよう、少し遡って同期する
+    SYNC_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self, sync_interval, resync_interval):
+        super().__init__(sync_interval, resync_interval)
+        self._boards = {}
+        # チャレンジごとのロック。読み込み・同期中のDBアクセスで他のチャレンジの問い合わせを待たせない
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+        # invalidate() のたびに進める。invalidate 前に読み込み始めたボードは保存しない
+        self._generation = 0
+
+    def _challenge_lock(self, challenge_id):
+        with self._registry_lock:
+            lock = self._locks.get(challenge_id)
+            if lock is None:
+                lock = self._locks[challenge_id] = threading.Lock()
+            return lock
+
+    def _load(self, challenge_id):
+        generation = self._generation
+        board = _ChallengeBoard()
+        board.synced_until = timezone.now()
+        rows = UserChallengeBest.objects.filter(challenge_id=challenge_id).values_list('user_id', 'best_score')
+        for user_id, best_score in rows.iterator(chunk_size=5000):
+            board.scores[user_id] = best_score
+        board.keys.update((-best_score, user_id) for user_id, best_score in board.scores.items())
+        board.loaded_at = board.synced_at = time.monotonic()
+        with self._registry_lock:
+            if generation == self._generation:
+                self._boards[challenge_id] = board
+        return board
+
+    def _sync(self, challenge_id, board):
+        since = board.synced_until - self.SYNC_OVERLAP
+        board.synced_until = timezone.now()
+        rows = UserChallengeBest.objects.filter(challenge_id=challenge_id, updated_at__gte=since)\
+            .values_list('user_id', 'best_score')
+        for user_id, best_score in rows:
+            board.set(user_id, best_score)
+        board.synced_at = time.monotonic()
+
+    def _board(self, challenge_id):
+        """Returns the challenge's board, loading or syncing it as needed. Call with the challenge's lock held."""
+        board = self._boards.get(challenge_id)
+        now = time.monotonic()
+        if board is None or now - board.loaded_at > self.resync_interval:
+            return self._load(challenge_id)
+        if now - board.synced_at > self.sync_interval:
+            self._sync(challenge_id, board)
+        return board
+
+    def refresh(self, challenge_id):
+        challenge_id = int(challenge_id)
+        with self._challenge_lock(challenge_id):
+            board = self._boards.get(challenge_id)
+            if board is not None:
+                self._sync(challenge_id, board)
+
+    def warm(self, challenge_ids=None):
+        """Loads the given challenges (default: every challenge with at least one score)."""
+        if challenge_ids is None:
+            challenge_ids = UserChallengeBest.objects.values_list('challenge_id', flat=True).distinct()
+        for challenge_id in challenge_ids:
+            with self._challenge_lock(int(challenge_id)):
+                self._load(int(challenge_id))
+
+    def top(self, challenge_id, limit=10):
+        challenge_id = int(challenge_id)
+        with self._challenge_lock(challenge_id):
+            return self._board(challenge_id).entries(0, limit)
+
+    def rank(self, user_id, challenge_id):
+        user_id, challenge_id = int(user_id), int(challenge_id)
+        with self._challenge_lock(challenge_id):
+            board = self._board(challenge_id)
+            best = board.scores.get(user_id)
+            if best is None:
+                return None
+            return {"rank": board.rank_of(best), "user_id": user_id, "score": best}
+
+    def neighborhood(self, user_id, challenge_id, radius=2):
+        user_id, challenge_id = int(user_id), int(challenge_id)
+        with self._challenge_lock(challenge_id):
+            board = self._board(challenge_id)
+            best = board.scores.get(user_id)
+            if best is None:
+                return []
+            index = board.keys.index((-best, user_id))
+            return board.entries(index - radius, index + radius + 1)
+
+    def total_participants(self, challenge_id):
+        challenge_id = int(challenge_id)
+        with self._challenge_lock(challenge_id):
+            return len(self._board(challenge_id).keys)
+
+    def sync_user(self, user_id, challenge_id):
+        user_id, challenge_id = int(user_id), int(challenge_id)
+        with self._challenge_lock(challenge_id):
+            board = self._boards.get(challenge_id)
+            if board is None:
+                return  # 未ロードのチャレンジは初回アクセス時に読み込む
+            best = UserChallengeBest.objects.filter(user_id=user_id, challenge_id=challenge_id)\
+                .values_list('best_score', flat=True).first()
+            if best is None:
+                board.discard(user_id)
+            else:
+                board.set(user_id, best)
+
+    def invalidate(self):
+        with self._registry_lock:
+            self._generation += 1
+            self._boards.clear()
+
+    def check_consistency(self, challenge_id=None):
+        """
+        Checks the boards this process has loaded (it never loads one just to check it). Each board is
+        delta-synced first, so what remains is drift the periodic sync would not repair before the next reload.
+        """
+        if challenge_id is None:
+            with self._registry_lock:
+                challenge_ids = list(self._boards)
+        else:
+            challenge_ids = [int(challenge_id)]
+        mismatches = []
+        for cid in challenge_ids:
+            with self._challenge_lock(cid):
+                board = self._boards.get(cid)
+                if board is None:
+                    continue
+                self._sync(cid, board)
+                expected = dict(UserChallengeBest.objects.filter(challenge_id=cid).values_list('user_id', 'best_score'))
+                for user_id in sorted(expected.keys() | board.scores.keys()):
+                    if expected.get(user_id) != board.scores.get(user_id):
+                        mismatches.append((cid, user_id, expected.get(user_id), board.scores.get(user_id)))
+        return mismatches
+
+
+def check_best_scores(challenge_id=None):
+    """Compares UserChallengeBest with the Score table; returns (challenge_id, user_id, expected, actual) rows."""
+    scores = Score.objects.all()
+    bests = UserChallengeBest.objects.all()
+    if challenge_id is not None:
+        scores = scores.filter(challenge_id=challenge_id)
+        bests = bests.filter(challenge_id=challenge_id)
+
+    expected = {
+        (row['challenge_id'], row['user_id']): row['best']
+        for row in scores.values('challenge_id', 'user_id').annotate(best=Max('overall_score'))
+    }
+    actual = {(cid, uid): best for cid, uid, best in bests.values_list('challenge_id', 'user_id', 'best_score')}
+    return [
+        (cid, uid, expected.get((cid, uid)), actual.get((cid, uid)))
+        for cid, uid in sorted(expected.keys() | actual.keys())
+        if expected.get((cid, uid)) != actual.get((cid, uid))
+    ]
+
+
+def attach_user_names(entries):
+    """Adds `user_name` to leaderboard entries with a single query."""
+    names = dict(User.objects.filter(pk__in=[entry['user_id'] for entry in entries]).values_list('id', 'name'))
+    for entry in entries:
+        entry['user_name'] = names.get(entry['user_id'])
+    return entries
+
+
+LEADERBOARD_BACKENDS = {
+    'database': DatabaseLeaderboard,
+    'memory': MemoryLeaderboard,
+}
+
+leaderboard_backend = LEADERBOARD_BACKENDS[settings.LEADERBOARD_BACKEND](
+    sync_interval=settings.LEADERBOARD_SYNC_INTERVAL,
+    resync_interval=settings.LEADERBOARD_RESYNC_INTERVAL,
+)
@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from dotenv import load_dotenv
+from google import genai
+from google.genai import errors, types
+
+from .instrumentation import LLM_TOKENS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの期限切れ直前に使わないよう、この秒数だけ早めに作り直す
+CONTEXT_CACHE_REFRESH_MARGIN = 60
+
+
+def is_context_cache_error(error):
+    """
+    True when a ClientError means the context cache itself is unusable (deleted, expired, not ours):
+    only then is the request retried without it. Other client errors (quota, invalid request) are raised.
+    """
+    if error.code == 404:
+        return True
+    message = f'{error.message or ""} {error.details or ""}'.lower()
+    return error.code in (400, 403) and ('cachedcontent' in message or 'cached content' in message)
+
+
+class GeminiClient:
+    """
+    Generates text with Google Gemini Flash.
+
+    One instance is shared per process: the underlying genai.Client (and its HTTP connection pool)
+    is created once and reused. The static system instruction of an AdvicePrompt is stored as a
+    context cache (settings.LLM_CONTEXT_CACHE), so each call only sends the per-score contents.
+    """
+    # モデル参照 https://ai.google.dev/gemini-api/docs/models?hl=ja&utm_source=chatgpt.com
+    model = "gemini-3-flash-preview"
+    backend = 'gemini'
+
+    def __init__(self):
+        self._client = None
+        self._context_caches = {}  # prompt version -> (cache name or None, refresh at)
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = genai.Client()
+            return self._client
+
+    def generate(self, prompt):
+        cache_name = self._context_cache(prompt) if settings.LLM_CONTEXT_CACHE else None
+        try:
+            response = self._generate(prompt, cache_name)
+        except errors.ClientError as e:
+            if cache_name is None or not is_context_cache_error(e):
+                raise
+            self._cache_rejected(prompt, cache_name, e)
+            response = self._generate(prompt, None)
+        self._record_usage(response.usage_metadata)
+        return response.text
+
+    def generate_stream(self, prompt):
+        """Yields the text in pieces as the streaming API returns them."""
+        cache_name = self._context_cache(prompt) if settings.LLM_CONTEXT_CACHE else None
+        started = False
+        try:
+            for piece in self._stream(prompt, cache_name):
+                started = True
+                yield piece
+        except errors.ClientError as e:
+            if cache_name is None or started or not is_context_cache_error(e):
+                raise
+            self._cache_rejected(prompt, cache_name, e)
+            yield from self._stream(prompt, None)
+
+    def _config(self, prompt, cache_name):
+        if cache_name is not None:
+            return types.GenerateContentConfig(cached_content=cache_name)
+        return types.GenerateContentConfig(system_instruction=prompt.system_instruction)
+
+    def _generate(self, prompt, cache_name):
+        return self.client.models.generate_content(
+            model=self.model, contents=prompt.contents, config=self._config(prompt, cache_name),
+        )
+
+    def _stream(self, prompt, cache_name):
+        usage = None
+        for response in self.client.models.generate_content_stream(
+            model=self.model, contents=prompt.contents, config=self._config(prompt, cache_name),
+        ):
+            # 使用量は累積値で届くため、最後のものを記録する
+            usage = response.usage_metadata or usage
+            if response.text:
+                yield response.text
+        self._record_usage(usage)
+
+    def _cache_rejected(self, prompt, cache_name, error):
+        # キャッシュが削除・失効していた場合は作り直しを待たず、system_instruction を直接送って再試行する
+        logger.warning("Context cache %s rejected (%s); retrying without it.", cache_name, error)
+        self._forget(prompt.version)
+
+    def _context_cache(self, prompt):
+        """Returns the name of the context cache holding the prompt's system instruction (None if unavailable)."""
+        with self._lock:
+            entry = self._context_caches.get(prompt.version)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+
+        ttl = settings.LLM_CONTEXT_CACHE_TTL
+        try:
+            cache = self.client.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=prompt.system_instruction,
+                    display_name=f'runway-advice-{prompt.version[:12]}',
+                    ttl=f'{ttl}s',
+                ),
+            )
+            name = cache.name
+        except errors.APIError as e:
+            # 最小トークン数に満たない等で作れない場合は、TTL の間は作成を試みずに直接送る
+            logger.info("Context cache unavailable (%s); sending the system instruction inline.", e)
+            name = None
+
+        with self._lock:
+            # ナレッジが更新されたら古い版は使わない（サーバ側では TTL で消える）
+            self._context_caches = {prompt.version: (name, time.monotonic() + max(0, ttl - CONTEXT_CACHE_REFRESH_MARGIN))}
+        return name
+
+    def _forget(self, version):
+        with self._lock:
+            self._context_caches.pop(version, None)
+
+    def _record_usage(self, usage):
+        if usage is None:
+            return
+        for kind, count in (
+            ('prompt', usage.prompt_token_count),
+            ('completion', usage.candidates_token_count),
+            ('cached', usage.cached_content_token_count),
+            ('thoughts', usage.thoughts_token_count),
+        ):
+            if count:
+                LLM_TOKENS.inc(count, backend=self.backend, kind=kind)
+
+
+class FakeLLMClient:
+    """Local stand-in for the LLM used in development and tests; never touches the network."""
+    backend = 'fake'
+    text = "## 🚀 未来を変えるウォーキング分析\n\n（これはローカル環境用のダミーアドバイスです。）"
+    # generate_stream で返す1片の文字数と、1片ごとに待つ秒数（ストリーミング表示の確認用）
+    stream_piece_length = 4
+    stream_delay = 0.05
+
+    def generate(self, prompt):
+        return self.text
+
+    def generate_stream(self, prompt):
+        for start in range(0, len(self.text), self.stream_piece_length):
+            time.sleep(self.stream_delay)
+            yield self.text[start:start + self.stream_piece_length]
+
+
+LLM_CLIENTS = {
+    'gemini': GeminiClient,
+    'fake': FakeLLMClient,
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Returns the long-lived client (one per process) for settings.LLM_BACKEND."""
+    backend = settings.LLM_BACKEND
+    with _clients_lock:
+        if backend not in _clients:
+            _clients[backend] = LLM_CLIENTS[backend]()
+        return _clients[backend]
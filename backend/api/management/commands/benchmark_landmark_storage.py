@@ -0,0 +1,79 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from api.landmark_codec import encode_landmarks, decode_landmarks, DTYPES, COMPRESSIONS, zstandard
+from api.landmarks import landmarks_to_array, array_to_landmarks
+from api.models import Score
+from api.synthetic import generate_walk
+
+class Command(BaseCommand):
+    help = 'Compares size and encode/decode throughput of the JSON and binary landmark layouts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=900, help='Frames per synthetic session')
+        parser.add_argument('--sessions', type=int, default=5, help='Number of sessions to measure')
+        parser.add_argument('--from-db', action='store_true', help='Use the latest stored scores instead of synthetic data')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable JSON')
+
+    def _load_sessions(self, options):
+        if not options['from_db']:
+            return [generate_walk(options['frames'], seed=seed) for seed in range(options['sessions'])]
+        scores = Score.objects.order_by('-id')[:options['sessions']]
+        return [score.landmark_array for score in scores]
+
+    def _measure(self, encode, decode, sessions):
+        start = time.perf_counter()
+        encoded = [encode(session) for session in sessions]
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for data in encoded:
+            decode(data)
+        decode_seconds = time.perf_counter() - start
+
+        frames = sum(len(session) for session in sessions)
+        size = sum(len(data) for data in encoded)
+        return {
+            'bytes_per_frame': round(size / frames, 1) if frames else 0,
+            'total_bytes': size,
+            'encode_frames_per_sec': round(frames / encode_seconds) if encode_seconds else None,
+            'decode_frames_per_sec': round(frames / decode_seconds) if decode_seconds else None,
+        }
+
+    def handle(self, *args, **options):
+        sessions = self._load_sessions(options)
+        if not sessions:
+            self.stderr.write('No sessions to measure.')
+            return
+
+        results = {
+            'json': self._measure(
+                lambda array: json.dumps(array_to_landmarks(array)).encode('utf-8'),
+                lambda data: landmarks_to_array(json.loads(data)),
+                sessions,
+            ),
+        }
+        for dtype in DTYPES:
+            for compression in COMPRESSIONS:
+                if compression == 'zstd' and zstandard is None:
+                    continue
+                results[f'{dtype}+{compression}'] = self._measure(
+                    lambda array, dtype=dtype, compression=compression: encode_landmarks(array, dtype, compression),
+                    decode_landmarks,
+                    sessions,
+                )
+
+        json_size = results['json']['total_bytes']
+        for result in results.values():
+            result['size_ratio'] = round(result['total_bytes'] / json_size, 4)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f'{"layout":<18}{"bytes/frame":>12}{"ratio":>8}{"enc frames/s":>14}{"dec frames/s":>14}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<18}{result["bytes_per_frame"]:>12}{result["size_ratio"]:>8.1%}'
+                f'{result["encode_frames_per_sec"]:>14,}{result["decode_frames_per_sec"]:>14,}'
+            )
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from api.leaderboard import leaderboard_backend
+from api.models import Challenge, Score
+from api.synthetic import populate_scores, delete_populated
+from api.user_stats import refresh_user_stats
+
+
+def _add_latency(seconds):
+    """Database execute wrapper that sleeps like a network round trip before every query."""
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+def _percentile(sorted_samples, fraction):
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures p50 / p99 latency of the read APIs (ranking, history, average comparison, dashboard, '
+        'result page) under concurrent requests through the ASGI handler, with the response cache disabled'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scores', type=int, default=20000, help='Synthetic scores in the benchmark challenge')
+        parser.add_argument('--scores-per-user', type=int, default=20)
+        parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated numbers of concurrent clients')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and concurrency level')
+        parser.add_argument(
+            '--query-latency', type=float, default=0.0,
+            help='Milliseconds added to every query, to emulate the round trip to a networked database (e.g. on SQLite)',
+        )
+        parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare against')
+        parser.add_argument('--output', default=None, help='Write the JSON results to this file')
+        parser.add_argument('--json', action='store_true', help='Print the JSON results instead of a summary')
+
+    def _urls(self, challenge, user_ids):
+        user_id = user_ids[len(user_ids) // 2]
+        score_id = Score.objects.filter(challenge=challenge, user_id=user_id).values_list('id', flat=True).first()
+        refresh_user_stats(user_id)
+        return {
+            'ranking': f'/api/ranking/?challenge={challenge.id}&user={user_id}',
+            'score_history': f'/api/scores/history/?user={user_id}&challenge={challenge.id}',
+            'average_comparison': f'/api/scores/average_comparison/?user={user_id}&challenge={challenge.id}',
+            'dashboard': f'/api/dashboard/?user={user_id}',
+            'result_page': f'/api/result/{score_id}/',
+        }
+
+    async def _measure(self, url, concurrency, requests):
+        client = AsyncClient()
+        remaining = iter(range(requests))
+        latencies = []
+
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'concurrency': concurrency,
+            'requests': requests,
+            'requests_per_sec': round(requests / elapsed, 1),
+            'p50_ms': round(_percentile(latencies, 0.5) * 1000, 2),
+            'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        }
+
+    def _install_latency(self, seconds):
+        wrapper = _add_latency(seconds)
+
+        def install(connection, **kwargs):
+            # 各スレッドの接続は初回のクエリで作られるため、作成時にラッパーを追加する。
+            # プール使用時は接続を取り出すたびに呼ばれるので、同じ接続に重ねて追加しない
+            if wrapper not in connection.execute_wrappers:
+                connection.execute_wrappers.append(wrapper)
+
+        connection_created.connect(install, weak=False)
+        install(connection)
+
+    def _compare(self, results, baseline):
+        lines = []
+        for endpoint, rows in results.items():
+            before = {row['concurrency']: row for row in baseline['results'].get(endpoint, [])}
+            for row in rows:
+                old = before.get(row['concurrency'])
+                if old is None:
+                    continue
+                lines.append(
+                    f"{endpoint:>18} x{row['concurrency']:<3} "
+                    f"p50 {old['p50_ms']} -> {row['p50_ms']} ms  p99 {old['p99_ms']} -> {row['p99_ms']} ms"
+                )
+        return lines
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['concurrency'].split(',') if level]
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'db_workers': settings.DB_WORKERS,
+                'db_pool': settings.DATABASES['default'].get('OPTIONS', {}).get('pool'),
+                'conn_max_age': settings.DATABASES['default'].get('CONN_MAX_AGE', 0),
+                'leaderboard_backend': settings.LEADERBOARD_BACKEND,
+                'scores': options['scores'],
+                'query_latency_ms': options['query_latency'],
+            },
+            'results': {},
+        }
+
+        # リクエストは別スレッドの接続で処理されるため、計測用のデータはコミットしてから最後に削除する
+        challenge = Challenge.objects.create(name=f'benchmark-read-{time.time_ns()}', description='benchmark')
+        try:
+            user_ids = populate_scores(challenge, options['scores'], options['scores_per_user'])
+            urls = self._urls(challenge, user_ids)
+            leaderboard_backend.invalidate()
+            if options['query_latency']:
+                self._install_latency(options['query_latency'] / 1000)
+            # レスポンスキャッシュは無効にして、ビューの処理そのものを測る
+            with override_settings(RESPONSE_CACHE_ENABLED=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for endpoint, url in urls.items():
+                    # 1回目はリーダーボードの読み込みなどを含むため計測しない
+                    asyncio.run(self._measure(url, 1, 1))
+                    report['results'][endpoint] = [
+                        asyncio.run(self._measure(url, level, options['requests'])) for level in levels
+                    ]
+                    self.stderr.write(f'  {endpoint} done')
+        finally:
+            delete_populated(challenge)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        if options['json']:
+            self.stdout.write(output)
+            return
+
+        if baseline is not None:
+            for line in self._compare(report['results'], baseline):
+                self.stdout.write(line)
+            return
+        for endpoint, rows in report['results'].items():
+            for row in rows:
+                self.stdout.write(
+                    f"{endpoint:>18} x{row['concurrency']:<3} {row['requests_per_sec']:>8} req/s  "
+                    f"p50 {row['p50_ms']} ms  p99 {row['p99_ms']} ms"
+                )
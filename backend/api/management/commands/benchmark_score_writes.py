@@ -0,0 +1,150 @@
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from api.db_executor import run_db
+from api.management.commands.benchmark_read_apis import _add_latency
+from api.landmarks import array_to_landmarks
+from api.metrics import score_frames
+from api.models import User, Challenge, Score
+from api.serializers import ScoreSerializer
+from api.synthetic import generate_walk
+
+
+def _shared_thread(fn, *args, **kwargs):
+    # 従来の書き込み経路: uvicorn ワーカー内の1本の共有スレッドで順番に実行される
+    return sync_to_async(fn, thread_sensitive=True)(*args, **kwargs)
+
+
+MODES = {
+    'shared_thread': _shared_thread,
+    'db_pool': run_db,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures score write throughput (validation + save) at several concurrency levels, '
+        'through the shared thread_sensitive thread and through the database thread pool. '
+        'Writes are spread over --users users and every measurement starts from an empty challenge'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,2,4,8,16', help='Comma-separated numbers of concurrent writers')
+        parser.add_argument('--writes', type=int, default=200, help='Scores written per measurement')
+        parser.add_argument('--frames', type=int, default=150, help='Frames per synthetic session')
+        parser.add_argument('--users', type=int, default=16, help='Users the writes are spread over (round robin)')
+        parser.add_argument('--mode', choices=[*MODES, 'all'], default='all')
+        parser.add_argument(
+            '--query-latency', type=float, default=0.0,
+            help='Milliseconds added to every query, to emulate the round trip to a networked database',
+        )
+        parser.add_argument('--json', action='store_true', help='Print machine-readable JSON')
+
+    def _write(self, payload, frames, results):
+        serializer = ScoreSerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        serializer.validated_data.pop('landmark_array')
+        chart_data, detailed_results, overall_score = results
+        # save_scored と同じくシグナルによる集計の更新まで1トランザクションで行う（フィードバック生成は対象外）
+        with transaction.atomic():
+            return serializer.save(
+                landmark_array=frames,
+                chart_data=chart_data,
+                detailed_results=detailed_results,
+                overall_score=overall_score,
+                feedback_status=Score.FeedbackStatus.DONE,
+            )
+
+    def _install_latency(self, seconds):
+        wrapper = _add_latency(seconds)
+
+        def install(connection, **kwargs):
+            # プール使用時は接続を取り出すたびに呼ばれるため、同じスレッドの接続に重ねて追加しない
+            if wrapper not in connection.execute_wrappers:
+                connection.execute_wrappers.append(wrapper)
+
+        connection_created.connect(install, weak=False)
+        install(connection)
+
+    async def _measure(self, run, concurrency, writes, payloads, frames, results):
+        remaining = iter(range(writes))
+        latencies = []
+
+        async def writer():
+            for index in remaining:
+                start = time.perf_counter()
+                await run(self._write, payloads[index % len(payloads)], frames, results)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(writer() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'concurrency': concurrency,
+            'writes': writes,
+            'writes_per_sec': round(writes / elapsed, 1),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        }
+
+    def handle(self, *args, **options):
+        prefix = f'benchmark-writes-{time.time_ns()}'
+        users = [User.objects.create(name=f'{prefix}-{i}') for i in range(options['users'])]
+        challenge = Challenge.objects.create(name=prefix, description='benchmark')
+        frames = generate_walk(options['frames'])
+        video_duration = options['frames'] / 30
+        landmarks = array_to_landmarks(frames)
+        payloads = [
+            {'user': user.id, 'challenge': challenge.id, 'video_duration': video_duration, 'raw_landmarks': landmarks}
+            for user in users
+        ]
+        results = score_frames(frames, video_duration)
+        modes = list(MODES) if options['mode'] == 'all' else [options['mode']]
+        levels = [int(level) for level in options['concurrency'].split(',') if level]
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'db_workers': settings.DB_WORKERS,
+                'db_pool': settings.DATABASES['default'].get('OPTIONS', {}).get('pool'),
+                'frames': options['frames'],
+                'users': options['users'],
+                'query_latency_ms': options['query_latency'],
+            },
+            'results': {},
+        }
+        if options['query_latency']:
+            self._install_latency(options['query_latency'] / 1000)
+        try:
+            for mode in modes:
+                report['results'][mode] = []
+                for level in levels:
+                    # 計測ごとに同じ状態（スコアなし）から始め、テーブルの増加による差を出さない
+                    Score.objects.filter(challenge=challenge).delete()
+                    report['results'][mode].append(
+                        asyncio.run(self._measure(MODES[mode], level, options['writes'], payloads, frames, results))
+                    )
+        finally:
+            # 計測で作成したスコアはユーザーごと削除する
+            for user in users:
+                user.delete()
+            challenge.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for mode, rows in report['results'].items():
+            for row in rows:
+                self.stdout.write(
+                    f"{mode:>13} x{row['concurrency']:<3} {row['writes_per_sec']:>8} writes/s  "
+                    f"p50 {row['p50_ms']} ms  p99 {row['p99_ms']} ms"
+                )
@@ -0,0 +1,215 @@
+import json
+import platform
+import statistics
+import time
+import django
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from api.landmarks import array_to_landmarks
+from api.leaderboard import leaderboard_backend
+from api.models import User, Challenge, Score
+from api.serializers import ScoreSerializer
+from api.services import ScoringService
+from api.synthetic import generate_walk, populate_scores, delete_populated
+from api.user_stats import refresh_user_stats
+from api.views import RankingAPIView, DashboardAPIView
+
+
+def _parse_ints(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def _timings(fn, repeat, setup=None):
+    """Runs `fn` `repeat` times (untimed `setup` result passed in); returns summary statistics in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'repeat': repeat,
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks scoring (calculate_all with a stubbed LLM), serializer validation, DB save and the '
+        'ranking / dashboard endpoints on synthetic data; all benchmark data is removed afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', default='150,900,3600', help='Comma-separated session lengths (frames)')
+        parser.add_argument('--fps', type=int, default=30)
+        parser.add_argument('--sway', type=float, default=0.01, help='Sideways sway amplitude (normalized x)')
+        parser.add_argument('--trunk-tilt', type=float, default=0.0, help='Trunk lean in degrees')
+        parser.add_argument('--shoulder-tilt', type=float, default=0.0, help='Shoulder line tilt in degrees')
+        parser.add_argument('--dropout', type=float, default=0.0, help='Fraction of landmarks with low visibility')
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated score counts for the endpoint benchmarks (e.g. up to 1000000)')
+        parser.add_argument('--scores-per-user', type=int, default=20, help='Average number of scores per synthetic user')
+        parser.add_argument('--repeat', type=int, default=5, help='Repetitions per measurement')
+        parser.add_argument('--skip-endpoints', action='store_true', help='Only run the per-session benchmarks')
+        parser.add_argument('--output', default=None, help='Write the JSON results to this file')
+        parser.add_argument('--json', action='store_true', help='Print the JSON results instead of a summary')
+
+    # --- Helpers ---
+
+    def _session(self, frames, options, seed=0):
+        return generate_walk(
+            frames=frames,
+            fps=options['fps'],
+            seed=seed,
+            sway_amplitude=options['sway'],
+            trunk_tilt=options['trunk_tilt'],
+            shoulder_tilt=options['shoulder_tilt'],
+            dropout_rate=options['dropout'],
+        )
+
+    def _meta(self, options):
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'numpy': np.__version__,
+            'database': connection.vendor,
+            'machine': platform.machine(),
+            'generator': {
+                key: options[key] for key in ('fps', 'sway', 'trunk_tilt', 'shoulder_tilt', 'dropout')
+            },
+        }
+
+    # --- Benchmarks ---
+
+    def _bench_sessions(self, options, user, challenge):
+        results = []
+        for frames in _parse_ints(options['frames']):
+            array = self._session(frames, options)
+            raw_landmarks = array_to_landmarks(array)
+            video_duration = frames / options['fps']
+            payload = {
+                'user': user.id,
+                'challenge': challenge.id,
+                'video_duration': video_duration,
+                'raw_landmarks': raw_landmarks,
+            }
+
+            def validate():
+                serializer = ScoreSerializer(data=payload)
+                serializer.is_valid(raise_exception=True)
+                return serializer
+
+            service = ScoringService(raw_landmarks, video_duration)
+            service.calculate_metrics()
+
+            def validated():
+                serializer = validate()
+                serializer.validated_data.pop('landmark_array')
+                return serializer
+
+            def save(serializer):
+                serializer.save(
+                    landmark_array=service.landmark_array,
+                    chart_data=service.chart_data,
+                    detailed_results=service.detailed_results,
+                    overall_score=service.overall_score,
+                    feedback_status=Score.FeedbackStatus.DONE,
+                )
+
+            results.append({
+                'frames': frames,
+                'calculate_all': _timings(lambda: ScoringService(raw_landmarks, video_duration).calculate_all(), options['repeat']),
+                'calculate_metrics': _timings(lambda: ScoringService(raw_landmarks, video_duration).calculate_metrics(), options['repeat']),
+                'serializer_validation': _timings(validate, options['repeat']),
+                'db_save': _timings(save, options['repeat'], setup=validated),
+            })
+            self.stderr.write(f'  sessions: {frames} frames done')
+        return results
+
+    def _bench_endpoints(self, options, challenge):
+        factory = APIRequestFactory()
+        # 非同期ビューのため、呼び出しごとにイベントループを回して完了を待つ
+        ranking_view = async_to_sync(RankingAPIView.as_view())
+        dashboard_view = async_to_sync(DashboardAPIView.as_view())
+
+        results = []
+        created = 0
+        for size in sorted(_parse_ints(options['sizes'])):
+            start = time.perf_counter()
+            user_ids = populate_scores(challenge, size, options['scores_per_user'], created)
+            populate_seconds = time.perf_counter() - start
+            created = size
+
+            user_id = user_ids[len(user_ids) // 2]
+            refresh_user_stats(user_id)
+            leaderboard_backend.invalidate()
+
+            def ranking():
+                response = ranking_view(factory.get('/api/ranking/', {'challenge': challenge.id, 'user': user_id}))
+                assert response.status_code == 200, response.data
+
+            def dashboard():
+                response = dashboard_view(factory.get('/api/dashboard/', {'user': user_id}))
+                assert response.status_code == 200, response.data
+
+            # 1回目はリーダーボードの読み込みを含む
+            first_ranking = _timings(ranking, 1)
+            results.append({
+                'scores': size,
+                'users': len(user_ids),
+                'populate_seconds': round(populate_seconds, 3),
+                'ranking_first_request': first_ranking,
+                'ranking': _timings(ranking, options['repeat']),
+                'dashboard': _timings(dashboard, options['repeat']),
+            })
+            self.stderr.write(f'  endpoints: {size} scores done')
+        return results
+
+    def handle(self, *args, **options):
+        results = {'meta': self._meta(options)}
+
+        # LLM はダミーに差し替え、レスポンスキャッシュは無効にして実際の処理時間を測る
+        with override_settings(LLM_BACKEND='fake', RESPONSE_CACHE_ENABLED=False):
+            with transaction.atomic():
+                user = User.objects.create(name=f'benchmark-session-{time.time_ns()}')
+                challenge = Challenge.objects.create(name=f'benchmark-{time.time_ns()}', description='benchmark')
+                results['sessions'] = self._bench_sessions(options, user, challenge)
+                # 計測用のデータはすべて破棄する
+                transaction.set_rollback(True)
+
+            if not options['skip_endpoints']:
+                # ビューのクエリは DB 用スレッドの別接続で実行されるため、データはコミットしてから最後に削除する
+                challenge = Challenge.objects.create(name=f'benchmark-{time.time_ns()}', description='benchmark')
+                try:
+                    results['endpoints'] = self._bench_endpoints(options, challenge)
+                finally:
+                    delete_populated(challenge)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        if options['json']:
+            self.stdout.write(output)
+            return
+
+        for row in results['sessions']:
+            self.stdout.write(
+                f"{row['frames']:>6} frames: calculate_all {row['calculate_all']['median_ms']} ms, "
+                f"validation {row['serializer_validation']['median_ms']} ms, save {row['db_save']['median_ms']} ms"
+            )
+        for row in results.get('endpoints', []):
+            self.stdout.write(
+                f"{row['scores']:>8} scores: ranking {row['ranking']['median_ms']} ms "
+                f"(first {row['ranking_first_request']['median_ms']} ms), dashboard {row['dashboard']['median_ms']} ms"
+            )
@@ -0,0 +1,57 @@
+import random
+from django.core.management.base import BaseCommand
+from api.leaderboard import (
+    DatabaseLeaderboard,
+    MemoryLeaderboard,
+    check_best_scores,
+    rebuild_user_bests,
+)
+from api.models import UserChallengeBest
+
+
+class Command(BaseCommand):
+    help = 'Checks the best-score table against Score and the in-memory leaderboard against SQL ranks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--challenge', type=int, default=None, help='Only check this challenge')
+        parser.add_argument('--sample', type=int, default=100, help='Number of users per challenge whose rank is compared')
+        parser.add_argument('--fix', action='store_true', help='Rebuild UserChallengeBest from Score when it has drifted')
+
+    def handle(self, *args, **options):
+        challenge_id = options['challenge']
+
+        # 1. UserChallengeBest と Score の最高点が一致するか
+        drift = check_best_scores(challenge_id)
+        for cid, user_id, expected, actual in drift[:20]:
+            self.stdout.write(f'Challenge {cid} / user {user_id}: expected {expected}, stored {actual}')
+        if drift and options['fix']:
+            rebuild_user_bests(challenge_id)
+            self.stdout.write(self.style.WARNING(f'Rebuilt best scores ({len(drift)} row(s) had drifted)'))
+        elif drift:
+            self.stdout.write(self.style.ERROR(f'{len(drift)} best score row(s) differ from Score (use --fix)'))
+
+        # 2. メモリ上のリーダーボード（このコマンドで読み込んだもの）と SQL の順位が一致するか
+        #    稼働中のワーカーが持つボードは GET /api/leaderboard/consistency/ で確認する
+        memory = MemoryLeaderboard(sync_interval=0, resync_interval=float('inf'))
+        database = DatabaseLeaderboard(sync_interval=0, resync_interval=0)
+        challenge_ids = [challenge_id] if challenge_id else list(
+            UserChallengeBest.objects.values_list('challenge_id', flat=True).distinct()
+        )
+
+        mismatches = 0
+        for cid in challenge_ids:
+            memory.warm([cid])
+            if memory.top(cid, 10) != database.top(cid, 10):
+                mismatches += 1
+                self.stdout.write(f'Challenge {cid}: top 10 differs')
+
+            user_ids = list(UserChallengeBest.objects.filter(challenge_id=cid).values_list('user_id', flat=True))
+            for user_id in random.sample(user_ids, min(options['sample'], len(user_ids))):
+                if memory.rank(user_id, cid) != database.rank(user_id, cid):
+                    mismatches += 1
+                    self.stdout.write(f'Challenge {cid} / user {user_id}: rank differs')
+
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f'{mismatches} leaderboard mismatch(es)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Leaderboard consistent for {len(challenge_ids)} challenge(s)'))
@@ -0,0 +1,53 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.landmark_codec import encode_landmarks, DTYPES, COMPRESSIONS
+from api.landmarks import landmarks_to_array
+from api.models import Score
+
+class Command(BaseCommand):
+    help = 'Converts raw_landmarks JSON of existing scores into the compact binary format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--dtype', choices=DTYPES.keys(), default=None, help='Defaults to LANDMARK_STORAGE_DTYPE')
+        parser.add_argument('--compression', choices=COMPRESSIONS.keys(), default=None, help='Defaults to LANDMARK_STORAGE_COMPRESSION')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the size reduction')
+
+    def handle(self, *args, **options):
+        dtype = options['dtype'] or settings.LANDMARK_STORAGE_DTYPE
+        compression = options['compression'] or settings.LANDMARK_STORAGE_COMPRESSION
+        batch_size = options['batch_size']
+
+        pending_ids = Score.objects.filter(raw_landmarks__isnull=False).order_by('id').values_list('id', flat=True)
+        converted = json_bytes = blob_bytes = 0
+        last_id = 0
+
+        while True:
+            ids = list(pending_ids.filter(id__gt=last_id)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            rows = Score.objects.filter(id__in=ids).only('id', 'raw_landmarks')
+            updates = []
+            for score in rows:
+                blob = encode_landmarks(landmarks_to_array(score.raw_landmarks), dtype=dtype, compression=compression)
+                json_bytes += len(json.dumps(score.raw_landmarks).encode('utf-8'))
+                blob_bytes += len(blob)
+                score.landmarks_blob = blob
+                score.raw_landmarks = None
+                updates.append(score)
+
+            if not options['dry_run']:
+                with transaction.atomic():
+                    Score.objects.bulk_update(updates, ['landmarks_blob', 'raw_landmarks'])
+            converted += len(updates)
+            self.stdout.write(f'{converted} score(s) processed (last id {last_id})')
+
+        ratio = blob_bytes / json_bytes if json_bytes else 0
+        verb = 'Would convert' if options['dry_run'] else 'Converted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {converted} score(s): {json_bytes:,} bytes of JSON -> {blob_bytes:,} bytes ({ratio:.1%})'
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from api.feedback import claim_next_job, requeue_stale_jobs, run_feedback_job
+from api.models import Score
+
+class Command(BaseCommand):
+    help = 'Generates AI feedback for pending scores in this process (recovery / cron use)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset-running',
+            action='store_true',
+            help='Re-queue jobs left in "running" state (only when no server workers are alive)',
+        )
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of jobs to process')
+
+    def handle(self, *args, **options):
+        if options['reset_running']:
+            reset = Score.objects.filter(feedback_status=Score.FeedbackStatus.RUNNING)\
+                .update(feedback_status=Score.FeedbackStatus.PENDING, feedback_claimed_at=None)
+            self.stdout.write(f'Re-queued {reset} running job(s)')
+        else:
+            reset = requeue_stale_jobs()
+            if reset:
+                self.stdout.write(f'Re-queued {reset} stale running job(s)')
+
+        processed = 0
+        while options['limit'] is None or processed < options['limit']:
+            score_id = claim_next_job()
+            if score_id is None:
+                break
+            status = run_feedback_job(score_id)
+            processed += 1
+            self.stdout.write(f'Score {score_id}: {status}')
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} feedback job(s)'))
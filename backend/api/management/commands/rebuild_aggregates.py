@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from api.aggregates import find_drift, rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the score aggregate tables from Score and reports how far they had drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--challenge', type=int, default=None, help='Only rebuild this challenge')
+        parser.add_argument('--check', action='store_true', help='Only report drift, do not rewrite the tables')
+
+    def handle(self, *args, **options):
+        drift = find_drift(options['challenge'])
+        for name, key, field, expected, stored in drift[:20]:
+            self.stdout.write(f'{name} {key} {field}: expected {expected}, stored {stored}')
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Aggregates are consistent with Score'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} aggregate value(s) drifted'))
+
+        if not options['check']:
+            rebuild_aggregates(options['challenge'])
+            self.stdout.write(self.style.SUCCESS('Rebuilt score aggregates'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from api.models import Score, UserStats
+from api.user_stats import find_stats_drift, refresh_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Backfills dashboard stats (UserStats) from Score, or checks them against the derived values'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', default=None, help='Only these user IDs (repeatable)')
+        parser.add_argument('--check', action='store_true', help='Only report users whose stored stats differ')
+
+    def handle(self, *args, **options):
+        user_ids = options['user']
+
+        if options['check']:
+            drift = find_stats_drift(user_ids)
+            for user_id, field, expected, stored in drift[:20]:
+                self.stdout.write(f'User {user_id} {field}: expected {expected!r}, stored {stored!r}')
+            if drift:
+                self.stdout.write(self.style.ERROR(f'{len(drift)} stats value(s) differ'))
+            else:
+                self.stdout.write(self.style.SUCCESS('User stats are consistent with Score'))
+            return
+
+        if user_ids is None:
+            # スコアのなくなったユーザーの統計も作り直す
+            user_ids = sorted(
+                set(Score.objects.values_list('user_id', flat=True).distinct())
+                | set(UserStats.objects.values_list('user_id', flat=True))
+            )
+
+        for index, user_id in enumerate(user_ids, start=1):
+            refresh_user_stats(user_id)
+            if index % 500 == 0:
+                self.stdout.write(f'{index}/{len(user_ids)} users')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {len(user_ids)} user(s)'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.models import RescoreJob
+from api.rescoring import run_rescore_job
+
+
+class Command(BaseCommand):
+    help = 'Re-scores existing Score rows with the current scoring constants (resumable, with a dry-run diff report)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--challenge', type=int, default=None, help='Only re-score this challenge')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Scores per chunk (one checkpoint per chunk)')
+        parser.add_argument('--workers', type=int, default=None, help='Scoring processes (default: SCORING_WORKERS)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+        parser.add_argument('--resume', type=int, default=None, metavar='JOB_ID', help='Continue an interrupted job from its checkpoint')
+
+    def handle(self, *args, **options):
+        if options['resume'] is not None:
+            try:
+                job = RescoreJob.objects.get(pk=options['resume'])
+            except RescoreJob.DoesNotExist:
+                raise CommandError(f'Rescore job {options["resume"]} does not exist')
+            if job.status == RescoreJob.Status.DONE:
+                raise CommandError(f'Rescore job {job.pk} is already done')
+        else:
+            job = RescoreJob.objects.create(
+                challenge_id=options['challenge'],
+                chunk_size=options['chunk_size'],
+                dry_run=options['dry_run'],
+            )
+        self.stdout.write(f'Rescore job {job.pk} (dry run: {job.dry_run}) starting after score {job.last_score_id}')
+
+        def on_progress(job):
+            report = job.report
+            self.stdout.write(
+                f'  up to score {job.last_score_id}: {report["processed"]} processed, '
+                f'{report["changed"]} changed, {report["skipped"]} skipped'
+            )
+
+        run_rescore_job(job, workers=options['workers'], on_progress=on_progress)
+
+        report = job.report
+        mean_delta = report['sum_abs_delta'] / report['changed'] if report['changed'] else 0
+        self.stdout.write(
+            f'Changed {report["changed"]} of {report["processed"]} score(s); '
+            f'overall score delta mean {mean_delta:.3f}, max {report["max_abs_delta"]:.3f}'
+        )
+        for sample in report['samples']:
+            self.stdout.write(f'  Score {sample["id"]}: {sample["old_overall_score"]} -> {sample["new_overall_score"]}')
+        self.stdout.write(self.style.SUCCESS(f'Rescore job {job.pk} done'))
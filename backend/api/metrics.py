@@ -0,0 +1,395 @@
+import time
+import numpy as np
+
+from .landmarks import LANDMARK_COUNT, CHANNELS, X, VISIBILITY
+
+# MediaPipe Pose Landmark IDs
+NOSE = 0
+LEFT_SHOULDER = 11
+RIGHT_SHOULDER = 12
+LEFT_HIP = 23
+RIGHT_HIP = 24
+LEFT_WRIST = 15
+RIGHT_WRIST = 16
+LEFT_ANKLE = 27
+RIGHT_ANKLE = 28
+
+TORSO_IDS = (LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_HIP, RIGHT_HIP)
+
+
+class ScoringParams:
+    """Scoring constants (shared by ScoringService and the scoring worker processes)."""
+
+    # Visibility threshold for a landmark to be considered reliable
+    VISIBILITY_THRESHOLD = 0.85
+
+    # Scoring coefficients
+    ANGLE_DEVIATION_COEFFICIENT = 2
+    STABILITY_STD_DEV_COEFFICIENT = 1000
+    TRUNK_TILT_ANGLE_COEFFICIENT = 10
+    RHYTHM_STD_DEV_COEFFICIENT = 15
+
+
+# --- Helper Functions ---
+
+def normalize_angle(angle):
+    """Normalizes angles (scalar or array, within ±540°) to the [-180, 180] range."""
+    angle = np.where(angle > 180, angle - 360, angle)
+    return np.where(angle < -180, angle + 360, angle)
+
+
+def fold_to_half_turn(angle):
+    """Folds line angles into the (-90, 90] range so that direction does not matter."""
+    angle = np.where(angle > 90, angle - 180, angle)
+    return np.where(angle <= -90, angle + 180, angle)
+
+
+def calculate_score(value, coefficient, max_points=25):
+    """Calculates a score based on a value and coefficient, capped at max_points."""
+    return max(0, max_points - (value * coefficient))
+
+
+class RunningStats:
+    """
+    Streaming mean / variance over batches of values.
+    Batches are merged with the parallel form of Welford's algorithm (Chan et al.),
+    so the state stays O(1) no matter how many frames are fed.
+    """
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, values):
+        count = len(values)
+        if not count:
+            return
+
+        batch_mean = float(np.mean(values))
+        batch_m2 = float(np.sum((values - batch_mean) ** 2))
+
+        if not self.count:
+            self.count, self.mean, self.m2 = count, batch_mean, batch_m2
+            return
+
+        total = self.count + count
+        delta = batch_mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += batch_m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    @property
+    def stdev(self):
+        """Sample standard deviation (same definition as `statistics.stdev`)."""
+        if self.count < 2:
+            return 0.0
+        return (self.m2 / (self.count - 1)) ** 0.5
+
+    def to_state(self):
+        return [self.count, self.mean, self.m2]
+
+
+class FrameBatch:
+    """
+    A chunk of frames (frames × 33 × 4) validated once, together with the intermediates
+    shared by several metrics (visibility mask, torso validity, body axis angle).
+    """
+
+    def __init__(self, frames, visibility_threshold):
+        self.frames = frames
+        self.visible = frames[:, :, VISIBILITY] > visibility_threshold
+        self.torso_valid = self.visible[:, TORSO_IDS].all(axis=1)
+
+        shoulder_mid = (frames[:, LEFT_SHOULDER, :2] + frames[:, RIGHT_SHOULDER, :2]) / 2
+        hip_mid = (frames[:, LEFT_HIP, :2] + frames[:, RIGHT_HIP, :2]) / 2
+        body_vec = shoulder_mid - hip_mid
+        self.body_angles = np.degrees(np.arctan2(body_vec[:, 1], body_vec[:, 0]))
+
+    def valid(self, *landmark_ids):
+        """Boolean mask of frames where all the given landmarks are visible."""
+        return self.visible[:, list(landmark_ids)].all(axis=1)
+
+
+# --- Metric Accumulators ---
+
+METRIC_ACCUMULATORS = []
+
+
+def register_metric(cls):
+    """Registers an accumulator class; chart_data keys follow registration order."""
+    METRIC_ACCUMULATORS.append(cls)
+    return cls
+
+
+class MetricAccumulator:
+    """
+    Base class for a metric computed in a single pass over the frames.
+    `params` is an object exposing the scoring constants (`ScoringParams` or a subclass).
+    """
+    name = None
+
+    def __init__(self, params):
+        self.params = params
+
+    def update(self, batch):
+        """Consumes a FrameBatch."""
+
+    def result(self, video_duration):
+        """Returns (chart score, detailed result dict)."""
+        raise NotImplementedError
+
+    def get_stats(self):
+        """Named RunningStats that make up the accumulator state."""
+        return {}
+
+    def to_state(self):
+        return {key: stats.to_state() for key, stats in self.get_stats().items()}
+
+    def load_state(self, state):
+        for key, stats in self.get_stats().items():
+            if key in state:
+                stats.count, stats.mean, stats.m2 = state[key]
+
+
+@register_metric
+class SymmetryAccumulator(MetricAccumulator):
+    """Tilt of the shoulder / hip lines relative to the body's horizontal axis."""
+    name = 'symmetry'
+    parts = {
+        'shoulders': (LEFT_SHOULDER, RIGHT_SHOULDER),
+        'hips': (LEFT_HIP, RIGHT_HIP),
+    }
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.signed = {part: RunningStats() for part in self.parts}
+        self.absolute = {part: RunningStats() for part in self.parts}
+
+    def update(self, batch):
+        body_horizontal = fold_to_half_turn(batch.body_angles + 90)
+
+        for part, (left_id, right_id) in self.parts.items():
+            mask = batch.torso_valid & batch.valid(left_id, right_id)
+            line_vec = batch.frames[mask, right_id, :2] - batch.frames[mask, left_id, :2]
+            line_angles = fold_to_half_turn(np.degrees(np.arctan2(line_vec[:, 1], line_vec[:, 0])))
+            angles = normalize_angle(line_angles - body_horizontal[mask])
+
+            # 2点が重なっている場合は傾きなしとみなす
+            is_degenerate = (line_vec[:, 0] == 0) & (line_vec[:, 1] == 0)
+            angles = np.where(is_degenerate, 0.0, angles)
+
+            self.signed[part].update(angles)
+            self.absolute[part].update(np.abs(angles))
+
+    def _part_result(self, part):
+        if not self.signed[part].count:
+            return {"score": 0, "avg_deviation": 0, "avg_tilt_direction": 0}
+
+        avg_tilt_direction = self.signed[part].mean
+        avg_deviation = self.absolute[part].mean
+        score = calculate_score(avg_deviation, self.params.ANGLE_DEVIATION_COEFFICIENT)
+
+        return {
+            "score": round(score, 3),
+            "avg_deviation": round(avg_deviation, 3),
+            "avg_tilt_direction": round(avg_tilt_direction, 3),
+        }
+
+    def result(self, video_duration):
+        symmetry_results = {part: self._part_result(part) for part in self.parts}
+        return symmetry_results['shoulders']['score'], symmetry_results
+
+    def get_stats(self):
+        stats = {f'{part}_signed': value for part, value in self.signed.items()}
+        stats.update({f'{part}_absolute': value for part, value in self.absolute.items()})
+        return stats
+
+
+@register_metric
+class TrunkUprightnessAccumulator(MetricAccumulator):
+    """Tilt of the trunk relative to vertical (Lateral tilt in front view)."""
+    name = 'trunk_uprightness'
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.signed = RunningStats()
+        self.absolute = RunningStats()
+
+    def update(self, batch):
+        # Signed tilt relative to -90 degrees (vertical)
+        tilt_angles = normalize_angle(batch.body_angles[batch.torso_valid] - (-90))
+        self.signed.update(tilt_angles)
+        self.absolute.update(np.abs(tilt_angles))
+
+    def result(self, video_duration):
+        score = 0
+        avg_tilt_angle = 0
+        avg_tilt_direction = 0
+
+        if self.absolute.count:
+            avg_tilt_angle = self.absolute.mean
+            avg_tilt_direction = self.signed.mean
+
+            # Score out of 100 then scaled to 25
+            score_100 = calculate_score(avg_tilt_angle, self.params.TRUNK_TILT_ANGLE_COEFFICIENT, max_points=100)
+            score = score_100 / 4.0
+
+        return round(score, 3), {
+            'score': round(score, 3),
+            'avg_tilt_angle': round(avg_tilt_angle, 3),
+            'avg_tilt_direction': round(avg_tilt_direction, 3)
+        }
+
+    def get_stats(self):
+        return {'signed': self.signed, 'absolute': self.absolute}
+
+
+@register_metric
+class GravityStabilityAccumulator(MetricAccumulator):
+    """Side-to-side sway for both hips and head."""
+    name = 'gravity_stability'
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.hip = RunningStats()
+        self.head = RunningStats()
+
+    def update(self, batch):
+        frames = batch.frames
+        hip_mask = batch.valid(LEFT_HIP, RIGHT_HIP)
+        self.hip.update((frames[hip_mask, LEFT_HIP, X] + frames[hip_mask, RIGHT_HIP, X]) / 2)
+        self.head.update(frames[batch.valid(NOSE), NOSE, X])
+
+    def _sway(self, stats):
+        """Returns (score, stdev, average direction) of the sway."""
+        if stats.count < 2:
+            return 0, 0, 0
+        stdev = stats.stdev
+        return calculate_score(stdev, self.params.STABILITY_STD_DEV_COEFFICIENT), stdev, stats.mean - 0.5
+
+    def result(self, video_duration):
+        hip_score, hip_stdev, avg_hip_sway_direction = self._sway(self.hip)
+        head_score, head_stdev, avg_head_sway_direction = self._sway(self.head)
+
+        # Average of hip and head stability scores
+        combined_score = (hip_score + head_score) / 2
+
+        return round(combined_score, 3), {
+            'score': round(combined_score, 3),
+            'hip_score': round(hip_score, 3),
+            'hip_sway_magnitude': round(hip_stdev, 5),
+            'avg_hip_sway_direction': round(avg_hip_sway_direction, 3),
+            'head_score': round(head_score, 3),
+            'head_sway_magnitude': round(head_stdev, 5),
+            'avg_head_sway_direction': round(avg_head_sway_direction, 3)
+        }
+
+    def get_stats(self):
+        return {'hip': self.hip, 'head': self.head}
+
+
+@register_metric
+class WalkingSpeedAccumulator(MetricAccumulator):
+    """10m walking speed; depends only on the recording length."""
+    name = 'walking_speed'
+
+    # 理想的な歩行速度 (m/s)。1.4m/s以上で満点(25点)
+    OPTIMAL_SPEED = 1.4
+
+    def result(self, video_duration):
+        if video_duration <= 0:
+            speed_mps = 0
+        else:
+            speed_mps = 10.0 / video_duration  # m/s
+
+        # 速度に応じて線形スコアリング
+        score_100 = min(100, (speed_mps / self.OPTIMAL_SPEED) * 100)
+        score = score_100 / 4.0
+
+        return round(score, 3), {
+            'score': round(score, 3),
+            'speed_mps': round(speed_mps, 3),
+            'time_seconds': round(video_duration, 2)
+        }
+
+
+class MetricPipeline:
+    """
+    Feeds each chunk of frames once through every registered metric accumulator.
+    Chunks can arrive all at once or incrementally; the result is available at any time.
+    If `timings` is a dict, the seconds spent per metric (and in building the frame batch) are added to it.
+    """
+
+    def __init__(self, params, accumulator_classes=None, timings=None):
+        self.params = params
+        self.frame_count = 0
+        self.accumulators = [cls(params) for cls in (accumulator_classes or METRIC_ACCUMULATORS)]
+        self.timings = timings
+
+    def feed(self, frames):
+        """Consumes a (frames, 33, 4) array chunk."""
+        if not len(frames):
+            return
+        if self.timings is None:
+            batch = FrameBatch(frames, self.params.VISIBILITY_THRESHOLD)
+            for accumulator in self.accumulators:
+                accumulator.update(batch)
+        else:
+            start = time.perf_counter()
+            batch = FrameBatch(frames, self.params.VISIBILITY_THRESHOLD)
+            self._add_timing('frame_batch', start)
+            for accumulator in self.accumulators:
+                start = time.perf_counter()
+                accumulator.update(batch)
+                self._add_timing(accumulator.name, start)
+        self.frame_count += len(frames)
+
+    def _add_timing(self, name, start):
+        self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def results(self, video_duration):
+        """Returns (chart_data, detailed_results, overall_score) for the frames fed so far."""
+        chart_data = {}
+        detailed_results = {}
+        for accumulator in self.accumulators:
+            chart_data[accumulator.name], detailed_results[accumulator.name] = accumulator.result(video_duration)
+        overall_score = round(sum(chart_data.values()), 3)
+        return chart_data, detailed_results, overall_score
+
+    def to_state(self):
+        """JSON-serialisable state, so a session can be resumed in another request or process."""
+        return {
+            'frame_count': self.frame_count,
+            'metrics': {accumulator.name: accumulator.to_state() for accumulator in self.accumulators},
+        }
+
+    @classmethod
+    def from_state(cls, params, state):
+        pipeline = cls(params)
+        pipeline.frame_count = state.get('frame_count', 0)
+        for accumulator in pipeline.accumulators:
+            accumulator.load_state(state.get('metrics', {}).get(accumulator.name, {}))
+        return pipeline
+
+
+def score_frames(frames, video_duration, params=ScoringParams):
+    """Scores a whole (frames, 33, 4) array; returns (chart_data, detailed_results, overall_score)."""
+    pipeline = MetricPipeline(params)
+    pipeline.feed(frames)
+    return pipeline.results(video_duration)
+
+
+def score_frames_timed(frames, video_duration, params=ScoringParams):
+    """Same as `score_frames`, but also returns the seconds spent per metric: (results, timings)."""
+    timings = {}
+    pipeline = MetricPipeline(params, timings=timings)
+    pipeline.feed(frames)
+    return pipeline.results(video_duration), timings
+
+
+def warm_up():
+    """Runs the pipeline once on a dummy frame so a fresh worker process has everything imported and initialised."""
+    score_frames(np.zeros((2, LANDMARK_COUNT, len(CHANNELS))), 1.0)
+    return True
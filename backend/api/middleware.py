@@ -0,0 +1,64 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .instrumentation import REQUEST_DB_DURATION, REQUEST_DURATION, REQUEST_QUERIES, REQUESTS, end_trace, start_trace
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, status and database query counts per endpoint, and logs a span breakdown
+    of requests slower than settings.METRICS_SLOW_REQUEST_SECONDS.
+    Works for both the sync and the async (adrf) views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        trace, token = start_trace()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_trace(token)
+        self._record(request, response, trace, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        trace, token = start_trace()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_trace(token)
+        self._record(request, response, trace, time.perf_counter() - start)
+        return response
+
+    def _record(self, request, response, trace, elapsed):
+        # URL そのもの（id を含む）ではなくルート名で集計し、系列数が増え続けないようにする
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.view_name if match is not None and match.view_name else 'unmatched'
+
+        REQUEST_DURATION.observe(elapsed, method=request.method, endpoint=endpoint)
+        REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        REQUEST_QUERIES.observe(trace.queries, endpoint=endpoint)
+        REQUEST_DB_DURATION.observe(trace.query_seconds, endpoint=endpoint)
+
+        level = logging.WARNING if elapsed >= settings.METRICS_SLOW_REQUEST_SECONDS else logging.DEBUG
+        logger.log(
+            level,
+            '%s %s %s %.1fms queries=%d db=%.1fms %s',
+            request.method, request.path, response.status_code, elapsed * 1000,
+            trace.queries, trace.query_seconds * 1000, trace.summary(),
+        )
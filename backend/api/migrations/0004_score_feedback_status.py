@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_score_video_duration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='feedback_status',
+            field=models.CharField(choices=[('pending', '生成待ち'), ('running', '生成中'), ('done', '完了'), ('failed', '失敗')], db_index=True, default='done', max_length=10, verbose_name='フィードバック生成状況'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_feedbackcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='landmarks_blob',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='score',
+            name='raw_landmarks',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
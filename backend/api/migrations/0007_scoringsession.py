@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_score_landmarks_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoringSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('open', '記録中'), ('finalized', '確定済み')], default='open', max_length=10)),
+                ('frame_count', models.PositiveIntegerField(default=0)),
+                ('next_sequence', models.PositiveIntegerField(default=0)),
+                ('pipeline_state', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scoring_sessions', to='api.challenge')),
+                ('score', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scoring_session', to='api.score')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scoring_sessions', to='api.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScoringSessionChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField()),
+                ('frame_count', models.PositiveIntegerField()),
+                ('landmarks_blob', models.BinaryField()),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='api.scoringsession')),
+            ],
+            options={
+                'ordering': ['sequence'],
+                'constraints': [models.UniqueConstraint(fields=('session', 'sequence'), name='unique_session_chunk_sequence')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_user_bests(apps, schema_editor):
+    Score = apps.get_model('api', 'Score')
+    UserChallengeBest = apps.get_model('api', 'UserChallengeBest')
+
+    rows = Score.objects.order_by('user_id', 'challenge_id', '-overall_score', 'id')\
+        .values_list('id', 'user_id', 'challenge_id', 'overall_score')
+    bests = []
+    last_key = None
+    for score_id, user_id, challenge_id, overall_score in rows.iterator(chunk_size=2000):
+        if (user_id, challenge_id) == last_key:
+            continue
+        last_key = (user_id, challenge_id)
+        bests.append(UserChallengeBest(
+            user_id=user_id, challenge_id=challenge_id, best_score=overall_score, score_id=score_id,
+        ))
+    UserChallengeBest.objects.bulk_create(bests, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_scoringsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserChallengeBest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('best_score', models.FloatField()),
+                ('updated_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_bests', to='api.challenge')),
+                ('score', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.score')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_bests', to='api.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['challenge', '-best_score'], name='user_best_challenge_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'challenge'), name='unique_user_challenge_best')],
+            },
+        ),
+        migrations.RunPython(backfill_user_bests, migrations.RunPython.noop),
+    ]
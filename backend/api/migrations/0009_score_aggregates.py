@@ -0,0 +1,89 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+CHART_KEYS = ('symmetry', 'trunk_uprightness', 'gravity_stability', 'walking_speed')
+
+
+def backfill_aggregates(apps, schema_editor):
+    Score = apps.get_model('api', 'Score')
+    ChallengeScoreAggregate = apps.get_model('api', 'ChallengeScoreAggregate')
+    UserChallengeScoreAggregate = apps.get_model('api', 'UserChallengeScoreAggregate')
+
+    challenge_totals = {}
+    user_totals = {}
+    rows = Score.objects.values_list('user_id', 'challenge_id', 'overall_score', 'chart_data')
+    for user_id, challenge_id, overall_score, chart_data in rows.iterator(chunk_size=2000):
+        for totals in (challenge_totals.setdefault(challenge_id, {}), user_totals.setdefault((user_id, challenge_id), {})):
+            totals['count'] = totals.get('count', 0) + 1
+            totals['overall_sum'] = totals.get('overall_sum', 0) + overall_score
+            for key in CHART_KEYS:
+                value = (chart_data or {}).get(key)
+                if value is not None:
+                    totals[f'{key}_sum'] = totals.get(f'{key}_sum', 0) + float(value)
+                    totals[f'{key}_count'] = totals.get(f'{key}_count', 0) + 1
+
+    ChallengeScoreAggregate.objects.bulk_create(
+        [ChallengeScoreAggregate(challenge_id=challenge_id, **totals) for challenge_id, totals in challenge_totals.items()],
+        batch_size=1000,
+    )
+    UserChallengeScoreAggregate.objects.bulk_create(
+        [
+            UserChallengeScoreAggregate(user_id=user_id, challenge_id=challenge_id, **totals)
+            for (user_id, challenge_id), totals in user_totals.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_userchallengebest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeScoreAggregate',
+            fields=[
+                ('count', models.PositiveIntegerField(default=0)),
+                ('overall_sum', models.FloatField(default=0)),
+                ('symmetry_sum', models.FloatField(default=0)),
+                ('symmetry_count', models.PositiveIntegerField(default=0)),
+                ('trunk_uprightness_sum', models.FloatField(default=0)),
+                ('trunk_uprightness_count', models.PositiveIntegerField(default=0)),
+                ('gravity_stability_sum', models.FloatField(default=0)),
+                ('gravity_stability_count', models.PositiveIntegerField(default=0)),
+                ('walking_speed_sum', models.FloatField(default=0)),
+                ('walking_speed_count', models.PositiveIntegerField(default=0)),
+                ('challenge', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score_aggregate', serialize=False, to='api.challenge')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='UserChallengeScoreAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('overall_sum', models.FloatField(default=0)),
+                ('symmetry_sum', models.FloatField(default=0)),
+                ('symmetry_count', models.PositiveIntegerField(default=0)),
+                ('trunk_uprightness_sum', models.FloatField(default=0)),
+                ('trunk_uprightness_count', models.PositiveIntegerField(default=0)),
+                ('gravity_stability_sum', models.FloatField(default=0)),
+                ('gravity_stability_count', models.PositiveIntegerField(default=0)),
+                ('walking_speed_sum', models.FloatField(default=0)),
+                ('walking_speed_count', models.PositiveIntegerField(default=0)),
+                ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_aggregates', to='api.challenge')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_aggregates', to='api.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'challenge'), name='unique_user_challenge_aggregate')],
+            },
+        ),
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
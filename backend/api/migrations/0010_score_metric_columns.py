@@ -0,0 +1,62 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:37
+
+from django.db import migrations, models
+
+
+METRIC_FIELDS = ('symmetry', 'trunk_uprightness', 'gravity_stability', 'walking_speed')
+
+
+def copy_chart_data_to_columns(apps, schema_editor):
+    Score = apps.get_model('api', 'Score')
+
+    batch = []
+    for score in Score.objects.only('id', 'chart_data').iterator(chunk_size=1000):
+        chart_data = score.chart_data or {}
+        for field in METRIC_FIELDS:
+            value = chart_data.get(field)
+            setattr(score, field, None if value is None else float(value))
+        batch.append(score)
+        if len(batch) >= 1000:
+            Score.objects.bulk_update(batch, METRIC_FIELDS)
+            batch = []
+    if batch:
+        Score.objects.bulk_update(batch, METRIC_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_score_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='gravity_stability',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='score',
+            name='symmetry',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='score',
+            name='trunk_uprightness',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='score',
+            name='walking_speed',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='score',
+            index=models.Index(fields=['challenge', 'user', 'created_at'], name='score_challenge_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='score',
+            index=models.Index(fields=['challenge', '-overall_score'], name='score_challenge_overall_idx'),
+        ),
+        migrations.RunPython(copy_chart_data_to_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+RECENT_ACTIVITY_LIMIT = 5
+
+
+def backfill_user_stats(apps, schema_editor):
+    Score = apps.get_model('api', 'Score')
+    UserStats = apps.get_model('api', 'UserStats')
+
+    # ユーザーごとに新しい順に並べ、1回の走査で api/user_stats.compute_user_stats と同じ値を求める
+    rows = Score.objects.order_by('user_id', '-created_at', '-id')\
+        .values_list('id', 'user_id', 'overall_score', 'created_at', 'challenge__name')
+    totals = {}
+    for score_id, user_id, overall_score, created_at, challenge_name in rows.iterator(chunk_size=2000):
+        user = totals.setdefault(user_id, {'total_plays': 0, 'high_score': overall_score, 'dates': [], 'recent_activities': []})
+        user['total_plays'] += 1
+        user['high_score'] = max(user['high_score'], overall_score)
+        play_date = timezone.localtime(created_at).date()
+        if not user['dates'] or user['dates'][-1] != play_date:
+            user['dates'].append(play_date)
+        if len(user['recent_activities']) < RECENT_ACTIVITY_LIMIT:
+            user['recent_activities'].append({
+                'id': score_id,
+                'challengeName': challenge_name,
+                'overall_score': float(overall_score),
+                'date': created_at.strftime('%Y-%m-%d'),
+            })
+
+    stats = []
+    for user_id, user in totals.items():
+        dates = user.pop('dates')
+        # 連続プレイ日数: 最新のプレイ日から1日ずつ遡って途切れるまで数える
+        current_streak = 1
+        for newer, older in zip(dates, dates[1:]):
+            if (newer - older).days != 1:
+                break
+            current_streak += 1
+        stats.append(UserStats(user_id=user_id, last_play_date=dates[0], current_streak=current_streak, **user))
+    UserStats.objects.bulk_create(stats, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_score_metric_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='api.user')),
+                ('total_plays', models.PositiveIntegerField(default=0)),
+                ('high_score', models.FloatField(default=0)),
+                ('last_play_date', models.DateField(blank=True, null=True)),
+                ('current_streak', models.PositiveIntegerField(default=0)),
+                ('recent_activities', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_user_stats, migrations.RunPython.noop),
+    ]
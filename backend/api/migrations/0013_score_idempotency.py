@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_rescorejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='score',
+            name='payload_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='score',
+            index=models.Index(fields=['user', 'created_at'], name='score_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_score_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='feedback_claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
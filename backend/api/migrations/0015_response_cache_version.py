@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-17 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_score_feedback_claimed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseCacheVersion',
+            fields=[
+                ('scope', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -1,4 +1,9 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+
+from .landmark_codec import LandmarkEncoder, decode_landmarks, frame_count
+from .landmarks import array_to_landmarks, landmarks_to_array
 
 # Create your models here.
 class User(models.Model):
@@ -47,20 +52,311 @@ class Challenge(models.Model):
         verbose_name_plural = "チャレンジ"
         
 class Score(models.Model):
+
+    class FeedbackStatus(models.TextChoices):
+        PENDING = 'pending', '生成待ち'
+        RUNNING = 'running', '生成中'
+        DONE = 'done', '完了'
+        FAILED = 'failed', '失敗'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='scores')
     challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name='scores')
     overall_score = models.FloatField()
     feedback_text = models.TextField(blank=True, null=True) 
+    feedback_status = models.CharField(
+        verbose_name='フィードバック生成状況',
+        max_length=10,
+        choices=FeedbackStatus.choices,
+        default=FeedbackStatus.DONE,
+        db_index=True,
+    )
+    # ワーカーがジョブを確保した時刻。生成中のまま FEEDBACK_JOB_TIMEOUT を過ぎたジョブは再度キューに戻す
+    feedback_claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
     chart_data = models.JSONField() 
-    raw_landmarks = models.JSONField()
+    # chart_data の各項目を型付きの列にも保持する（絞り込み・並べ替え・集計用）。save() 時に chart_data から同期される
+    symmetry = models.FloatField(null=True, blank=True, editable=False)
+    trunk_uprightness = models.FloatField(null=True, blank=True, editable=False)
+    gravity_stability = models.FloatField(null=True, blank=True, editable=False)
+    walking_speed = models.FloatField(null=True, blank=True, editable=False)
+    # ランドマークは raw_landmarks (JSON) か landmarks_blob (landmark_codec のバイナリ) のどちらかに保存される。
+    # 読み書きは `landmarks` / `landmark_array` を経由すること
+    raw_landmarks = models.JSONField(blank=True, null=True)
+    landmarks_blob = models.BinaryField(blank=True, null=True, editable=False)
     detailed_results = models.JSONField(blank=True, null=True)
     video_duration = models.FloatField(default=5.0, verbose_name='動画時間(秒)')
     created_at = models.DateTimeField(auto_now_add=True)
+    # 再送の判定用（api/idempotency.py）。Idempotency-Key ヘッダーと、送信内容のハッシュ
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, editable=False)
+    payload_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
     
+    METRIC_FIELDS = ('symmetry', 'trunk_uprightness', 'gravity_stability', 'walking_speed')
+
     def __str__(self):
         return f'{self.user.name} - {self.challenge.name}: {self.overall_score}点'
+
+    def sync_metric_columns(self):
+        """Copies the chart_data scores into the typed metric columns (call before bulk_update)."""
+        chart_data = self.chart_data or {}
+        for field in self.METRIC_FIELDS:
+            value = chart_data.get(field)
+            setattr(self, field, None if value is None else float(value))
+
+    def save(self, *args, **kwargs):
+        self.sync_metric_columns()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'chart_data' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | set(self.METRIC_FIELDS)
+        super().save(*args, **kwargs)
+
+    @property
+    def landmarks(self):
+        """Landmarks in the `raw_landmarks` JSON structure, whichever storage the row uses."""
+        if self.raw_landmarks is not None:
+            return self.raw_landmarks
+        if self.landmarks_blob is None:
+            return []
+        return array_to_landmarks(self.landmark_array)
+
+    @landmarks.setter
+    def landmarks(self, raw_landmarks):
+        if settings.LANDMARK_STORAGE_FORMAT == 'binary':
+            self.landmark_array = landmarks_to_array(raw_landmarks)
+        else:
+            self.raw_landmarks = raw_landmarks
+            self.landmarks_blob = None
+            self._landmark_array = None
+
+    @property
+    def landmark_array(self):
+        """Landmarks as a (frames, 33, 4) array, decoded lazily and cached on the instance."""
+        if getattr(self, '_landmark_array', None) is None:
+            if self.landmarks_blob is not None:
+                self._landmark_array = decode_landmarks(self.landmarks_blob)
+            else:
+                self._landmark_array = landmarks_to_array(self.raw_landmarks or [])
+        return self._landmark_array
+
+    @landmark_array.setter
+    def landmark_array(self, array):
+        """Stores an already converted array, in the compact binary format unless storage is 'json'."""
+        if settings.LANDMARK_STORAGE_FORMAT == 'binary':
+            encoder = self.landmark_encoder()
+            encoder.feed(array)
+            self.landmarks_blob = encoder.finish()
+            self.raw_landmarks = None
+        else:
+            self.raw_landmarks = array_to_landmarks(array)
+            self.landmarks_blob = None
+        self._landmark_array = array
+
+    def landmark_frames(self, start=0, stop=None):
+        """Frames [start, stop) as an array; binary rows only decode the segments that overlap the range."""
+        if getattr(self, '_landmark_array', None) is None and self.landmarks_blob is not None:
+            return decode_landmarks(self.landmarks_blob, start, stop)
+        return self.landmark_array[start:stop]
+
+    @property
+    def landmark_frame_count(self):
+        if getattr(self, '_landmark_array', None) is None and self.landmarks_blob is not None:
+            return frame_count(self.landmarks_blob)
+        return len(self.landmark_array)
+
+    @staticmethod
+    def landmark_encoder():
+        """Incremental encoder for `landmarks_blob` with the configured dtype / compression."""
+        return LandmarkEncoder(
+            dtype=settings.LANDMARK_STORAGE_DTYPE,
+            compression=settings.LANDMARK_STORAGE_COMPRESSION,
+        )
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['challenge', 'user', 'created_at'], name='score_challenge_user_date_idx'),
+            models.Index(fields=['challenge', '-overall_score'], name='score_challenge_overall_idx'),
+            # 再送の判定は、ユーザーの直近のスコアだけを見る
+            models.Index(fields=['user', 'created_at'], name='score_user_date_idx'),
+        ]
     
-    
\ No newline at end of file
+    
+class UserChallengeBest(models.Model):
+    """
+    ユーザー×チャレンジごとの自己ベスト（Score保存時に更新される集計テーブル）。
+    順位は「自分より高いベストスコアの件数 + 1」で求める。
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='challenge_bests')
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name='user_bests')
+    best_score = models.FloatField()
+    score = models.ForeignKey(Score, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f'{self.user.name} - {self.challenge.name}: {self.best_score}点'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'challenge'], name='unique_user_challenge_best'),
+        ]
+        indexes = [
+            models.Index(fields=['challenge', '-best_score'], name='user_best_challenge_score_idx'),
+        ]
+
+
+class ScoreAggregateBase(models.Model):
+    """
+    overall_score と chart_data の各項目の合計・件数（Score の保存・削除時に加算／減算される）。
+    平均は sum / count で求める。
+    """
+    CHART_KEYS = ('symmetry', 'trunk_uprightness', 'gravity_stability', 'walking_speed')
+
+    count = models.PositiveIntegerField(default=0)
+    overall_sum = models.FloatField(default=0)
+    symmetry_sum = models.FloatField(default=0)
+    symmetry_count = models.PositiveIntegerField(default=0)
+    trunk_uprightness_sum = models.FloatField(default=0)
+    trunk_uprightness_count = models.PositiveIntegerField(default=0)
+    gravity_stability_sum = models.FloatField(default=0)
+    gravity_stability_count = models.PositiveIntegerField(default=0)
+    walking_speed_sum = models.FloatField(default=0)
+    walking_speed_count = models.PositiveIntegerField(default=0)
+
+    @property
+    def overall_average(self):
+        return self.overall_sum / self.count if self.count else 0
+
+    def chart_data_averages(self):
+        averages = {}
+        for key in self.CHART_KEYS:
+            count = getattr(self, f'{key}_count')
+            averages[key] = getattr(self, f'{key}_sum') / count if count else 0
+        return averages
+
+    class Meta:
+        abstract = True
+
+
+class ChallengeScoreAggregate(ScoreAggregateBase):
+    """チャレンジ全体の集計（主キーはチャレンジ）"""
+    challenge = models.OneToOneField(Challenge, on_delete=models.CASCADE, primary_key=True, related_name='score_aggregate')
+
+
+class UserChallengeScoreAggregate(ScoreAggregateBase):
+    """ユーザー×チャレンジごとの集計"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='challenge_aggregates')
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name='user_aggregates')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'challenge'], name='unique_user_challenge_aggregate'),
+        ]
+
+
+class UserStats(models.Model):
+    """
+    ダッシュボード用のユーザー統計（Score保存時にトランザクション内で更新される）。
+    recent_activities は新しい順に最大 RECENT_ACTIVITY_LIMIT 件を保持するリングバッファ。
+    """
+    RECENT_ACTIVITY_LIMIT = 5
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_plays = models.PositiveIntegerField(default=0)
+    high_score = models.FloatField(default=0)
+    last_play_date = models.DateField(null=True, blank=True)
+    # last_play_date で終わる連続プレイ日数（今日・昨日以外なら表示上は0）
+    current_streak = models.PositiveIntegerField(default=0)
+    recent_activities = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user.name}: {self.total_plays}回'
+
+
+class FeedbackCacheEntry(models.Model):
+    """AIアドバイスのキャッシュ（量子化した分析結果＋専門知識のハッシュをキーとする）"""
+    key = models.CharField(max_length=64, unique=True)
+    advice = models.TextField()
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.key[:12]} ({self.hit_count} hits)'
+
+
+class ResponseCacheVersion(models.Model):
+    """
+    レスポンスキャッシュのスコープ（challenge:3, user:7 など）ごとのバージョン（api/response_cache.py）。
+    ワーカー間で取りこぼさないよう、更新は UPDATE ... SET version = version + 1 で行う。
+    """
+    scope = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField()
+
+    def __str__(self):
+        return f'{self.scope}: {self.version}'
+
+
+class ScoringSession(models.Model):
+    """
+    録画中にフレームをチャンク単位で受け取るライブ採点セッション。
+    採点パイプラインの途中状態 (pipeline_state) をチャンクごとに更新するため、
+    確定 (finalize) 時にフレームを再走査する必要がない。
+    """
+
+    class Status(models.TextChoices):
+        OPEN = 'open', '記録中'
+        FINALIZED = 'finalized', '確定済み'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='scoring_sessions')
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name='scoring_sessions')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.OPEN)
+    frame_count = models.PositiveIntegerField(default=0)
+    next_sequence = models.PositiveIntegerField(default=0)
+    pipeline_state = models.JSONField(default=dict)
+    score = models.OneToOneField(Score, on_delete=models.SET_NULL, null=True, blank=True, related_name='scoring_session')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Session {self.pk} ({self.user.name} - {self.challenge.name}, {self.frame_count} frames)'
+
+
+class ScoringSessionChunk(models.Model):
+    """セッションに追記されたフレームのチャンク（landmark_codec 形式のバイナリ）"""
+    session = models.ForeignKey(ScoringSession, on_delete=models.CASCADE, related_name='chunks')
+    sequence = models.PositiveIntegerField()
+    frame_count = models.PositiveIntegerField()
+    landmarks_blob = models.BinaryField()
+
+    class Meta:
+        ordering = ['sequence']
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'sequence'], name='unique_session_chunk_sequence'),
+        ]
+
+
+class RescoreJob(models.Model):
+    """
+    既存スコアの再採点ジョブ。Score の id 順に処理し、チャンクごとに last_score_id を
+    チェックポイントとして保存するため、中断しても続きから再開できる。
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', '待機中'
+        RUNNING = 'running', '実行中'
+        DONE = 'done', '完了'
+        FAILED = 'failed', '失敗'
+
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, null=True, blank=True, related_name='rescore_jobs')
+    # True の場合は差分の集計のみ行い、Score を書き換えない
+    dry_run = models.BooleanField(default=False)
+    chunk_size = models.PositiveIntegerField(default=500)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    last_score_id = models.BigIntegerField(default=0)
+    # 処理件数・変更件数・スコアの差分統計・差分のサンプル
+    report = models.JSONField(default=dict)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Rescore {self.pk} ({self.status}, last score {self.last_score_id})'
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ScoreCursorPagination(CursorPagination):
+    """
+    新しい順のカーソルページネーション。
+    OFFSET を使わないため、スコアが増えてもページ取得のコストが一定。
+    """
+    ordering = '-created_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
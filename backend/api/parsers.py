@@ -0,0 +1,207 @@
+import io
+import zlib
+import orjson
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, UnsupportedMediaType
+from rest_framework.parsers import BaseParser, JSONParser
+
+from .landmarks import iter_landmark_chunks
+from .packed_landmarks import MEDIA_TYPE as PACKED_MEDIA_TYPE, PackedLandmarkError, iter_packed_chunks, read_header
+
+# 圧縮された本文を展開するときの1回あたりの読み込み量
+_READ_SIZE = 64 * 1024
+# gzip / zlib (Content-Encoding: deflate) のヘッダーを自動判別する
+_ZLIB_AUTO_HEADER = zlib.MAX_WBITS | 32
+COMPRESSED_ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'The request body is too large.'
+    default_code = 'payload_too_large'
+
+
+def _too_large():
+    return PayloadTooLarge(f'The request body exceeds {settings.SCORE_UPLOAD_MAX_BYTES} bytes.')
+
+
+class _Decompressor:
+    """File-like view of a gzip / deflate compressed stream (never buffers more than one read)."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._zlib = zlib.decompressobj(_ZLIB_AUTO_HEADER)
+
+    def read(self, size):
+        while not self._zlib.eof:
+            data = self._zlib.unconsumed_tail or self._stream.read(_READ_SIZE)
+            if not data:
+                raise ParseError('The compressed request body is truncated.')
+            try:
+                out = self._zlib.decompress(data, size)
+            except zlib.error as exc:
+                raise ParseError(f'Could not decompress the request body: {exc}')
+            if out:
+                return out
+        return b''
+
+
+class _LimitedReader(io.RawIOBase):
+    """Raises PayloadTooLarge once more than settings.SCORE_UPLOAD_MAX_BYTES (decoded) bytes were read."""
+
+    def __init__(self, source):
+        self._source = source
+        self._limit = settings.SCORE_UPLOAD_MAX_BYTES
+        self._read = 0
+
+    def readable(self):
+        return True
+
+    def _count(self, data):
+        self._read += len(data)
+        if self._read > self._limit:
+            raise _too_large()
+        return data
+
+    def readinto(self, buffer):
+        data = self._count(self._source.read(len(buffer)))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        parts = []
+        while data := self._count(self._source.read(max(_READ_SIZE, self._limit - self._read + 1))):
+            parts.append(data)
+        return b''.join(parts)
+
+
+def open_body(stream, parser_context):
+    """
+    The request body as a buffered file, decompressed according to Content-Encoding
+    (gzip / deflate). Bodies whose declared length exceeds settings.SCORE_UPLOAD_MAX_BYTES are
+    rejected with 413 before being read, and reading stops with 413 once the (decompressed)
+    body grows past it, so chunked or compressed uploads are bounded as well.
+    """
+    request = (parser_context or {}).get('request')
+    meta = request.META if request is not None else {}
+    try:
+        length = int(meta.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > settings.SCORE_UPLOAD_MAX_BYTES:
+        raise _too_large()
+
+    source = stream if stream is not None else io.BytesIO()
+    encoding = meta.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+    if encoding in COMPRESSED_ENCODINGS:
+        source = _Decompressor(source)
+    elif encoding not in ('', 'identity'):
+        raise UnsupportedMediaType(encoding, detail=f'Unsupported Content-Encoding "{encoding}".')
+    return io.BufferedReader(_LimitedReader(source), buffer_size=_READ_SIZE)
+
+
+class ORJSONParser(JSONParser):
+    """
+    JSON parser backed by orjson (several times faster than the json module on the large
+    `raw_landmarks` arrays). Accepts gzip / deflate compressed bodies; bodies over
+    settings.SCORE_UPLOAD_MAX_BYTES are rejected with 413 without being decoded.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = open_body(stream, parser_context).read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class LandmarkStream:
+    """
+    Frames of a streamed score upload, read from the request body only as they are consumed,
+    so the whole session is never held in memory. Can be consumed once.
+    """
+
+    def chunks(self, chunk_frames=256, max_frames=None):
+        """Validated (n, 33, 4) arrays of at most `chunk_frames` frames (see iter_landmark_chunks)."""
+        raise NotImplementedError
+
+
+class NDJSONLandmarkStream(LandmarkStream):
+    """Frames of an NDJSON upload, decoded line by line."""
+
+    def __init__(self, lines):
+        self._lines = lines
+
+    def __iter__(self):
+        for line_number, line in self._lines:
+            try:
+                frame = orjson.loads(line)
+            except orjson.JSONDecodeError as exc:
+                raise ParseError(f'NDJSON parse error on line {line_number}: {exc}')
+            if not isinstance(frame, list):
+                raise ParseError(f'Line {line_number} must be a frame (a list of poses).')
+            yield frame
+
+    def chunks(self, chunk_frames=256, max_frames=None):
+        return iter_landmark_chunks(self, chunk_frames, max_frames)
+
+
+class PackedLandmarkStream(LandmarkStream):
+    """Frames of a packed binary upload (api/packed_landmarks.py), dequantized chunk by chunk."""
+
+    def __init__(self, body, scale):
+        self._body = body
+        self._scale = scale
+
+    def chunks(self, chunk_frames=256, max_frames=None):
+        return iter_packed_chunks(self._body, self._scale, chunk_frames, max_frames)
+
+
+class LandmarkNDJSONParser(BaseParser):
+    """
+    Parses `application/x-ndjson` score uploads (UTF-8):
+        line 1 : {"user": 1, "challenge": 1, "video_duration": 8.2}
+        line 2+: one frame per line, in the same shape as an element of `raw_landmarks`
+    The frames are returned as an NDJSONLandmarkStream under `raw_landmarks` and decoded on demand.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = open_body(stream, parser_context)
+        lines = ((number, line) for number, line in enumerate(body, start=1) if line.strip())
+
+        try:
+            _, header_line = next(lines)
+            header = orjson.loads(header_line)
+        except StopIteration:
+            raise ParseError('Empty NDJSON body.')
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'NDJSON parse error on line 1: {exc}')
+        if not isinstance(header, dict):
+            raise ParseError('The first NDJSON line must be a JSON object.')
+
+        return {**header, 'raw_landmarks': NDJSONLandmarkStream(lines)}
+
+
+class PackedLandmarkParser(BaseParser):
+    """
+    Parses `application/x-runway-landmarks` score uploads: quantized little-endian frames after
+    a header carrying the other fields (see api/packed_landmarks.py). The frames are returned
+    as a PackedLandmarkStream under `raw_landmarks` and decoded on demand.
+    """
+    media_type = PACKED_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = open_body(stream, parser_context)
+        try:
+            scale, meta = read_header(body)
+            header = orjson.loads(meta)
+        except PackedLandmarkError as exc:
+            raise ParseError(str(exc))
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'Packed upload header parse error - {exc}')
+        if not isinstance(header, dict):
+            raise ParseError('The header of a packed upload must be a JSON object.')
+
+        return {**header, 'raw_landmarks': PackedLandmarkStream(body, scale)}
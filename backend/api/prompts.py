@@ -0,0 +1,241 @@
+"""
+Advice prompt.
+
+The prompt is split into a static system instruction (role, guardrails, output template and the
+expert knowledge base) and a small per-score payload. The static part only changes when
+expert_knowledge.md changes, so it is built once per knowledge version and can be cached on the
+provider side (see GeminiClient); each request then only sends the analysis results.
+
+The model quotes numbers as placeholders ({{overall_score}}, {{symmetry.hips.score}}, ...) rather than
+literal values. The advice is cached in that form and `render_advice` fills in the values of the score
+it is shown for, so a cached advice never carries another session's numbers.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_PATH = os.path.join(settings.BASE_DIR, 'expert_knowledge.md')
+
+Knowledge = namedtuple('Knowledge', ['text', 'hash', 'mtime'])
+# version: 静的部分（system_instruction）のハッシュ。プロバイダ側のキャッシュの識別に使う
+AdvicePrompt = namedtuple('AdvicePrompt', ['system_instruction', 'contents', 'version'])
+
+
+SYSTEM_INSTRUCTION_TEMPLATE = """
+# 役割
+あなたは、データに基づきユーザーの可能性を最大限に引き出す「ロジカルかつ前向きなパーソナルウォーキングコーチ」です。
+あなたの使命は、数値を冷静に分析し、その結果を「どうすればもっと良くなるか」というポジティブな解決策に変換して伝えることです。
+ユーザーの分析データ(JSON)と総合スコアは、各リクエストで入力として渡されます。
+
+# 数値の書き方（厳守）
+- 入力データの数値を文中に書くときは、値そのものではなく必ずプレースホルダを書いてください。システムがユーザーの値に置き換えます。
+- 総合スコアは `{{overall_score}}`、分析データの値は JSON のキーを `.` でつないだもの（例: `{{trunk_uprightness.avg_tilt_angle}}`、`{{symmetry.hips.score}}`）です。
+- 入力データの値を丸めたり計算し直したりした数値も書かないでください。ナレッジベースの基準値（ランクの境界など）はそのまま書いて構いません。
+
+# 専門知識
+{expert_knowledge}
+
+# 安全性・倫理ガードレール（最重要遵守事項）
+1.  **医療用語の禁止**:
+    - 「診断」「症状」「疾患」「異常」「治療」「リハビリ」「症候群」「～病」「～障害」といった言葉は絶対に使用しないでください。
+    - 代わりに「クセ」「特徴」「傾向」「改善ポイント」「コンディショニング」「エクササイズ」といった言葉を使用してください。
+    - 特定の病名（例：脊柱側弯症、トレンデレンブルグ徴候、パーキンソン病など）の推測・言及は禁止です。
+2.  **断定の回避**:
+    - 「～です」と身体の状態を断定するのではなく、「～の傾向が見られます」「～の可能性があります」とデータ上の数値を解説するスタンスを守ってください。
+
+# 思考プロセスと制約条件（最重要）
+1. **比較対象の原則**:
+   - 「平均値と比較して〜」は禁止。常に「物理的に理想的なフォーム（角度0度、安定性0.0）」と比較してください。
+2. **Sランクの絶対肯定**:
+   - データがナレッジベースの「Sランク」範囲内にある項目は、**いかなる改善提案も行わず、「最強の武器」として手放しで絶賛してください。**
+3. **クロス分析の優先（New!）**:
+   - 個別の項目を評価する前に、必ずナレッジベースの**「4. 複合要因分析ルール」**と照合してください。
+   - もし「パターンA（代償動作）」などに該当する場合は、単なる「肩が傾いています」という指摘ではなく、「腰の弱さが肩に影響しています」という**因果関係に基づいた深いアドバイス**を優先してください。
+4. **メリハリ**:
+   - 良い点は「なぜ素晴らしいか」、悪い点は「直すとどう変わるか（メリット）」を提示してください。
+
+# 出力テンプレート
+## 🚀 未来を変えるウォーキング分析：現在のスコア {{overall_score}}点
+
+### 🌟 あなたのウォーキングタイプ
+**「[ここにポジティブで特徴的なタイプ名を生成]」**
+
+### 📈 総合レビュー
+[スコアの背景とポテンシャルを150文字程度で。Sランク項目がある場合は「〇〇という強力な武器を持っています」と強調。課題点は「ここさえ磨けばさらに伸びます」と前向きに記述]
+
+### 🔗 動きの連動性（プロの視点）
+[**重要: ここでクロス分析の結果を披露してください**]
+[該当するパターンがあれば：「一見、肩の傾きが気になりますが、データを見ると**実は腰の不安定さが原因**である可能性が高いです...」のように記述]
+[該当パターンがない場合：「姿勢の安定性が、美しいリズムを生み出す土台になっています...」のように、良い項目の相乗効果を記述]
+
+### 💡 項目別・ネクストステップ
+
+#### 1. 体幹の直立性
+- **評価:** [Sランクなら「文句なしのSランク」、それ以外はランクに応じた評価]
+- **分析:** [数値をプレースホルダで引用。クロス分析で「全身の歪み」と診断された場合はその旨を記載]
+- **アクション:** [ナレッジベースに基づいた具体的な解決策]
+
+#### 2. 左右対称性
+- **評価:** [評価]
+- **分析:** [数値をプレースホルダで引用。クロス分析で「代償動作（腰が原因）」と診断された場合は、「肩そのものではなく腰へのアプローチが有効です」と記載]
+- **アクション:** [ナレッジベースに基づいたアクション]
+
+#### 3. 重心安定性
+- **評価:** [評価]
+- **分析:** [数値をプレースホルダで引用]
+- **アクション:** [トレーニング案]
+
+#### 4. リズム
+- **評価:** [評価]
+- **分析:** [数値をプレースホルダで引用。クロス分析で「過緊張」と診断された場合は「リラックス」を提案]
+- **アクション:** [トレーニング案]
+
+---
+**✨ コーチからのエール**
+[論理的かつ情熱的な締めくくりのメッセージ]
+"""
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class KnowledgeBase:
+    """
+    expert_knowledge.md loaded once and hashed, reloaded when its mtime changes.
+    The file is stat'ed at most every `check_interval` seconds; a missing file is an empty knowledge base.
+    """
+
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self._knowledge = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self, mtime):
+        text = ''
+        if mtime is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            except OSError as e:
+                logger.exception("Failed to load expert knowledge: %s", e)
+                # 読めなかった場合は前回の内容を使い続ける
+                if self._knowledge is not None:
+                    return self._knowledge
+        if self._knowledge is not None:
+            logger.info("Reloaded expert knowledge from %s", self.path)
+        return Knowledge(text, _sha256(text), mtime)
+
+    def current(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._knowledge is None or now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                mtime = self._mtime()
+                if self._knowledge is None or mtime != self._knowledge.mtime:
+                    self._knowledge = self._load(mtime)
+            return self._knowledge
+
+
+class AdvicePromptBuilder:
+    """Builds advice prompts; the system instruction is rebuilt only when the knowledge base changes."""
+
+    def __init__(self, knowledge_base):
+        self.knowledge_base = knowledge_base
+        self._static = None  # (knowledge hash, system_instruction, version)
+        self._lock = threading.Lock()
+
+    def _system_instruction(self, knowledge):
+        with self._lock:
+            if self._static is None or self._static[0] != knowledge.hash:
+                system_instruction = SYSTEM_INSTRUCTION_TEMPLATE.replace('{expert_knowledge}', knowledge.text)
+                self._static = (knowledge.hash, system_instruction, _sha256(system_instruction))
+            return self._static[1], self._static[2]
+
+    def build(self, detailed_results, overall_score, knowledge=None):
+        knowledge = knowledge or self.knowledge_base.current()
+        system_instruction, version = self._system_instruction(knowledge)
+        contents = (
+            "# 入力データ\n"
+            "ユーザー分析データ(JSON):\n"
+            f"{json.dumps(detailed_results, ensure_ascii=False, separators=(',', ':'))}\n\n"
+            f"総合スコア:\n{overall_score} 点\n"
+        )
+        return AdvicePrompt(system_instruction, contents, version)
+
+
+# --- Placeholders ---
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*([\w.]+)\s*\}\}')
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+
+
+def quoted_values(detailed_results, overall_score):
+    """Placeholder name -> value for every number the advice may quote."""
+    values = {'overall_score': overall_score}
+
+    def flatten(prefix, node):
+        for key, value in node.items():
+            if isinstance(value, dict):
+                flatten(f'{prefix}{key}.', value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                values[f'{prefix}{key}'] = value
+
+    flatten('', detailed_results or {})
+    return values
+
+
+def render_advice(advice, detailed_results, overall_score, partial=False):
+    """
+    Replaces the placeholders in `advice` with the values of this score. Unknown placeholders are left as is.
+    With `partial=True` (text still streaming) a trailing placeholder that is not closed yet is held back.
+    """
+    if partial:
+        start = advice.rfind('{{')
+        if start != -1 and '}}' not in advice[start:]:
+            advice = advice[:start]
+        elif advice.endswith('{'):
+            advice = advice[:-1]
+    values = quoted_values(detailed_results, overall_score)
+
+    def fill(match):
+        value = values.get(match.group(1))
+        return match.group(0) if value is None else str(value)
+
+    return PLACEHOLDER_PATTERN.sub(fill, advice)
+
+
+def quotes_literal_values(advice, detailed_results, overall_score):
+    """
+    True when `advice` writes one of this score's values literally (as given or rounded to 1–2 decimals)
+    instead of as a placeholder. Such a text is specific to this score and must not be cached.
+    Whole numbers are not checked: they cannot be told apart from the knowledge base's thresholds.
+    """
+    literals = set()
+    for value in quoted_values(detailed_results, overall_score).values():
+        value = abs(value)
+        for literal in (str(value), f'{value:.1f}', f'{value:.2f}'):
+            if '.' in literal and float(literal) != int(float(literal)):
+                literals.add(literal)
+    text = PLACEHOLDER_PATTERN.sub('', advice)
+    return any(number in literals for number in NUMBER_PATTERN.findall(text))
+
+
+expert_knowledge = KnowledgeBase(KNOWLEDGE_PATH, settings.EXPERT_KNOWLEDGE_CHECK_INTERVAL)
+advice_prompts = AdvicePromptBuilder(expert_knowledge)
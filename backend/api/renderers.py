@@ -0,0 +1,55 @@
+import json
+import orjson
+from decimal import Decimal
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+
+def sse_event(event, data):
+    """Formats one server-sent event with a JSON payload."""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets `Accept: text/event-stream` (EventSource) pass content negotiation.
+    Streaming views return their own StreamingHttpResponse; this only renders errors, as a single `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return sse_event('error', data).encode('utf-8')
+
+
+def _orjson_default(obj):
+    # orjson が直接扱えない型（DRF の JSONEncoder と同じ扱いにする）
+    if isinstance(obj, Promise):
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__iter__'):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    `application/json` renderer backed by orjson. Responses carrying `raw_landmarks` run to
+    megabytes, where it is several times faster than the json module; numpy arrays are
+    serialized natively. Output is compact UTF-8, like JSONRenderer with its default settings.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=_orjson_default, option=orjson.OPT_SERIALIZE_NUMPY)
@@ -0,0 +1,176 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from .aggregates import rebuild_aggregates
+from .leaderboard import rebuild_user_bests
+from .metrics import score_frames, warm_up
+from .models import Score, RescoreJob
+from .response_cache import bump_scopes
+from .user_stats import refresh_stats_for_users
+
+RESCORED_FIELDS = ['overall_score', 'chart_data', 'detailed_results', *Score.METRIC_FIELDS]
+SCORE_ONLY_FIELDS = [
+    'id', 'user_id', 'challenge_id', 'video_duration', 'raw_landmarks', 'landmarks_blob',
+    'overall_score', 'chart_data', 'detailed_results',
+]
+DIFF_SAMPLE_LIMIT = 20
+
+logger = logging.getLogger(__name__)
+
+
+def empty_report():
+    return {
+        'processed': 0,
+        'changed': 0,
+        'skipped': 0,
+        'sum_abs_delta': 0.0,
+        'max_abs_delta': 0.0,
+        'samples': [],
+    }
+
+
+def _iter_batches(queryset, chunk_size):
+    batch = []
+    for score in queryset.iterator(chunk_size=chunk_size):
+        batch.append(score)
+        if len(batch) >= chunk_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _job_scores(job):
+    scores = Score.objects.filter(pk__gt=job.last_score_id).order_by('pk').only(*SCORE_ONLY_FIELDS)
+    if job.challenge_id is not None:
+        scores = scores.filter(challenge_id=job.challenge_id)
+    return scores
+
+
+def _apply_batch(job, batch, pool, report):
+    """Scores one batch in the pool, updates the report and (unless dry run) the rows; returns changed rows."""
+    # ランドマークのない行は採点できないので対象外
+    scorable = [score for score in batch if score.raw_landmarks is not None or score.landmarks_blob is not None]
+    report['skipped'] += len(batch) - len(scorable)
+
+    arrays = [score.landmark_array for score in scorable]
+    results = pool.map(score_frames, arrays, [score.video_duration for score in scorable])
+
+    changed = []
+    for score, (chart_data, detailed_results, overall_score) in zip(scorable, results):
+        score._landmark_array = None  # デコード済み配列をチャンクを超えて保持しない
+        report['processed'] += 1
+        if (chart_data, detailed_results, overall_score) == (score.chart_data, score.detailed_results, score.overall_score):
+            continue
+
+        delta = overall_score - score.overall_score
+        report['changed'] += 1
+        report['sum_abs_delta'] += abs(delta)
+        report['max_abs_delta'] = max(report['max_abs_delta'], abs(delta))
+        if len(report['samples']) < DIFF_SAMPLE_LIMIT:
+            report['samples'].append({
+                'id': score.id,
+                'old_overall_score': score.overall_score,
+                'new_overall_score': overall_score,
+                'old_chart_data': score.chart_data,
+                'new_chart_data': chart_data,
+            })
+
+        score.chart_data, score.detailed_results, score.overall_score = chart_data, detailed_results, overall_score
+        score.sync_metric_columns()
+        changed.append(score)
+
+    if changed and not job.dry_run:
+        Score.objects.bulk_update(changed, RESCORED_FIELDS, batch_size=job.chunk_size)
+    return changed
+
+
+def _lock_out_score_writers():
+    """
+    Blocks new Score writes (and their signal updates of the derived tables) until the transaction ends,
+    after waiting for the ones in progress to commit. Reads are not blocked.
+    SHARE ROW EXCLUSIVE conflicts with the ROW EXCLUSIVE lock every INSERT / UPDATE / DELETE takes,
+    and with itself, so two rebuilds do not interleave either.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {connection.ops.quote_name(Score._meta.db_table)} IN SHARE ROW EXCLUSIVE MODE')
+
+
+def _rebuild_derived(job):
+    """
+    bulk_update bypasses the Score signals, so the derived tables and caches are rebuilt here.
+    Everything is recomputed from Score in one transaction with Score writes locked out: a score saved
+    meanwhile would otherwise update rows that the rebuild then replaces with totals computed without it.
+    """
+    scores = Score.objects.all()
+    if job.challenge_id is not None:
+        scores = scores.filter(challenge_id=job.challenge_id)
+
+    with transaction.atomic():
+        _lock_out_score_writers()
+        rebuild_user_bests(job.challenge_id)
+        rebuild_aggregates(job.challenge_id)
+        refresh_stats_for_users(scores.values('user_id'))
+
+        user_ids = set(scores.values_list('user_id', flat=True).distinct())
+        challenge_ids = set(scores.values_list('challenge_id', flat=True).distinct())
+        # score:<id> の無効化は行数分になるため、リザルトページは user / challenge 側のバージョンで無効化する
+        scopes = [f'user:{user_id}' for user_id in user_ids] + [f'challenge:{cid}' for cid in challenge_ids]
+        transaction.on_commit(lambda: bump_scopes(scopes))
+
+
+def run_rescore_job(job, workers=None, on_progress=None):
+    """
+    Re-scores the job's scores with the current ScoringParams, resuming after `last_score_id`.
+    The checkpoint and report are saved after every chunk; `on_progress(job)` is called as well.
+    """
+    workers = workers or settings.SCORING_WORKERS
+    job.status = RescoreJob.Status.RUNNING
+    job.report = job.report or empty_report()
+    job.error = ''
+    job.save(update_fields=['status', 'report', 'error', 'updated_at'])
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=warm_up,
+        ) as pool:
+            for batch in _iter_batches(_job_scores(job), job.chunk_size):
+                _apply_batch(job, batch, pool, job.report)
+                job.last_score_id = batch[-1].id
+                job.save(update_fields=['last_score_id', 'report', 'updated_at'])
+                if on_progress is not None:
+                    on_progress(job)
+
+        if not job.dry_run:
+            _rebuild_derived(job)
+    except Exception as e:
+        job.status = RescoreJob.Status.FAILED
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        raise
+
+    job.status = RescoreJob.Status.DONE
+    job.save(update_fields=['status', 'updated_at'])
+    return job
+
+
+def start_rescore_job(job):
+    """Runs the job in a background thread of this process (used by the API)."""
+    def run():
+        try:
+            run_rescore_job(job)
+        except Exception as e:
+            logger.exception("Rescore job %s failed: %s", job.pk, e)
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=run, name=f'rescore-{job.pk}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,198 @@
+"""
+Response cache for the read APIs.
+
+A cached response is stored under a key built from the endpoint, its parameters and the
+current version of every scope it depends on (e.g. ``challenge:3``, ``user:7``). Writes never
+delete entries: they bump the version counters of the affected scopes (see api/signals.py),
+so stale entries are simply never looked up again and expire with the cache timeout.
+
+The versions live in the database (ResponseCacheVersion) rather than in the cache backend:
+the file and database cache backends implement incr() as get + set, so two workers bumping
+the same scope at once could lose an invalidation. An UPDATE ... SET version = version + 1 cannot.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .db_executor import run_db
+from .instrumentation import registry
+from .models import ResponseCacheVersion
+
+ENTRY_PREFIX = 'response-cache:entry:'
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+class CacheStats:
+    """Per-endpoint hit / miss / not-modified counters (per process)."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, {'hits': 0, 'misses': 0, 'not_modified': 0})
+            counts[outcome] += 1
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for endpoint, counts in self._counts.items():
+                lookups = counts['hits'] + counts['misses']
+                snapshot[endpoint] = dict(counts, hit_rate=round(counts['hits'] / lookups, 4) if lookups else 0)
+            return snapshot
+
+    def collect(self):
+        with self._lock:
+            values = [
+                ({'endpoint': endpoint, 'outcome': outcome}, count)
+                for endpoint, counts in sorted(self._counts.items())
+                for outcome, count in counts.items()
+            ]
+        return [('runway_response_cache_requests_total', 'counter', 'Response cache lookups by endpoint and outcome.', values)]
+
+
+cache_stats = CacheStats()
+registry.register_collector(cache_stats.collect)
+
+
+# --- Scope versions ---
+
+def _create_versions(scopes):
+    # 行が消された後に 0 から数え直すと古いエントリと衝突しうるため、時刻で初期化する
+    ResponseCacheVersion.objects.bulk_create(
+        [ResponseCacheVersion(scope=scope, version=time.time_ns()) for scope in scopes], ignore_conflicts=True,
+    )
+
+
+def scope_versions(scopes):
+    """Current version of every scope; missing counters are created with a fresh value."""
+    versions = dict(ResponseCacheVersion.objects.filter(scope__in=scopes).values_list('scope', 'version'))
+    missing = [scope for scope in scopes if scope not in versions]
+    if missing:
+        _create_versions(missing)
+        versions.update(ResponseCacheVersion.objects.filter(scope__in=missing).values_list('scope', 'version'))
+    return [versions[scope] for scope in scopes]
+
+
+def bump_scopes(scopes):
+    """Increments the versions atomically in the database (safe with several workers bumping at once)."""
+    scopes = list(scopes)
+    # 先に行を用意してから加算する（読み込み側が同時に行を作っても加算は失われない）
+    _create_versions(scopes)
+    ResponseCacheVersion.objects.filter(scope__in=scopes).update(version=F('version') + 1)
+
+
+def invalidate_on_commit(*scopes):
+    """Bumps the scopes once the current transaction commits (immediately outside a transaction)."""
+    transaction.on_commit(lambda: bump_scopes(scopes))
+
+
+def score_scopes(user_id, challenge_id, score_id):
+    return [f'user:{user_id}', f'challenge:{challenge_id}', f'score:{score_id}']
+
+
+# --- View decorator ---
+
+def make_etag(data):
+    payload = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+    return '"%s"' % hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _entry_key(endpoint, request, kwargs, scopes, daily):
+    params = sorted(request.query_params.lists())
+    identity = [endpoint, params, sorted(kwargs.items()), scopes, scope_versions(scopes)]
+    if daily:
+        # 日付で変わる値（連続プレイ日数など）を含むレスポンスは、日付が変わったら作り直す
+        identity.append(timezone.localdate().isoformat())
+    identity = json.dumps(identity, default=str)
+    return ENTRY_PREFIX + hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def _finalize(response, etag, outcome):
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['X-Cache'] = outcome
+    return response
+
+
+def _lookup(endpoint, scopes, daily, request, kwargs):
+    """Returns (key, cached entry or None); key is None when the request bypasses the cache."""
+    scope_list = scopes(request, **kwargs)
+    if scope_list is None:
+        return None, None
+    key = _entry_key(endpoint, request, kwargs, scope_list, daily)
+    return key, _cache().get(key)
+
+
+def _store(key, response):
+    entry = (response.data, make_etag(response.data))
+    _cache().set(key, entry, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+    return entry
+
+
+def _respond(endpoint, request, response, entry, outcome):
+    cache_stats.record(endpoint, 'hits' if outcome == 'HIT' else 'misses')
+    etag = entry[1]
+    if etag in request.headers.get('If-None-Match', ''):
+        cache_stats.record(endpoint, 'not_modified')
+        return _finalize(Response(status=status.HTTP_304_NOT_MODIFIED), etag, outcome)
+    return _finalize(response, etag, outcome)
+
+
+def cached_response(endpoint, scopes, daily=False):
+    """
+    Caches successful responses of an APIView `get` method (sync, or async for adrf views).
+
+    `scopes(request, **kwargs)` returns the scopes the response depends on, or None to bypass
+    the cache (e.g. missing parameters, so the view can return its own error).
+    With `daily=True` the entry is also keyed on today's date (responses derived from "today").
+    Requests with a matching `If-None-Match` get `304 Not Modified`.
+    """
+    def decorator(view_method):
+        if asyncio.iscoroutinefunction(view_method):
+            @wraps(view_method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                if not settings.RESPONSE_CACHE_ENABLED:
+                    return await view_method(self, request, *args, **kwargs)
+                # キャッシュの読み書き（ファイル / DB）もイベントループを止めないよう DB 用スレッドで行う
+                key, entry = await run_db(_lookup, endpoint, scopes, daily, request, kwargs)
+                if key is None:
+                    return await view_method(self, request, *args, **kwargs)
+                if entry is not None:
+                    return _respond(endpoint, request, Response(entry[0]), entry, 'HIT')
+                response = await view_method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                entry = await run_db(_store, key, response)
+                return _respond(endpoint, request, response, entry, 'MISS')
+            return async_wrapper
+
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if not settings.RESPONSE_CACHE_ENABLED:
+                return view_method(self, request, *args, **kwargs)
+            key, entry = _lookup(endpoint, scopes, daily, request, kwargs)
+            if key is None:
+                return view_method(self, request, *args, **kwargs)
+            if entry is not None:
+                return _respond(endpoint, request, Response(entry[0]), entry, 'HIT')
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            return _respond(endpoint, request, response, _store(key, response), 'MISS')
+        return wrapper
+    return decorator
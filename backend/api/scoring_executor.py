@@ -0,0 +1,140 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .instrumentation import record_span, record_spans, registry
+from .metrics import score_frames_timed, warm_up
+
+
+class ScoringUnavailable(APIException):
+    """Every scoring slot is busy; DRF turns `wait` into a Retry-After header."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The scoring service is busy. Please retry shortly.'
+    default_code = 'scoring_unavailable'
+
+    def __init__(self, wait, detail=None):
+        super().__init__(detail)
+        self.wait = wait
+
+
+class ScoringExecutor:
+    """
+    Runs `score_frames_timed` outside the event loop's GIL, in worker processes by default.
+
+    At most `workers + queue_depth` jobs are accepted at a time; beyond that `submit` raises
+    ScoringUnavailable (503 + Retry-After) instead of letting requests pile up.
+    Landmarks are handed over as numpy arrays, which pickle as a single buffer.
+    """
+
+    def __init__(self, mode, workers, queue_depth, retry_after, start_method='spawn'):
+        self.mode = mode
+        self.workers = workers
+        self.retry_after = retry_after
+        self.start_method = start_method
+        self.capacity = workers + queue_depth
+        # 受け付け済み（実行中・待機中）のジョブ数。プールの作成に使う _lock とは別のロックで守る
+        self._in_flight = 0
+        self._slots_lock = threading.Lock()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _create_executor(self):
+        if self.mode == 'thread':
+            return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scoring')
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=warm_up,
+        )
+        # ワーカーを全数起動しておき、初回リクエストで import や初期化を待たせない
+        for _ in range(self.workers):
+            executor.submit(warm_up)
+        return executor
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def _reset(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def available_slots(self):
+        with self._slots_lock:
+            return self.capacity - self._in_flight
+
+    def _acquire_slot(self):
+        with self._slots_lock:
+            if self._in_flight >= self.capacity:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _release_slot(self, _future=None):
+        with self._slots_lock:
+            self._in_flight -= 1
+
+    def check_capacity(self):
+        """Cheap early check so callers can reject before doing any preparation work."""
+        if self.available_slots() <= 0:
+            raise ScoringUnavailable(wait=self.retry_after)
+
+    def submit(self, frames, video_duration):
+        """Returns a concurrent.futures.Future of ((chart_data, detailed_results, overall_score), timings)."""
+        if not self._acquire_slot():
+            raise ScoringUnavailable(wait=self.retry_after)
+        try:
+            executor = self.start()
+            try:
+                future = executor.submit(score_frames_timed, frames, video_duration)
+            except BrokenProcessPool:
+                # ワーカーが異常終了していた場合はプールを作り直して1度だけ再投入する
+                self._reset(executor)
+                future = self.start().submit(score_frames_timed, frames, video_duration)
+        except BaseException:
+            self._release_slot()
+            raise
+        future.add_done_callback(self._release_slot)
+        return future
+
+    async def run(self, frames, video_duration):
+        """Returns (chart_data, detailed_results, overall_score); queue wait and per-metric times are recorded as spans."""
+        start = time.perf_counter()
+        results, timings = await asyncio.wrap_future(self.submit(frames, video_duration))
+        elapsed = time.perf_counter() - start
+        record_spans(timings, prefix='metric.')
+        # 待ち行列やプロセス間の受け渡しにかかった時間
+        record_span('scoring_overhead', max(0.0, elapsed - sum(timings.values())))
+        return results
+
+    def collect(self):
+        return [(
+            'runway_scoring_slots_available', 'gauge',
+            'Scoring jobs that can still be accepted before uploads are rejected with 503.',
+            [({}, self.available_slots())],
+        )]
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+scoring_executor = ScoringExecutor(
+    mode=settings.SCORING_EXECUTOR,
+    workers=settings.SCORING_WORKERS,
+    queue_depth=settings.SCORING_QUEUE_DEPTH,
+    retry_after=settings.SCORING_RETRY_AFTER,
+)
+registry.register_collector(scoring_executor.collect)
@@ -1,6 +1,25 @@
+from django.conf import settings
 from rest_framework import serializers
 from adrf.serializers import ModelSerializer
-from .models import User, Challenge, Score
+from .landmarks import LandmarkShapeError, array_to_landmarks, validate_landmarks
+from .models import User, Challenge, Score, ScoringSession, RescoreJob
+
+
+class LandmarkArrayField(serializers.Field):
+    """
+    `raw_landmarks` (frames × poses × 33 landmarks) validated and converted to a
+    (frames, 33, 4) float64 array in one pass (api/landmarks.validate_landmarks), and rendered
+    back in the JSON structure. At most settings.SCORE_UPLOAD_MAX_FRAMES frames are accepted.
+    """
+    def to_internal_value(self, data):
+        try:
+            return validate_landmarks(data, max_frames=settings.SCORE_UPLOAD_MAX_FRAMES)
+        except LandmarkShapeError as exc:
+            raise serializers.ValidationError(str(exc))
+
+    def to_representation(self, value):
+        return array_to_landmarks(value)
+
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     
@@ -23,6 +42,9 @@ class ChallengeSerializer(serializers.HyperlinkedModelSerializer):
 class ScoreSerializer(ModelSerializer):
     # video_duration is now stored in DB
     video_duration = serializers.FloatField(required=False, default=5.0)
+    # 保存形式（JSON / バイナリ）に関わらず、従来どおりのJSON構造で入出力する。
+    # 入力は形状を検証しながら配列に変換され、validated_data['landmark_array'] に入る
+    raw_landmarks = LandmarkArrayField(source='landmark_array')
     
     class Meta:
         model = Score
@@ -32,6 +54,7 @@ class ScoreSerializer(ModelSerializer):
             'challenge',
             'overall_score',
             'feedback_text',
+            'feedback_status',
             'chart_data',
             'raw_landmarks',
             'detailed_results',
@@ -41,8 +64,98 @@ class ScoreSerializer(ModelSerializer):
         read_only_fields = [
             'overall_score',
             'feedback_text',
+            'feedback_status',
+            'chart_data',
+            'detailed_results',
+            'created_at',
+        ]
+
+class ScoreFeedbackSerializer(serializers.ModelSerializer):
+    """AIフィードバックの生成状況をポーリングするための軽量シリアライザ"""
+
+    class Meta:
+        model = Score
+        fields = ['id', 'feedback_status', 'feedback_text']
+
+
+
+class ScoreSummarySerializer(serializers.ModelSerializer):
+    """一覧用の軽量な表現（ランドマーク・詳細結果・フィードバック本文を含まない）"""
+
+    class Meta:
+        model = Score
+        fields = [
+            'id',
+            'user',
+            'challenge',
+            'overall_score',
+            'feedback_status',
+            'chart_data',
+            'video_duration',
+            'created_at',
+        ]
+
+
+class ScoreDetailSerializer(ModelSerializer):
+    """raw_landmarks を含まないスコアの表現（レスポンスサイズがセッションの長さに依存しない）"""
+
+    class Meta:
+        model = Score
+        fields = [
+            'id',
+            'user',
+            'challenge',
+            'overall_score',
+            'feedback_text',
+            'feedback_status',
             'chart_data',
             'detailed_results',
+            'video_duration',
             'created_at',
         ]
 
+class ScoreLandmarksQuerySerializer(serializers.Serializer):
+    """ランドマーク取得のクエリパラメータ: フレーム [start, stop) を step フレームごとに間引いて返す"""
+    start = serializers.IntegerField(required=False, default=0, min_value=0)
+    stop = serializers.IntegerField(required=False, default=None, min_value=0, allow_null=True)
+    step = serializers.IntegerField(required=False, default=1, min_value=1)
+
+    def validate(self, attrs):
+        if attrs['stop'] is not None and attrs['stop'] < attrs['start']:
+            raise serializers.ValidationError('stop must be greater than or equal to start.')
+        return attrs
+
+class ScoreStreamHeaderSerializer(ModelSerializer):
+    """NDJSONアップロードの1行目（ランドマーク以外の入力項目）を検証する"""
+    video_duration = serializers.FloatField(required=False, default=5.0)
+
+    class Meta:
+        model = Score
+        fields = ['user', 'challenge', 'video_duration']
+
+
+class ScoringSessionSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ScoringSession
+        fields = ['id', 'user', 'challenge', 'status', 'frame_count', 'next_sequence', 'score', 'created_at']
+        read_only_fields = ['status', 'frame_count', 'next_sequence', 'score', 'created_at']
+
+class SessionFramesSerializer(serializers.Serializer):
+    """ライブ採点セッションへのフレーム追記（sequence は0から始まる連番）"""
+    sequence = serializers.IntegerField(min_value=0)
+    frames = LandmarkArrayField()
+    # 途中経過の歩行速度スコアを計算するための経過時間（秒）
+    elapsed_seconds = serializers.FloatField(required=False, default=0)
+
+class SessionFinalizeSerializer(serializers.Serializer):
+    video_duration = serializers.FloatField(required=False, default=5.0)
+
+
+class RescoreJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = RescoreJob
+        fields = ['id', 'challenge', 'dry_run', 'chunk_size', 'status', 'last_score_id', 'report', 'error', 'created_at', 'updated_at']
+        read_only_fields = ['status', 'last_score_id', 'report', 'error', 'created_at', 'updated_at']
+        extra_kwargs = {'chunk_size': {'min_value': 1, 'max_value': 10000}}
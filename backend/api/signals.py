@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from .aggregates import apply_score, recompute_aggregates
+from .instrumentation import count_queries
+from .leaderboard import leaderboard_backend, record_best_score, refresh_user_best
+from .models import Challenge, Score, User
+from .response_cache import invalidate_on_commit, score_scopes
+from .user_stats import record_play, refresh_user_stats, rename_challenge_in_activities
+
+# これらの項目が変わりうる保存のときだけ集計を再計算する
+BEST_SCORE_FIELDS = {'overall_score', 'user', 'challenge'}
+AGGREGATE_FIELDS = BEST_SCORE_FIELDS | {'chart_data'}
+USER_STATS_FIELDS = BEST_SCORE_FIELDS | {'created_at'}
+OWNER_FIELDS = {'user', 'challenge'}
+
+
+def _sync_leaderboard_on_commit(user_id, challenge_id):
+    transaction.on_commit(lambda: leaderboard_backend.sync_user(user_id, challenge_id))
+
+
+@receiver(pre_save, sender=Score)
+def remember_previous_owner(sender, instance, update_fields=None, **kwargs):
+    # 別のユーザー・チャレンジに付け替えられたスコアは、元の集計からも外す必要がある
+    instance._previous_owner = None
+    if instance.pk is None or (update_fields is not None and not OWNER_FIELDS & set(update_fields)):
+        return
+    instance._previous_owner = Score.objects.filter(pk=instance.pk).values_list('user_id', 'challenge_id').first()
+
+
+def _previous_owner(instance):
+    """(user_id, challenge_id) the score belonged to before this save, if it changed."""
+    previous = getattr(instance, '_previous_owner', None)
+    return previous if previous is not None and previous != (instance.user_id, instance.challenge_id) else None
+
+
+@receiver(post_save, sender=Score)
+def update_user_best_on_save(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        record_best_score(instance)
+    elif update_fields is None or BEST_SCORE_FIELDS & set(update_fields):
+        refresh_user_best(instance.user_id, instance.challenge_id)
+        previous = _previous_owner(instance)
+        if previous is not None:
+            refresh_user_best(*previous)
+            _sync_leaderboard_on_commit(*previous)
+    else:
+        return
+    _sync_leaderboard_on_commit(instance.user_id, instance.challenge_id)
+
+
+@receiver(post_save, sender=Score)
+def update_aggregates_on_save(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        apply_score(instance.user_id, instance.challenge_id, instance.overall_score, instance.chart_data)
+    elif update_fields is None or AGGREGATE_FIELDS & set(update_fields):
+        recompute_aggregates(instance.user_id, instance.challenge_id)
+        previous = _previous_owner(instance)
+        if previous is not None:
+            recompute_aggregates(*previous)
+
+
+@receiver(post_save, sender=Score)
+def update_user_stats_on_save(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        record_play(instance)
+    elif update_fields is None or USER_STATS_FIELDS & set(update_fields):
+        refresh_user_stats(instance.user_id)
+        previous = _previous_owner(instance)
+        if previous is not None and previous[0] != instance.user_id:
+            refresh_user_stats(previous[0])
+
+
+@receiver(post_delete, sender=Score)
+def update_user_best_on_delete(sender, instance, **kwargs):
+    refresh_user_best(instance.user_id, instance.challenge_id)
+    _sync_leaderboard_on_commit(instance.user_id, instance.challenge_id)
+
+
+@receiver(post_delete, sender=Score)
+def update_aggregates_on_delete(sender, instance, **kwargs):
+    apply_score(instance.user_id, instance.challenge_id, instance.overall_score, instance.chart_data, sign=-1)
+
+
+def _deleted_with_user(origin):
+    """True when the score is removed because its user is being deleted (the user's stats go with it)."""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model is User
+
+
+@receiver(post_delete, sender=Score)
+def update_user_stats_on_delete(sender, instance, origin=None, **kwargs):
+    if _deleted_with_user(origin):
+        return
+    refresh_user_stats(instance.user_id)
+
+
+@receiver(post_save, sender=Score)
+@receiver(post_delete, sender=Score)
+def invalidate_score_responses(sender, instance, **kwargs):
+    invalidate_on_commit(*score_scopes(instance.user_id, instance.challenge_id, instance.pk))
+    previous = _previous_owner(instance)
+    if previous is not None:
+        invalidate_on_commit(*score_scopes(*previous, instance.pk))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_responses(sender, instance, **kwargs):
+    # ランキングには他ユーザーの名前も含まれる
+    invalidate_on_commit(f'user:{instance.pk}', 'users')
+
+
+@receiver(post_save, sender=Challenge)
+def sync_challenge_name_on_save(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is None or 'name' in update_fields:
+        # ダッシュボードの最近のアクティビティは保存時のチャレンジ名を持っている
+        rename_challenge_in_activities(instance.pk, instance.name)
+    invalidate_on_commit(f'challenge:{instance.pk}', 'challenges')
+
+
+@receiver(post_delete, sender=Challenge)
+def invalidate_challenge_responses(sender, instance, **kwargs):
+    invalidate_on_commit(f'challenge:{instance.pk}', 'challenges')
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    # リクエストごとのクエリ数・DB時間を記録する（リクエスト外では何もしない）
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
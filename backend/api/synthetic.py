@@ -0,0 +1,128 @@
+import random
+import numpy as np
+from django.db import connection, transaction
+
+from .aggregates import rebuild_aggregates
+from .landmarks import LANDMARK_COUNT, CHANNELS, X, Y, Z, VISIBILITY
+from .leaderboard import leaderboard_backend, rebuild_user_bests
+from .models import User, Score, UserChallengeBest, ChallengeScoreAggregate, UserChallengeScoreAggregate
+
+BENCHMARK_USER_PREFIX = 'benchmark-user-'
+
+# 正面から撮影した直立姿勢のおおよその基準座標（正規化座標, x: 左右, y: 上下）
+_BASE_POSE = np.full((LANDMARK_COUNT, 2), 0.5)
+_BASE_POSE[:11] = [0.5, 0.15]             # 顔
+_BASE_POSE[[11, 13, 15]] = [0.42, 0.3]    # 左肩・肘・手首
+_BASE_POSE[[12, 14, 16]] = [0.58, 0.3]    # 右肩・肘・手首
+_BASE_POSE[13:17, 1] += [0.12, 0.12, 0.24, 0.24]
+_BASE_POSE[[17, 19, 21]] = [0.4, 0.56]
+_BASE_POSE[[18, 20, 22]] = [0.6, 0.56]
+_BASE_POSE[[23, 25, 27, 29, 31]] = [0.45, 0.55]
+_BASE_POSE[[24, 26, 28, 30, 32]] = [0.55, 0.55]
+_BASE_POSE[25:33, 1] += np.repeat([0.17, 0.34, 0.38, 0.4], 2)
+
+
+_HIP_IDS = [23, 24]
+_SHOULDER_IDS = [11, 12]
+# 腰より上（顔・腕・肩）のランドマーク。体幹の傾きはこれらを腰の中点まわりに回転させて表現する
+_UPPER_BODY_IDS = list(range(23))
+
+
+def _rotate(points, center, degrees):
+    """Rotates (..., 2) points around `center` in the image plane."""
+    theta = np.radians(degrees)
+    rotation = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    return (points - center) @ rotation.T + center
+
+
+def generate_walk(frames=300, fps=30, seed=0, sway_amplitude=0.01, step_frequency=1.8,
+                  trunk_tilt=0.0, shoulder_tilt=0.0, dropout_rate=0.0):
+    """
+    Generates a synthetic walking session as a (frames, 33, 4) landmark array.
+
+    The body sways sideways by `sway_amplitude` (normalized x) at `step_frequency` Hz and every
+    landmark gets a little jitter. `trunk_tilt` leans the upper body around the hip center and
+    `shoulder_tilt` tilts the shoulder line (degrees). `dropout_rate` is the fraction of landmarks
+    whose visibility drops below the scoring threshold, as happens with occlusions.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(frames) / fps
+
+    array = np.zeros((frames, LANDMARK_COUNT, len(CHANNELS)))
+    pose = _BASE_POSE.copy()
+    if trunk_tilt:
+        hip_center = pose[_HIP_IDS].mean(axis=0)
+        pose[_UPPER_BODY_IDS] = _rotate(pose[_UPPER_BODY_IDS], hip_center, trunk_tilt)
+    if shoulder_tilt:
+        shoulder_center = pose[_SHOULDER_IDS].mean(axis=0)
+        pose[_SHOULDER_IDS] = _rotate(pose[_SHOULDER_IDS], shoulder_center, shoulder_tilt)
+
+    array[:, :, [X, Y]] = pose
+    array[:, :, X] += sway_amplitude * np.sin(2 * np.pi * step_frequency * t)[:, None]
+    array[:, :, [X, Y]] += rng.normal(0, 0.002, (frames, LANDMARK_COUNT, 2))
+    array[:, :, Z] = rng.normal(0, 0.1, (frames, LANDMARK_COUNT))
+    array[:, :, VISIBILITY] = rng.uniform(0.9, 1.0, (frames, LANDMARK_COUNT))
+
+    if dropout_rate:
+        dropped = rng.random((frames, LANDMARK_COUNT)) < dropout_rate
+        array[dropped, VISIBILITY] = rng.uniform(0.0, 0.5, int(dropped.sum()))
+
+    # MediaPipe の出力と同じく float32 精度に揃える
+    return array.astype(np.float32).astype(np.float64)
+
+
+# --- Synthetic database rows ---
+
+def populate_scores(challenge, target, scores_per_user=20, created=0):
+    """
+    Bulk-creates synthetic scores (without landmarks) until the challenge holds `target` rows
+    (`created` of which already exist), spread over `target // scores_per_user` benchmark users.
+    Returns the ids of those users.
+    """
+    user_count = max(1, target // scores_per_user)
+    existing_users = User.objects.filter(name__startswith=BENCHMARK_USER_PREFIX).count()
+    if user_count > existing_users:
+        User.objects.bulk_create(
+            [User(name=f'{BENCHMARK_USER_PREFIX}{index}') for index in range(existing_users, user_count)],
+            batch_size=5000,
+        )
+    user_ids = list(User.objects.filter(name__startswith=BENCHMARK_USER_PREFIX).values_list('id', flat=True)[:user_count])
+
+    rng = random.Random(target)
+    batch = []
+    for _ in range(target - created):
+        chart_data = {key: round(rng.uniform(0, 25), 3) for key in Score.METRIC_FIELDS}
+        score = Score(
+            user_id=rng.choice(user_ids),
+            challenge=challenge,
+            overall_score=round(sum(chart_data.values()), 3),
+            chart_data=chart_data,
+            detailed_results={},
+            video_duration=7.0,
+        )
+        score.sync_metric_columns()
+        batch.append(score)
+        if len(batch) >= 5000:
+            Score.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Score.objects.bulk_create(batch)
+
+    # bulk_create はシグナルを送らないため、派生テーブルをまとめて作り直す
+    rebuild_user_bests(challenge.id)
+    rebuild_aggregates(challenge.id)
+    return user_ids
+
+
+def delete_populated(challenge):
+    """Deletes a challenge filled by populate_scores together with its scores and the benchmark users."""
+    with transaction.atomic():
+        # 派生テーブルごと消すため、スコア1件ずつの削除シグナル（集計の更新）は通さずにまとめて削除する
+        UserChallengeBest.objects.filter(challenge=challenge).delete()
+        ChallengeScoreAggregate.objects.filter(challenge=challenge).delete()
+        UserChallengeScoreAggregate.objects.filter(challenge=challenge).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Score._meta.db_table} WHERE challenge_id = %s', [challenge.id])
+        challenge.delete()
+        User.objects.filter(name__startswith=BENCHMARK_USER_PREFIX).delete()
+    leaderboard_backend.invalidate()
@@ -1,3 +1,1648 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import copy
+import gzip
+import importlib
+import itertools
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.db import connection, transaction
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from google.genai import errors
+from rest_framework.exceptions import ParseError
+from rest_framework.request import Request
 
-# Create your tests here.
+from .feedback import (
+    ADVICE_FAILED_MESSAGE, claim_next_job, feedback_header, generate_advice, requeue_stale_jobs, run_feedback_job,
+)
+from .feedback_cache import LocalFeedbackCache, NullFeedbackCache, make_cache_key
+from .aggregates import apply_score, find_drift, rebuild_aggregates, recompute_aggregates
+from .idempotency import SingleFlight
+from . import landmark_codec
+from .instrumentation import MetricsRegistry, count_queries, end_trace, start_trace
+from .landmarks import LANDMARK_COUNT, LandmarkShapeError, array_to_landmarks, validate_landmarks
+from .leaderboard import DatabaseLeaderboard, MemoryLeaderboard, check_best_scores
+from .llm import FakeLLMClient, GeminiClient
+from .metrics import MetricPipeline, ScoringParams, score_frames, score_frames_timed
+from .models import (
+    Challenge, ChallengeScoreAggregate, Score, ScoringSession, User, UserChallengeBest, UserChallengeScoreAggregate, UserStats,
+)
+from .packed_landmarks import DEFAULT_SCALE, MEDIA_TYPE, VISIBILITY_SCALE, encode_packed
+from .parsers import LandmarkNDJSONParser, ORJSONParser, PackedLandmarkParser
+from .prompts import NUMBER_PATTERN, expert_knowledge, quoted_values, quotes_literal_values
+from .serializers import ScoreDetailSerializer, ScoreSummarySerializer
+from .scoring_executor import ScoringExecutor, ScoringUnavailable
+from .rescoring import _lock_out_score_writers, _rebuild_derived
+from .response_cache import bump_scopes, scope_versions
+from .services import ScoringService
+from .user_stats import compute_user_stats, find_stats_drift, refresh_stats_for_users
+from .synthetic import generate_walk
+
+
+class MetricPipelineTests(SimpleTestCase):
+    """チャンクの分け方や途中状態の保存に関わらず、一括で採点した場合と同じ結果になることを確認する"""
+
+    walks = [
+        {'seed': 0},
+        {'seed': 1, 'dropout_rate': 0.2, 'trunk_tilt': 6},
+        {'seed': 2, 'sway_amplitude': 0.04, 'shoulder_tilt': -4, 'dropout_rate': 0.05},
+    ]
+    chunk_sizes = [1, 7, 64, 100, 256]
+
+    def _chunks(self, frames):
+        start = 0
+        for size in itertools.cycle(self.chunk_sizes):
+            if start >= len(frames):
+                return
+            yield frames[start:start + size]
+            start += size
+
+    def test_chunked_feed_matches_whole_array(self):
+        for kwargs in self.walks:
+            with self.subTest(**kwargs):
+                frames = generate_walk(900, **kwargs)
+                expected = score_frames(frames, 30.0)
+
+                pipeline = MetricPipeline(ScoringParams)
+                for chunk in self._chunks(frames):
+                    pipeline.feed(chunk)
+                self.assertEqual(pipeline.frame_count, len(frames))
+                self.assertEqual(pipeline.results(30.0), expected)
+
+    def test_state_round_trip_between_chunks(self):
+        for kwargs in self.walks:
+            with self.subTest(**kwargs):
+                frames = generate_walk(900, **kwargs)
+                expected = score_frames(frames, 30.0)
+
+                # ライブ採点と同じく、チャンクごとに JSON で保存した状態から再開する
+                state = MetricPipeline(ScoringParams).to_state()
+                for chunk in self._chunks(frames):
+                    pipeline = MetricPipeline.from_state(ScoringParams, json.loads(json.dumps(state)))
+                    pipeline.feed(chunk)
+                    state = pipeline.to_state()
+                resumed = MetricPipeline.from_state(ScoringParams, json.loads(json.dumps(state)))
+                self.assertEqual(resumed.results(30.0), expected)
+
+    # 書き換え前のフレームごとの ScoringService.calculate_all が同じ歩行（900 フレーム・30 秒）に対して返した値
+    baseline_results = [
+        (
+            {'symmetry': 23.204, 'trunk_uprightness': 24.099, 'gravity_stability': 17.686, 'walking_speed': 5.952},
+            {
+                'symmetry': {
+                    'shoulders': {'score': 23.204, 'avg_deviation': 0.898, 'avg_tilt_direction': 0.003},
+                    'hips': {'score': 22.352, 'avg_deviation': 1.324, 'avg_tilt_direction': 0.033},
+                },
+                'trunk_uprightness': {'score': 24.099, 'avg_tilt_angle': 0.36, 'avg_tilt_direction': 0.012},
+                'gravity_stability': {
+                    'score': 17.686, 'hip_score': 17.789, 'hip_sway_magnitude': 0.00721, 'avg_hip_sway_direction': 0.0,
+                    'head_score': 17.584, 'head_sway_magnitude': 0.00742, 'avg_head_sway_direction': 0.0,
+                },
+                'walking_speed': {'score': 5.952, 'speed_mps': 0.333, 'time_seconds': 30.0},
+            },
+            70.941,
+        ),
+        (
+            {'symmetry': 23.137, 'trunk_uprightness': 10.008, 'gravity_stability': 17.818, 'walking_speed': 5.952},
+            {
+                'symmetry': {
+                    'shoulders': {'score': 23.137, 'avg_deviation': 0.931, 'avg_tilt_direction': 0.041},
+                    'hips': {'score': 12.898, 'avg_deviation': 6.051, 'avg_tilt_direction': -6.051},
+                },
+                'trunk_uprightness': {'score': 10.008, 'avg_tilt_angle': 5.997, 'avg_tilt_direction': 5.997},
+                'gravity_stability': {
+                    'score': 17.818, 'hip_score': 17.801, 'hip_sway_magnitude': 0.0072, 'avg_hip_sway_direction': 0.0,
+                    'head_score': 17.835, 'head_sway_magnitude': 0.00716, 'avg_head_sway_direction': 0.042,
+                },
+                'walking_speed': {'score': 5.952, 'speed_mps': 0.333, 'time_seconds': 30.0},
+            },
+            56.915,
+        ),
+        (
+            {'symmetry': 16.958, 'trunk_uprightness': 24.06, 'gravity_stability': 0.0, 'walking_speed': 5.952},
+            {
+                'symmetry': {
+                    'shoulders': {'score': 16.958, 'avg_deviation': 4.021, 'avg_tilt_direction': -4.021},
+                    'hips': {'score': 22.29, 'avg_deviation': 1.355, 'avg_tilt_direction': -0.063},
+                },
+                'trunk_uprightness': {'score': 24.06, 'avg_tilt_angle': 0.376, 'avg_tilt_direction': 0.003},
+                'gravity_stability': {
+                    'score': 0.0, 'hip_score': 0, 'hip_sway_magnitude': 0.02821, 'avg_hip_sway_direction': 0.0,
+                    'head_score': 0, 'head_sway_magnitude': 0.02838, 'avg_head_sway_direction': 0.0,
+                },
+                'walking_speed': {'score': 5.952, 'speed_mps': 0.333, 'time_seconds': 30.0},
+            },
+            46.97,
+        ),
+    ]
+
+    def test_matches_per_frame_baseline(self):
+        for kwargs, expected in zip(self.walks, self.baseline_results):
+            with self.subTest(**kwargs):
+                self.assertEqual(score_frames(generate_walk(900, **kwargs), 30.0), expected)
+
+    def test_frames_without_visible_landmarks(self):
+        frames = generate_walk(60)
+        frames[:, :, 3] = 0.0
+        chart_data, detailed_results, overall_score = score_frames(frames, 5.0)
+        self.assertEqual(set(chart_data), set(detailed_results))
+        self.assertEqual(overall_score, round(sum(chart_data.values()), 3))
+
+
+class LandmarkValidationTests(SimpleTestCase):
+    """アップロードされた raw_landmarks の形と値の確認"""
+
+    def _upload(self, frames=3):
+        return array_to_landmarks(generate_walk(frames, seed=0))
+
+    def _with_value(self, value, key='x'):
+        raw = self._upload()
+        raw[1][0][5][key] = value
+        return raw
+
+    def test_valid_upload(self):
+        raw = self._upload()
+        raw.insert(1, [])  # 姿勢が検出されなかったフレームは読み飛ばす
+        del raw[0][0][0]['visibility']
+        array = validate_landmarks(raw)
+        self.assertEqual(array.shape, (3, LANDMARK_COUNT, 4))
+        self.assertEqual(array[0, 0, 3], 0.0)
+
+    def test_bad_shapes(self):
+        raw = self._upload()
+        short_pose = copy.deepcopy(raw)
+        del short_pose[2][0][-1]
+        missing_key = copy.deepcopy(raw)
+        del missing_key[0][0][3]['y']
+        cases = {
+            'not a list': {'frames': raw},
+            'frame not a list': [raw[0], {'pose': raw[1][0]}],
+            'pose not a list': [[{'x': 0.5}]],
+            'short pose': short_pose,
+            'landmark not an object': [[[0.5] * LANDMARK_COUNT]],
+            'missing coordinate': missing_key,
+        }
+        for name, body in cases.items():
+            with self.subTest(name), self.assertRaises(LandmarkShapeError):
+                validate_landmarks(body)
+
+    def test_non_numeric_values(self):
+        for value in ['0.5', '', True, False, None, [0.5], {'v': 0.5}]:
+            for key in ('x', 'visibility'):
+                with self.subTest(value=value, key=key), self.assertRaisesMessage(LandmarkShapeError, 'must be numbers'):
+                    validate_landmarks(self._with_value(value, key))
+
+    def test_integers_are_numbers(self):
+        array = validate_landmarks(self._with_value(1))
+        self.assertEqual(array[1, 5, 0], 1.0)
+
+    def test_non_finite_values(self):
+        for value in [float('nan'), float('inf'), float('-inf'), 10 ** 400]:
+            with self.subTest(value=value), self.assertRaisesMessage(LandmarkShapeError, 'finite'):
+                validate_landmarks(self._with_value(value, 'y'))
+
+    def test_max_frames(self):
+        raw = self._upload(5)
+        self.assertEqual(len(validate_landmarks(raw, max_frames=5)), 5)
+        with self.assertRaisesMessage(LandmarkShapeError, 'Too many frames'):
+            validate_landmarks(raw, max_frames=4)
+
+    def test_error_names_the_frame_of_a_chunk(self):
+        raw = self._upload()
+        del raw[2][0][-1]
+        with self.assertRaisesMessage(LandmarkShapeError, 'Frame 258:'):
+            validate_landmarks(raw, first_frame=256)
+
+
+class LandmarkStorageTests(TransactionTestCase):
+    """ランドマークのバイナリ保存形式（api/landmark_codec.py）と Score の保存形式の切り替えを確認する"""
+
+    def setUp(self):
+        self.frames = generate_walk(300, seed=7)
+        self.user = User.objects.create(name='walker')
+        self.challenge = Challenge.objects.create(name='runway', description='')
+
+    def _compressions(self):
+        return ['none', 'zlib'] + (['zstd'] if landmark_codec.zstandard is not None else [])
+
+    def test_round_trip(self):
+        for compression in self._compressions():
+            with self.subTest(compression=compression):
+                blob = landmark_codec.encode_landmarks(self.frames, compression=compression, segment_frames=64)
+                decoded = landmark_codec.decode_landmarks(blob)
+                self.assertEqual(decoded.dtype, np.float64)
+                np.testing.assert_array_equal(decoded, self.frames.astype(np.float32))
+                self.assertEqual(landmark_codec.frame_count(blob), len(self.frames))
+        half = landmark_codec.decode_landmarks(landmark_codec.encode_landmarks(self.frames, dtype='float16'))
+        np.testing.assert_allclose(half, self.frames, atol=1e-3)
+        # float32 は JSON の倍精度の半分以下の大きさ（圧縮なしで比較）
+        self.assertLess(len(landmark_codec.encode_landmarks(self.frames, compression='none')), self.frames.nbytes // 2 + 64)
+
+    def test_frame_ranges_and_incremental_encoding(self):
+        encoder = landmark_codec.LandmarkEncoder(segment_frames=64)
+        for start in range(0, len(self.frames), 50):
+            encoder.feed(self.frames[start:start + 50])
+        blob = encoder.finish()
+        # 50 フレームずつの追記は 100 フレームごとの区切りになる（範囲の読み出しで区切りをまたぐ）
+        self.assertEqual([count for _, count, _ in landmark_codec.iter_segments(blob)], [100, 100, 100])
+
+        expected = self.frames.astype(np.float32)
+        for start, stop in [(0, None), (0, 1), (63, 65), (100, 228), (250, 400), (299, None), (300, None), (10, 10)]:
+            with self.subTest(start=start, stop=stop):
+                np.testing.assert_array_equal(landmark_codec.decode_landmarks(blob, start, stop), expected[start:stop])
+
+    def test_concat_blobs(self):
+        parts = [self.frames[:100], self.frames[100:130], self.frames[130:]]
+        blob = landmark_codec.concat_blobs(landmark_codec.encode_landmarks(part) for part in parts)
+        np.testing.assert_array_equal(landmark_codec.decode_landmarks(blob), self.frames.astype(np.float32))
+        self.assertEqual(landmark_codec.frame_count(landmark_codec.concat_blobs([])), 0)
+        with self.assertRaises(landmark_codec.LandmarkCodecError):
+            landmark_codec.concat_blobs([landmark_codec.encode_landmarks(parts[0]), landmark_codec.encode_landmarks(parts[1], dtype='float16')])
+
+    def test_bad_blobs(self):
+        blob = landmark_codec.encode_landmarks(self.frames)
+        for bad in (b'', b'RWL', b'XXXX' + blob[4:], blob[:4] + bytes([9]) + blob[5:]):
+            with self.subTest(bad=bad[:8]), self.assertRaises(landmark_codec.LandmarkCodecError):
+                landmark_codec.decode_landmarks(bad)
+        with self.assertRaises(landmark_codec.LandmarkCodecError):
+            landmark_codec.LandmarkEncoder(dtype='float64')
+        if landmark_codec.zstandard is None:
+            with self.assertRaisesMessage(landmark_codec.LandmarkCodecError, 'zstandard'):
+                landmark_codec.encode_landmarks(self.frames, compression='zstd')
+
+    def _saved(self, **fields):
+        score = Score(user=self.user, challenge=self.challenge, overall_score=50, chart_data={}, **fields)
+        score.save()
+        return Score.objects.get(pk=score.pk)
+
+    def test_score_storage_formats(self):
+        raw = array_to_landmarks(self.frames)
+        with override_settings(LANDMARK_STORAGE_FORMAT='binary', LANDMARK_STORAGE_COMPRESSION='zlib'):
+            score = self._saved(landmarks=raw)
+        self.assertIsNone(score.raw_landmarks)
+        self.assertEqual(landmark_codec.frame_count(score.landmarks_blob), len(self.frames))
+        self.assertEqual(score.landmark_frame_count, len(self.frames))
+        np.testing.assert_array_equal(score.landmark_frames(10, 20), self.frames[10:20].astype(np.float32))
+        np.testing.assert_allclose(score.landmark_array, self.frames, rtol=1e-6)
+
+        with override_settings(LANDMARK_STORAGE_FORMAT='json'):
+            legacy = self._saved(landmarks=raw)
+        self.assertIsNone(legacy.landmarks_blob)
+        self.assertEqual(legacy.landmarks, raw)
+        # 形式の異なる行も同じ配列として読める
+        np.testing.assert_array_equal(legacy.landmark_array, self.frames)
+        self.assertEqual(legacy.landmark_frame_count, len(self.frames))
+        np.testing.assert_array_equal(legacy.landmark_frames(10, 20), self.frames[10:20])
+        self.assertEqual(self._saved().landmarks, [])
+
+
+class ScoreProjectionTests(TransactionTestCase):
+    """スコアの一覧・詳細がランドマークを読み込まず、ランドマークは専用のエンドポイントで範囲指定して取得できることを確認する"""
+
+    landmark_columns = ('"raw_landmarks"', '"landmarks_blob"')
+
+    def setUp(self):
+        self.frames = generate_walk(300, seed=8)
+        user = User.objects.create(name='walker')
+        challenge = Challenge.objects.create(name='runway', description='')
+        self.scores = {}
+        for storage in ('binary', 'json'):
+            with override_settings(LANDMARK_STORAGE_FORMAT=storage):
+                score = Score(user=user, challenge=challenge, overall_score=50, chart_data={'symmetry': 20.0},
+                              detailed_results={}, feedback_text='advice')
+                score.landmarks = array_to_landmarks(self.frames)
+                score.save()
+            self.scores[storage] = score
+
+    def _get(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        score_queries = [query['sql'] for query in queries if 'FROM "api_score"' in query['sql']]
+        return response, score_queries
+
+    def test_list_and_detail_leave_out_landmarks(self):
+        response, queries = self._get('/api/scores/')
+        self.assertEqual(response.status_code, 200)
+        for item in response.json()['results']:
+            self.assertEqual(sorted(item), sorted(ScoreSummarySerializer.Meta.fields))
+        for sql in queries:
+            for column in self.landmark_columns + ('"detailed_results"', '"feedback_text"'):
+                self.assertNotIn(column, sql)
+
+        score = self.scores['binary']
+        response, queries = self._get(f'/api/scores/{score.id}/')
+        self.assertEqual(sorted(response.json()), sorted(ScoreDetailSerializer.Meta.fields))
+        self.assertEqual(response.json()['feedback_text'], 'advice')
+        self.assertTrue(queries)
+        for sql in queries:
+            for column in self.landmark_columns:
+                self.assertNotIn(column, sql)
+
+    def test_landmark_ranges(self):
+        for storage, score in self.scores.items():
+            # バイナリ保存は float32 で保存される
+            frames = self.frames.astype(np.float32).astype(np.float64) if storage == 'binary' else self.frames
+            for params, (start, stop, step) in (
+                ({}, (0, None, 1)),
+                ({'start': 250}, (250, None, 1)),
+                ({'start': 10, 'stop': 20}, (10, 20, 1)),
+                ({'start': 5, 'stop': 290, 'step': 30}, (5, 290, 30)),
+                ({'step': 100}, (0, None, 100)),
+                ({'start': 400}, (400, None, 1)),
+            ):
+                with self.subTest(storage=storage, **params):
+                    response = self.client.get(f'/api/scores/{score.id}/landmarks/', params)
+                    self.assertEqual(response.status_code, 200)
+                    body = response.json()
+                    self.assertEqual(body['raw_landmarks'], array_to_landmarks(frames[start:stop:step]))
+                    self.assertEqual((body['id'], body['frame_count'], body['start'], body['step']), (score.id, 300, start, step))
+
+    def test_invalid_landmark_queries(self):
+        url = f'/api/scores/{self.scores["binary"].id}/landmarks/'
+        for params in ({'start': -1}, {'start': 20, 'stop': 10}, {'step': 0}, {'stop': 'end'}):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+        missing = max(score.id for score in self.scores.values()) + 1
+        self.assertEqual(self.client.get(f'/api/scores/{missing}/landmarks/').status_code, 404)
+
+
+class PackedLandmarkUploadTests(SimpleTestCase):
+    """量子化したバイナリ形式のアップロードが JSON と同じ採点結果になることを確認する"""
+
+    meta = {'user': 1, 'challenge': 2, 'video_duration': 20.0}
+
+    def _parse(self, body, content_type=MEDIA_TYPE, **headers):
+        request = RequestFactory().post('/api/score/', data=body, content_type=content_type, **headers)
+        return Request(request, parsers=[ORJSONParser(), LandmarkNDJSONParser(), PackedLandmarkParser()]).data
+
+    def _decode(self, data):
+        return np.concatenate(list(data['raw_landmarks'].chunks()))
+
+    def _score(self, frames):
+        service = ScoringService(None, video_duration=self.meta['video_duration'])
+        service.calculate_metrics_streaming([frames])
+        return service.overall_score, service.chart_data
+
+    def test_round_trip_keeps_precision_and_scores(self):
+        for kwargs in ({}, {'dropout_rate': 0.1, 'trunk_tilt': 5}, {'sway_amplitude': 0.03, 'shoulder_tilt': 3}):
+            with self.subTest(**kwargs):
+                frames = generate_walk(600, seed=1, **kwargs)
+                data = self._parse(encode_packed(self.meta, frames))
+                self.assertEqual({name: data[name] for name in self.meta}, self.meta)
+                decoded = self._decode(data)
+
+                self.assertEqual(decoded.shape, frames.shape)
+                self.assertLessEqual(np.abs(decoded[:, :, :3] - frames[:, :, :3]).max(), 0.5 / DEFAULT_SCALE + 1e-12)
+                self.assertLessEqual(np.abs(decoded[:, :, 3] - frames[:, :, 3]).max(), 1 / VISIBILITY_SCALE)
+
+                # JSON で送った場合と同じ採点結果（小数第3位の丸め誤差の範囲）
+                json_score, json_chart = self._score(validate_landmarks(array_to_landmarks(frames)))
+                packed_score, packed_chart = self._score(decoded)
+                self.assertAlmostEqual(packed_score, json_score, delta=0.01)
+                for metric, value in json_chart.items():
+                    self.assertAlmostEqual(packed_chart[metric], value, delta=0.01)
+
+    def test_visibility_stays_on_its_side_of_the_threshold(self):
+        threshold = ScoringParams.VISIBILITY_THRESHOLD
+        frames = generate_walk(4)
+        frames[:, :, 3] = np.linspace(threshold - 0.005, threshold + 0.005, frames[:, :, 3].size).reshape(frames.shape[:2])
+        decoded = self._decode(self._parse(encode_packed(self.meta, frames)))
+        np.testing.assert_array_equal(decoded[:, :, 3] > threshold, frames[:, :, 3] > threshold)
+
+    def test_compressed_bodies(self):
+        frames = generate_walk(300, seed=2)
+        packed = encode_packed(self.meta, frames)
+        for encoding in ('gzip', 'deflate'):
+            with self.subTest(encoding=encoding):
+                body = gzip.compress(packed) if encoding == 'gzip' else zlib.compress(packed)
+                data = self._parse(body, HTTP_CONTENT_ENCODING=encoding)
+                np.testing.assert_array_equal(self._decode(data), self._decode(self._parse(packed)))
+
+        json_body = gzip.compress(b'{"raw_landmarks": [[[]]], "user": 1}')
+        self.assertEqual(self._parse(json_body, 'application/json', HTTP_CONTENT_ENCODING='gzip')['user'], 1)
+
+
+class ScoreUploadTestCase(TransactionTestCase):
+    """POST /api/score/ を呼ぶテストの共通部分（採点はスレッドで行い、フィードバックは積まない）"""
+
+    def setUp(self):
+        self.user = User.objects.create(name='walker')
+        self.challenge = Challenge.objects.create(name='runway', description='')
+        self.meta = {'user': self.user.id, 'challenge': self.challenge.id, 'video_duration': 4.0}
+        self.frames = generate_walk(120, seed=4)
+
+        self.executor = ScoringExecutor('thread', workers=2, queue_depth=4, retry_after=1)
+        self.addCleanup(lambda: self.executor._executor and self.executor._executor.shutdown())
+        for target, value in (
+            ('api.views.scoring_executor', self.executor),
+            ('api.services.enqueue_feedback', lambda score_id: None),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _json(self, meta, frames):
+        return json.dumps({**meta, 'raw_landmarks': array_to_landmarks(frames)})
+
+    def _ndjson(self, meta, frames):
+        lines = [json.dumps(meta)] + [json.dumps(frame) for frame in array_to_landmarks(frames)]
+        return ('\n'.join(lines) + '\n').encode()
+
+    def _post(self, body, content_type='application/json', key=None):
+        headers = {'Idempotency-Key': key} if key is not None else None
+        return async_to_sync(AsyncClient().post)('/api/score/', data=body, content_type=content_type, headers=headers)
+
+
+class ScoreUploadBodyTests(ScoreUploadTestCase):
+    """JSON (orjson) と NDJSON のスコア送信の解析と、オブジェクト以外の本文の扱いを確認する"""
+
+    def _parse(self, body, content_type):
+        request = RequestFactory().post('/api/score/', data=body, content_type=content_type)
+        return Request(request, parsers=[ORJSONParser(), LandmarkNDJSONParser()]).data
+
+    def test_parsers(self):
+        data = self._parse(json.dumps({**self.meta, 'raw_landmarks': [[[]]]}), 'application/json')
+        self.assertEqual(data, {**self.meta, 'raw_landmarks': [[[]]]})
+        self.assertEqual(self._parse(b'[]', 'application/json'), [])
+
+        data = self._parse(self._ndjson(self.meta, self.frames), 'application/x-ndjson')
+        self.assertEqual({name: value for name, value in data.items() if name != 'raw_landmarks'}, self.meta)
+        np.testing.assert_array_equal(np.concatenate(list(data['raw_landmarks'].chunks(chunk_frames=50))), self.frames)
+
+        for name, body in {
+            'blank lines only': b'\n  \n',
+            'header not an object': b'[1, 2]\n[[]]\n',
+            'broken header': b'{"user": \n',
+        }.items():
+            with self.subTest(name), self.assertRaises(ParseError):
+                self._parse(body, 'application/x-ndjson')
+        data = self._parse(json.dumps(self.meta).encode() + b'\n{"x": 1}\n', 'application/x-ndjson')
+        with self.assertRaisesMessage(ParseError, 'Line 2'):
+            list(data['raw_landmarks'].chunks())
+
+    def test_json_and_ndjson_uploads_score_the_same(self):
+        json_response = self._post(self._json(self.meta, self.frames))
+        self.assertEqual(json_response.status_code, 201)
+
+        other = User.objects.create(name='other walker')
+        ndjson_response = self._post(self._ndjson({**self.meta, 'user': other.id}, self.frames), 'application/x-ndjson')
+        self.assertEqual(ndjson_response.status_code, 201)
+        for field in ('overall_score', 'chart_data'):
+            self.assertEqual(ndjson_response.json()[field], json_response.json()[field])
+
+        # 同じ内容は送信形式が違っても再送として扱われる
+        resent = self._post(self._ndjson(self.meta, self.frames), 'application/x-ndjson')
+        self.assertEqual(resent.status_code, 200)
+        self.assertEqual(resent['Idempotent-Replayed'], 'true')
+        self.assertEqual(resent.json()['id'], json_response.json()['id'])
+        self.assertEqual(Score.objects.count(), 2)
+
+    def test_non_object_bodies_are_rejected(self):
+        for body in (b'[]', b'[{"user": 1}]', b'"score"', b'42', b'null'):
+            with self.subTest(body=body):
+                response = self._post(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('non_field_errors', response.json())
+        response = self._post(self._ndjson({**self.meta, 'user': 'nobody'}, self.frames), 'application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('user', response.json())
+        self.assertFalse(Score.objects.exists())
+
+
+class ScoreIdempotencyTests(ScoreUploadTestCase):
+    """再送されたスコア送信が採点し直されずに最初のスコアで返されることを確認する"""
+
+    def assertReplayed(self, response, first):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(response.json()['id'], first.json()['id'])
+
+    def test_idempotency_key_replay(self):
+        body = self._json(self.meta, self.frames)
+        first = self._post(body, key='walk-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        self.assertReplayed(self._post(body, key='walk-1'), first)
+        # キー付きの NDJSON の再送は本文を読まずに返す
+        self.assertReplayed(self._post(self._ndjson(self.meta, self.frames), 'application/x-ndjson', key='walk-1'), first)
+        self.assertEqual(Score.objects.count(), 1)
+
+    def test_key_reused_for_a_different_payload(self):
+        self.assertEqual(self._post(self._json(self.meta, self.frames), key='walk-1').status_code, 201)
+
+        other_frames = generate_walk(120, seed=5)
+        response = self._post(self._json(self.meta, other_frames), key='walk-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['detail'], 'This Idempotency-Key was already used for a different submission.')
+        response = self._post(self._json({**self.meta, 'video_duration': 5.0}, self.frames), key='walk-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Score.objects.count(), 1)
+
+    def test_payload_hash_dedup(self):
+        first = self._post(self._json(self.meta, self.frames))
+        self.assertEqual(first.status_code, 201)
+        # キーがなくても同じ内容は再送とみなす（空白やキーの順序の違いは問わない）
+        reordered = json.dumps({'raw_landmarks': array_to_landmarks(self.frames), **self.meta}, indent=1)
+        self.assertReplayed(self._post(reordered), first)
+
+        # 内容や送信者が違えば別のスコアになる
+        other_user = User.objects.create(name='other walker')
+        for meta, frames in (
+            ({**self.meta, 'video_duration': 5.0}, self.frames),
+            (self.meta, generate_walk(120, seed=5)),
+            ({**self.meta, 'user': other_user.id}, self.frames),
+        ):
+            with self.subTest(meta=meta):
+                self.assertEqual(self._post(self._json(meta, frames)).status_code, 201)
+        self.assertEqual(Score.objects.count(), 4)
+
+    @override_settings(SCORE_DEDUP_WINDOW=0)
+    def test_dedup_window_disabled(self):
+        body = self._json(self.meta, self.frames)
+        self.assertEqual([self._post(body).status_code for _ in range(2)], [201, 201])
+        self.assertEqual(Score.objects.count(), 2)
+
+    def test_concurrent_duplicates_are_scored_once(self):
+        calls = []
+        run = self.executor.run
+
+        async def slow_run(landmark_array, video_duration):
+            calls.append(len(landmark_array))
+            # 採点中に残りの再送が届くようにする
+            await asyncio.sleep(0.1)
+            return await run(landmark_array, video_duration)
+
+        body = self._json(self.meta, self.frames)
+
+        async def post_all():
+            client = AsyncClient()
+            return await asyncio.gather(*(
+                client.post('/api/score/', data=body, content_type='application/json') for _ in range(4)
+            ))
+
+        with mock.patch.object(self.executor, 'run', slow_run):
+            responses = async_to_sync(post_all)()
+
+        self.assertEqual(calls, [len(self.frames)])
+        self.assertEqual(sorted(response.status_code for response in responses), [200, 200, 200, 201])
+        self.assertEqual({response.json()['id'] for response in responses}, set(Score.objects.values_list('id', flat=True)))
+        self.assertEqual(Score.objects.count(), 1)
+
+
+class ScoringCapacityTests(ScoreUploadTestCase):
+    """採点の受け付け枠が埋まったときに 503 と Retry-After を返し、処理後に枠が戻ることを確認する"""
+
+    def test_full_queue_returns_503_with_retry_after(self):
+        self.executor.retry_after = 7
+        release = threading.Event()
+
+        def blocked(frames, video_duration):
+            release.wait(timeout=10)
+            return score_frames_timed(frames, video_duration)
+
+        with mock.patch('api.scoring_executor.score_frames_timed', blocked):
+            futures = [self.executor.submit(self.frames, 4.0) for _ in range(self.executor.capacity)]
+            self.assertEqual(self.executor.available_slots(), 0)
+            self.assertEqual(self.executor.collect()[0][3], [({}, 0)])
+            with self.assertRaises(ScoringUnavailable):
+                self.executor.submit(self.frames, 4.0)
+
+            response = self._post(self._json(self.meta, self.frames))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '7')
+            self.assertFalse(Score.objects.exists())
+
+            release.set()
+            for future in futures:
+                future.result(timeout=10)
+        # 完了コールバックは結果の受け取り後に走ることがある
+        for _ in range(100):
+            if self.executor.available_slots() == self.executor.capacity:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.executor.available_slots(), self.executor.capacity)
+        self.assertEqual(self._post(self._json(self.meta, self.frames)).status_code, 201)
+
+    def test_slot_is_released_when_submit_fails(self):
+        with mock.patch.object(self.executor, 'start', side_effect=RuntimeError('no pool')):
+            for _ in range(self.executor.capacity + 1):
+                with self.assertRaises(RuntimeError):
+                    self.executor.submit(self.frames, 4.0)
+        self.assertEqual(self.executor.available_slots(), self.executor.capacity)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """同じキーの同時実行が1回の計算にまとめられることを確認する"""
+
+    def test_concurrent_calls_share_one_computation(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value * 2
+
+        async def main():
+            results = await asyncio.gather(
+                *(flights.run('a', lambda: compute(1)) for _ in range(3)),
+                flights.run('b', lambda: compute(5)),
+            )
+            return results, dict(flights._inflight)
+
+        results, inflight = async_to_sync(main)()
+        self.assertEqual(results, [(2, False), (2, True), (2, True), (10, False)])
+        self.assertEqual(calls, [1, 5])
+        self.assertEqual(inflight, {})
+
+    def test_errors_reach_every_caller_and_the_key_is_released(self):
+        flights = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('boom')
+
+        async def main():
+            results = await asyncio.gather(*(flights.run('a', fail) for _ in range(2)), return_exceptions=True)
+            # 失敗した後は同じキーでも計算し直す
+            return results, await flights.run('a', lambda: asyncio.sleep(0, 'ok'))
+
+        results, retried = async_to_sync(main)()
+        self.assertEqual([type(result) for result in results], [ValueError, ValueError])
+        self.assertEqual(retried, ('ok', False))
+
+    def test_cancelled_caller_does_not_cancel_the_computation(self):
+        flights = SingleFlight()
+        finished = []
+
+        async def compute():
+            await asyncio.sleep(0.02)
+            finished.append(True)
+            return 'done'
+
+        async def main():
+            first = asyncio.ensure_future(flights.run('a', compute))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(flights.run('a', compute))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(async_to_sync(main)(), ('done', True))
+        self.assertEqual(finished, [True])
+
+
+class ScoringSessionAPITests(TransactionTestCase):
+    """ライブ採点セッションのチャンク追記・確定と、順番どおりでない送信の扱いを確認する"""
+
+    def setUp(self):
+        patcher = mock.patch('api.services.enqueue_feedback', lambda score_id: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(name='walker')
+        self.challenge = Challenge.objects.create(name='runway', description='')
+        self.frames = generate_walk(300, seed=6)
+        self.chunks = [self.frames[start:start + 100] for start in range(0, len(self.frames), 100)]
+
+    def _post(self, url, payload):
+        return self.client.post(url, data=json.dumps(payload), content_type='application/json')
+
+    def _open(self):
+        response = self._post('/api/sessions/', {'user': self.user.id, 'challenge': self.challenge.id})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def _send(self, session_id, sequence, frames, elapsed_seconds=0):
+        return self._post(f'/api/sessions/{session_id}/frames/', {
+            'sequence': sequence, 'frames': array_to_landmarks(frames), 'elapsed_seconds': elapsed_seconds,
+        })
+
+    def test_chunks_then_finalize(self):
+        session_id = self._open()
+        for sequence, chunk in enumerate(self.chunks):
+            response = self._send(session_id, sequence, chunk, elapsed_seconds=sequence + 1.0)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['next_sequence'], sequence + 1)
+            self.assertEqual(response.json()['frame_count'], 100 * (sequence + 1))
+        # 途中経過はそこまでのフレームを一括で採点した結果と同じ
+        self.assertEqual(response.json()['overall_score'], score_frames(self.frames, 3.0)[2])
+
+        response = self._post(f'/api/sessions/{session_id}/finalize/', {'video_duration': 10.0})
+        self.assertEqual(response.status_code, 201)
+        chart_data, _, overall_score = score_frames(self.frames, 10.0)
+        self.assertEqual((response.json()['overall_score'], response.json()['chart_data']), (overall_score, chart_data))
+
+        score = Score.objects.get(pk=response.json()['id'])
+        np.testing.assert_allclose(score.landmark_frames(), self.frames, rtol=1e-6)
+        session = ScoringSession.objects.get(pk=session_id)
+        self.assertEqual((session.status, session.score_id), (ScoringSession.Status.FINALIZED, score.id))
+        self.assertFalse(session.chunks.exists())
+
+        # 確定の再送は同じスコアを返す
+        again = self._post(f'/api/sessions/{session_id}/finalize/', {'video_duration': 10.0})
+        self.assertEqual((again.status_code, again.json()['id']), (200, score.id))
+        self.assertEqual(Score.objects.count(), 1)
+
+    def test_out_of_order_and_duplicate_chunks(self):
+        session_id = self._open()
+        self.assertEqual(self._send(session_id, 0, self.chunks[0]).status_code, 200)
+
+        # 飛ばした番号のチャンクは受け付けない
+        response = self._send(session_id, 2, self.chunks[2])
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Expected chunk 1', response.json()['detail'])
+
+        # 保存済みのチャンクの再送は何もしない（別の内容でも上書きしない）
+        for frames in (self.chunks[0], self.chunks[1]):
+            response = self._send(session_id, 0, frames)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.json()['next_sequence'], response.json()['frame_count']), (1, 100))
+        self.assertEqual(response.json()['overall_score'], score_frames(self.chunks[0], 0)[2])
+
+        self.assertEqual(self._send(session_id, 1, self.chunks[1]).status_code, 200)
+        self.assertEqual(ScoringSession.objects.get(pk=session_id).chunks.count(), 2)
+
+        self.assertEqual(self._post(f'/api/sessions/{session_id}/finalize/', {}).status_code, 201)
+        response = self._send(session_id, 2, self.chunks[2])
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('already finalized', response.json()['detail'])
+
+    def test_invalid_requests(self):
+        session_id = self._open()
+        # フレームのないセッションは確定できない
+        self.assertEqual(self._post(f'/api/sessions/{session_id}/finalize/', {}).status_code, 400)
+        self.assertEqual(self._post(f'/api/sessions/{session_id}/frames/', {'sequence': -1, 'frames': []}).status_code, 400)
+        self.assertEqual(self._post(f'/api/sessions/{session_id}/frames/', {'sequence': 0, 'frames': [[[{'x': 1}]]]}).status_code, 400)
+        self.assertEqual(self._send(session_id + 1, 0, self.chunks[0]).status_code, 404)
+
+        with override_settings(SCORE_UPLOAD_MAX_FRAMES=150):
+            self.assertEqual(self._send(session_id, 0, self.chunks[0]).status_code, 200)
+            response = self._send(session_id, 1, self.chunks[1])
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('frames', response.json())
+        self.assertEqual(ScoringSession.objects.get(pk=session_id).next_sequence, 1)
+
+
+class CountingLLMClient(FakeLLMClient):
+    stream_delay = 0
+
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        return super().generate(prompt)
+
+    def generate_stream(self, prompt):
+        self.calls += 1
+        return super().generate_stream(prompt)
+
+
+class FeedbackCacheTests(SimpleTestCase):
+    """キャッシュ済みのアドバイスが、同じキーになる別のスコアの数値を表示しないことを確認する"""
+
+    advice = (
+        "## 🚀 未来を変えるウォーキング分析：現在のスコア {{overall_score}}点\n"
+        "- **分析:** 体幹の傾きは {{trunk_uprightness.avg_tilt_angle}}度、"
+        "腰の左右差は {{symmetry.hips.avg_deviation}}度（{{symmetry.hips.score}}点）です。\n"
+    )
+
+    def setUp(self):
+        patcher = mock.patch('api.feedback.feedback_cache', LocalFeedbackCache(16, 60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        chart_data, self.results, self.overall = score_frames(generate_walk(300, seed=3), 10.0)
+        # ランク・丸めたスコア・向きが同じで、細かい数値だけが違う結果
+        self.other_results = copy.deepcopy(self.results)
+        self.other_results['trunk_uprightness']['avg_tilt_angle'] += 0.123
+        self.other_results['symmetry']['hips']['avg_deviation'] += 0.234
+        self.other_results['symmetry']['hips']['score'] = round(self.results['symmetry']['hips']['score'] - 0.111, 3)
+        self.other_overall = round(self.overall - 0.111, 3)
+        knowledge_hash = expert_knowledge.current().hash
+        self.assertEqual(
+            make_cache_key(self.results, self.overall, knowledge_hash),
+            make_cache_key(self.other_results, self.other_overall, knowledge_hash),
+        )
+
+    def _literals(self, results, overall):
+        return {str(value) for value in quoted_values(results, overall).values()}
+
+    def test_cached_advice_shows_each_scores_own_numbers(self):
+        client = CountingLLMClient(self.advice)
+        streamed = []
+        first = generate_advice(self.results, self.overall, client, on_text=streamed.append)
+        second = generate_advice(self.other_results, self.other_overall, client)
+        self.assertEqual(client.calls, 1)
+
+        for text, (results, overall), (other_results, other_overall) in (
+            (first, (self.results, self.overall), (self.other_results, self.other_overall)),
+            (second, (self.other_results, self.other_overall), (self.results, self.overall)),
+        ):
+            self.assertNotIn('{{', text)
+            self.assertIn(f"現在のスコア {overall}点", text)
+            self.assertIn(f"{results['symmetry']['hips']['avg_deviation']}度", text)
+            self.assertTrue(quotes_literal_values(text, results, overall))
+            self.assertFalse(quotes_literal_values(text, other_results, other_overall))
+            shown = set(NUMBER_PATTERN.findall(text))
+            self.assertFalse((shown & self._literals(other_results, other_overall)) - self._literals(results, overall))
+
+        # ストリーミング中の途中経過にも、置き換え前のプレースホルダは出ない
+        self.assertEqual(streamed[-1], first)
+        for text in streamed:
+            self.assertNotIn('{', text)
+            self.assertTrue(first.startswith(text))
+
+    def test_advice_quoting_literal_values_is_not_cached(self):
+        client = CountingLLMClient(
+            f"現在のスコア {self.overall}点。体幹の傾きは {self.results['trunk_uprightness']['avg_tilt_angle']:.1f}度です。"
+        )
+        generate_advice(self.results, self.overall, client)
+        second = generate_advice(self.other_results, self.other_overall, client)
+        self.assertEqual(client.calls, 2)
+        self.assertEqual(second, client.text)
+
+
+@override_settings(LLM_CONTEXT_CACHE=True)
+class GeminiContextCacheTests(SimpleTestCase):
+    """コンテキストキャッシュ固有のエラーのときだけ、キャッシュなしで再試行することを確認する"""
+
+    prompt = SimpleNamespace(system_instruction='instruction', contents='contents', version='v1')
+    response = SimpleNamespace(text='advice', usage_metadata=None)
+
+    def _client(self, error):
+        client = GeminiClient()
+        client._client = mock.Mock()
+        client._client.caches.create.return_value = SimpleNamespace(name='cachedContents/abc')
+        client._client.models.generate_content.side_effect = [error, self.response]
+        return client
+
+    def _error(self, code, message):
+        return errors.ClientError(code, {'error': {'code': code, 'message': message, 'status': 'ERROR'}})
+
+    def test_retries_without_rejected_cache(self):
+        for code, message in ((404, 'Not found'), (400, 'CachedContent has expired'), (403, 'No access to cached content')):
+            with self.subTest(code=code):
+                client = self._client(self._error(code, message))
+                self.assertEqual(client.generate(self.prompt), 'advice')
+                retry_config = client._client.models.generate_content.call_args.kwargs['config']
+                self.assertIsNone(retry_config.cached_content)
+                self.assertEqual(retry_config.system_instruction, 'instruction')
+                self.assertNotIn('v1', client._context_caches)
+
+    def test_other_client_errors_are_raised(self):
+        for code, message in ((429, 'Resource exhausted'), (400, 'Invalid argument')):
+            with self.subTest(code=code):
+                client = self._client(self._error(code, message))
+                with self.assertRaises(errors.ClientError):
+                    client.generate(self.prompt)
+                self.assertEqual(client._client.models.generate_content.call_count, 1)
+
+        client = self._client(None)
+        client._client.models.generate_content_stream.side_effect = self._error(429, 'Resource exhausted')
+        with self.assertRaises(errors.ClientError):
+            list(client.generate_stream(self.prompt))
+        self.assertEqual(client._client.models.generate_content_stream.call_count, 1)
+
+
+class RecordingLLMClient(FakeLLMClient):
+    """生成中の各時点で、ジョブの状態と書き込まれた途中経過を記録するクライアント"""
+    stream_delay = 0
+
+    def __init__(self, score_id):
+        self.score_id = score_id
+        self.seen = []
+
+    def generate_stream(self, prompt):
+        for piece in super().generate_stream(prompt):
+            self.seen.append(Score.objects.values_list('feedback_status', 'feedback_text').get(pk=self.score_id))
+            yield piece
+
+
+class FailingLLMClient(FakeLLMClient):
+    def generate_stream(self, prompt):
+        raise RuntimeError('LLM unavailable')
+
+
+class FeedbackQueueTestCase(TransactionTestCase):
+    """フィードバック生成待ちのスコアを作るための共通部分"""
+
+    def setUp(self):
+        # 同じ分析結果のキャッシュ済みアドバイスで生成が省略されないようにする
+        patcher = mock.patch('api.feedback.feedback_cache', NullFeedbackCache(0, 0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(name='walker')
+        self.challenge = Challenge.objects.create(name='runway', description='')
+
+    def _pending_score(self):
+        chart_data, detailed_results, overall_score = score_frames(generate_walk(300, seed=3), 10.0)
+        return Score.objects.create(
+            user=self.user, challenge=self.challenge, overall_score=overall_score,
+            chart_data=chart_data, detailed_results=detailed_results,
+            feedback_status=Score.FeedbackStatus.PENDING,
+        )
+
+
+@override_settings(FEEDBACK_STREAM_FLUSH_INTERVAL=0)
+class FeedbackJobTests(FeedbackQueueTestCase):
+    """Score 行をキューとするフィードバック生成ジョブの状態遷移を確認する"""
+
+    @skipUnlessDBFeature('has_select_for_update_skip_locked')
+    def test_claim_skips_locked_jobs(self):
+        first, second = self._pending_score(), self._pending_score()
+        claimed = []
+
+        def claim():
+            try:
+                claimed.append(claim_next_job())
+            finally:
+                connection.close()
+
+        # 別のワーカーが first を確保している最中（行ロック中）でも、待たずに次のジョブを確保する
+        with transaction.atomic():
+            Score.objects.select_for_update().get(pk=first.pk)
+            worker = threading.Thread(target=claim)
+            worker.start()
+            worker.join(timeout=10)
+        self.assertEqual(claimed, [second.pk])
+
+        self.assertEqual(claim_next_job(), first.pk)
+        self.assertIsNone(claim_next_job())
+        first.refresh_from_db()
+        self.assertEqual(first.feedback_status, Score.FeedbackStatus.RUNNING)
+        self.assertIsNotNone(first.feedback_claimed_at)
+
+    def test_job_runs_to_done(self):
+        score = self._pending_score()
+        self.assertEqual(claim_next_job(), score.pk)
+
+        client = RecordingLLMClient(score.pk)
+        self.assertEqual(run_feedback_job(score.pk, client), Score.FeedbackStatus.DONE)
+
+        header = feedback_header(score.overall_score)
+        self.assertTrue(client.seen)
+        for status, text in client.seen:
+            self.assertEqual(status, Score.FeedbackStatus.RUNNING)
+            self.assertTrue(client.text.startswith((text or header)[len(header):]))
+        self.assertGreater(len(client.seen[-1][1]), len(header))
+
+        score.refresh_from_db()
+        self.assertEqual(score.feedback_status, Score.FeedbackStatus.DONE)
+        self.assertEqual(score.feedback_text, header + client.text)
+
+        response = self.client.get(f'/api/scores/{score.pk}/feedback/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'id': score.pk, 'feedback_status': 'done', 'feedback_text': header + client.text,
+        })
+
+    def test_failed_generation(self):
+        score = self._pending_score()
+        claim_next_job()
+        self.assertEqual(run_feedback_job(score.pk, FailingLLMClient()), Score.FeedbackStatus.FAILED)
+
+        response = self.client.get(f'/api/scores/{score.pk}/feedback/')
+        self.assertEqual(response.json()['feedback_status'], 'failed')
+        self.assertEqual(response.json()['feedback_text'], feedback_header(score.overall_score) + ADVICE_FAILED_MESSAGE)
+
+    def test_pending_feedback_is_reported_as_pending(self):
+        score = self._pending_score()
+        with mock.patch('api.views.worker_pool') as pool:
+            response = self.client.get(f'/api/scores/{score.pk}/feedback/')
+        self.assertEqual(response.json()['feedback_status'], 'pending')
+        pool.start.assert_called_once_with()
+
+    def test_stale_running_jobs_are_requeued(self):
+        stale, fresh = self._pending_score(), self._pending_score()
+        claim_next_job()
+        claim_next_job()
+        Score.objects.filter(pk=stale.pk).update(feedback_claimed_at=timezone.now() - timedelta(seconds=120))
+
+        self.assertEqual(requeue_stale_jobs(timeout=60), 1)
+        self.assertEqual(
+            dict(Score.objects.values_list('id', 'feedback_status')),
+            {stale.pk: Score.FeedbackStatus.PENDING, fresh.pk: Score.FeedbackStatus.RUNNING},
+        )
+        self.assertEqual(claim_next_job(), stale.pk)
+
+
+class SlowLLMClient(FakeLLMClient):
+    text = "## 🚀 未来を変えるウォーキング分析\n\n体幹がまっすぐで、リズムも安定しています。この調子で歩幅を少しずつ広げていきましょう。"
+    stream_delay = 0.02
+
+
+@override_settings(FEEDBACK_STREAM_FLUSH_INTERVAL=0, FEEDBACK_STREAM_POLL_INTERVAL=0.01)
+class ScoreFeedbackStreamTests(FeedbackQueueTestCase):
+    """SSE で数値結果 → 生成中のアドバイス → 確定した全文の順に届き、全文が保存されることを確認する"""
+
+    @staticmethod
+    def _parse(chunk):
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('utf-8')
+        events = []
+        for block in chunk.split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+            if 'event' in lines:
+                events.append((lines['event'], json.loads(lines['data'])))
+        return events
+
+    def _run_job(self, score_id):
+        try:
+            self.assertEqual(claim_next_job(), score_id)
+            run_feedback_job(score_id, SlowLLMClient())
+        finally:
+            connection.close()
+
+    async def _stream(self, score):
+        response = await AsyncClient().get(f'/api/scores/{score.pk}/feedback/stream/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        events, job = [], None
+        async for chunk in response.streaming_content:
+            events.extend(self._parse(chunk))
+            if job is None:
+                # 数値結果を受け取ってから生成を始める
+                job = threading.Thread(target=self._run_job, args=(score.pk,))
+                job.start()
+        job.join(timeout=10)
+        return events
+
+    def test_stream_sends_score_then_partial_advice_then_final_text(self):
+        score = self._pending_score()
+        with mock.patch('api.views.worker_pool'):
+            events = async_to_sync(self._stream)(score)
+
+        names = [name for name, _ in events]
+        self.assertEqual(names[0], 'score')
+        self.assertEqual(names[-1], 'done')
+        self.assertEqual(set(names[1:-1]), {'token'})
+        self.assertGreater(names.count('token'), 1)
+
+        self.assertEqual(events[0][1]['id'], score.pk)
+        self.assertEqual(events[0][1]['overall_score'], score.overall_score)
+        self.assertEqual(events[0][1]['chart_data'], score.chart_data)
+
+        expected = feedback_header(score.overall_score) + SlowLLMClient.text
+        streamed = ''.join(data['text'] for name, data in events if name == 'token')
+        self.assertTrue(expected.startswith(streamed))
+        self.assertGreater(len(streamed), len(feedback_header(score.overall_score)))
+        self.assertEqual(events[-1][1], {'feedback_status': 'done', 'feedback_text': expected})
+
+        score.refresh_from_db()
+        self.assertEqual(score.feedback_status, Score.FeedbackStatus.DONE)
+        self.assertEqual(score.feedback_text, expected)
+
+
+class InstrumentationTests(SimpleTestCase):
+
+    def test_query_count_is_exact_across_threads(self):
+        # run_db と同じく、リクエストのコンテキストをコピーした複数のスレッドから同じ RequestTrace に加算する
+        trace, token = start_trace()
+        try:
+            def run():
+                for _ in range(2000):
+                    count_queries(lambda *args: None, 'SELECT 1', (), False, {})
+
+            threads = [threading.Thread(target=contextvars.copy_context().run, args=(run,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            end_trace(token)
+        self.assertEqual(trace.queries, 8 * 2000)
+
+    def test_samples_carry_the_worker_label(self):
+        registry = MetricsRegistry()
+        registry.counter('requests_total', 'Requests.', ('status',)).inc(status='200')
+        registry.histogram('duration_seconds', 'Duration.', buckets=(1,)).observe(0.5)
+        registry.register_collector(lambda: [('slots', 'gauge', 'Slots.', [({}, 3)])])
+
+        worker = f'worker="{os.getpid()}"'
+        samples = [line for line in registry.render().splitlines() if not line.startswith('#')]
+        self.assertIn(f'requests_total{{status="200",{worker}}} 1', samples)
+        self.assertIn(f'duration_seconds_bucket{{{worker},le="1.0"}} 1', samples)
+        self.assertIn(f'slots{{{worker}}} 3', samples)
+        self.assertTrue(all(worker in line for line in samples))
+
+
+class MemoryLeaderboardTests(TransactionTestCase):
+
+    def setUp(self):
+        self.challenges = [Challenge.objects.create(name=f'challenge {i}', description='') for i in range(2)]
+        self.users = [User.objects.create(name=f'walker {i}') for i in range(3)]
+        for challenge in self.challenges:
+            for i, user in enumerate(self.users):
+                Score.objects.create(user=user, challenge=challenge, overall_score=50 + 10 * i, chart_data={})
+        self.board = MemoryLeaderboard(sync_interval=float('inf'), resync_interval=float('inf'))
+
+    def test_live_board_consistency(self):
+        first, second = self.challenges
+        self.assertEqual(self.board.top(first.id, 1)[0]['user_id'], self.users[2].id)
+        # 読み込み済みのボードだけを確認する
+        self.assertEqual(self.board.check_consistency(), [])
+
+        # 削除は差分同期では取り込めないため、再読み込みまでずれとして残る
+        UserChallengeBest.objects.filter(challenge=first, user=self.users[0]).delete()
+        UserChallengeBest.objects.filter(challenge=first, user=self.users[1]).update(best_score=99, updated_at=timezone.now())
+        self.assertEqual(self.board.check_consistency(), [(first.id, self.users[0].id, None, 50.0)])
+        self.assertEqual(self.board.rank(self.users[1].id, first.id)['rank'], 1)
+        self.assertEqual(self.board.check_consistency(second.id), [])
+
+        with mock.patch('api.views.leaderboard_backend', self.board):
+            response = self.client.get('/api/leaderboard/consistency/', {'challenge': first.id})
+        self.assertEqual(response.json()['worker'], os.getpid())
+        self.assertEqual(response.json()['mismatches'], [
+            {'challenge_id': first.id, 'user_id': self.users[0].id, 'expected': None, 'actual': 50.0},
+        ])
+
+    def test_challenges_do_not_wait_for_each_other(self):
+        first, second = self.challenges
+        results = []
+
+        def query():
+            try:
+                results.append(self.board.total_participants(second.id))
+            finally:
+                connection.close()
+
+        # 別のチャレンジの読み込み・同期中（ロック中）でも待たされない
+        with self.board._challenge_lock(first.id):
+            thread = threading.Thread(target=query)
+            thread.start()
+            thread.join(timeout=10)
+            self.assertEqual(results, [3])
+
+
+    def test_warm_in_background(self):
+        with self.assertLogs('api.leaderboard', 'INFO'):
+            self.board.warm_in_background().join(timeout=10)
+        self.assertEqual(sorted(self.board._boards), sorted(challenge.id for challenge in self.challenges))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.board.total_participants(self.challenges[1].id), 3)
+        self.assertEqual(len(queries), 0)
+
+        # 読み込みに失敗しても例外はスレッドの外に出ず、最初の問い合わせで読み込まれる
+        board = MemoryLeaderboard(sync_interval=float('inf'), resync_interval=float('inf'))
+        with mock.patch.object(board, 'warm', side_effect=RuntimeError('database unavailable')), \
+                self.assertLogs('api.leaderboard', 'ERROR'):
+            board.warm_in_background().join(timeout=10)
+        self.assertEqual(board.total_participants(self.challenges[0].id), 3)
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class LeaderboardRankTests(TransactionTestCase):
+    """順位の規則（同点は同順位、自分より高いスコアの人数 + 1）を、DB版とメモリ版で同じ結果になるか確認する"""
+
+    bests = [70, 90, 80, 50, 80, 70, 80, 60]
+    expected_ranks = [5, 1, 2, 8, 2, 5, 2, 7]
+
+    def setUp(self):
+        self.challenge = Challenge.objects.create(name='runway', description='')
+        self.other = Challenge.objects.create(name='catwalk', description='')
+        self.users = [User.objects.create(name=f'walker {i}') for i in range(len(self.bests))]
+        for user, best in zip(self.users, self.bests):
+            # 最高スコア以外の記録は順位に関係しない
+            Score.objects.create(user=user, challenge=self.challenge, overall_score=best - 30, chart_data={})
+            Score.objects.create(user=user, challenge=self.challenge, overall_score=best, chart_data={})
+        Score.objects.create(user=self.users[3], challenge=self.other, overall_score=100, chart_data={})
+        self.outsider = User.objects.create(name='spectator')
+        self.backends = {
+            'database': DatabaseLeaderboard(sync_interval=0, resync_interval=0),
+            'memory': MemoryLeaderboard(sync_interval=float('inf'), resync_interval=float('inf')),
+        }
+
+    def _board(self):
+        """(-score, user_id) 順に並べた全員の項目"""
+        rows = sorted(zip(self.bests, self.users, self.expected_ranks), key=lambda row: (-row[0], row[1].id))
+        return [{'rank': rank, 'user_id': user.id, 'score': float(best)} for best, user, rank in rows]
+
+    def test_rank_rule(self):
+        for best, expected in zip(self.bests, self.expected_ranks):
+            self.assertEqual(expected, 1 + sum(other > best for other in self.bests))
+
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name):
+                for user, best, rank in zip(self.users, self.bests, self.expected_ranks):
+                    self.assertEqual(backend.rank(user.id, self.challenge.id), {'rank': rank, 'user_id': user.id, 'score': best})
+                self.assertIsNone(backend.rank(self.outsider.id, self.challenge.id))
+                self.assertEqual(backend.total_participants(self.challenge.id), len(self.users))
+                self.assertEqual(backend.total_participants(self.other.id), 1)
+                self.assertEqual(backend.rank(self.users[3].id, self.other.id)['rank'], 1)
+
+    def test_top_and_neighborhood_pages(self):
+        board = self._board()
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name):
+                # 同点の途中で切っても順位は変わらない
+                for limit in range(1, len(board) + 2):
+                    self.assertEqual(backend.top(self.challenge.id, limit=limit), board[:limit])
+                for index, entry in enumerate(board):
+                    for radius in (1, 2):
+                        self.assertEqual(
+                            backend.neighborhood(entry['user_id'], self.challenge.id, radius=radius),
+                            board[max(index - radius, 0):index + radius + 1],
+                        )
+                self.assertEqual(backend.neighborhood(self.outsider.id, self.challenge.id), [])
+
+    def test_backends_agree_through_the_api(self):
+        tied = self.users[4]
+        score = Score.objects.filter(user=tied, challenge=self.challenge).latest('overall_score')
+        responses = {}
+        for name, backend in self.backends.items():
+            with mock.patch('api.views.leaderboard_backend', backend):
+                ranking = self.client.get('/api/ranking/', {'challenge': self.challenge.id, 'user': tied.id}).json()
+                score_rank = self.client.get(f'/api/scores/{score.id}/ranking/').json()
+            responses[name] = (ranking, score_rank)
+
+        self.assertEqual(responses['database'], responses['memory'])
+        ranking, score_rank = responses['memory']
+        self.assertEqual(score_rank, {'rank': 2, 'total_participants': len(self.users)})
+        self.assertEqual(ranking['my_rank']['rank'], 2)
+        self.assertEqual([entry['rank'] for entry in ranking['leaderboard']], [1, 2, 2, 2, 5, 5, 7, 8])
+        self.assertEqual([entry['rank'] for entry in ranking['neighborhood']], [1, 2, 2, 2, 5])
+
+
+class ResponseCacheTests(TransactionTestCase):
+
+    @skipUnless(connection.vendor == 'postgresql', 'SQLite allows a single writer at a time')
+    def test_concurrent_bumps_are_not_lost(self):
+        scopes = ['user:1', 'challenge:1']
+        before = scope_versions(scopes)
+
+        def bump():
+            try:
+                for _ in range(25):
+                    bump_scopes(scopes)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bump) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(scope_versions(scopes), [version + 8 * 25 for version in before])
+
+    def test_dashboard_follows_challenge_renames_and_the_date(self):
+        user = User.objects.create(name='walker')
+        challenge = Challenge.objects.create(name='runway', description='')
+        Score.objects.create(user=user, challenge=challenge, overall_score=70, chart_data={})
+
+        first = self.client.get('/api/dashboard/', {'user': user.id})
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(first.json()['streak'], 1)
+        self.assertEqual(self.client.get('/api/dashboard/', {'user': user.id})['X-Cache'], 'HIT')
+
+        challenge.name = 'catwalk'
+        challenge.save()
+        renamed = self.client.get('/api/dashboard/', {'user': user.id})
+        self.assertEqual(renamed['X-Cache'], 'MISS')
+        self.assertEqual(renamed.json()['recentActivities'][0]['challengeName'], 'catwalk')
+
+        # 2日後には連続プレイが途切れて表示される
+        later = timezone.localdate() + timedelta(days=2)
+        with mock.patch('django.utils.timezone.localdate', return_value=later):
+            response = self.client.get('/api/dashboard/', {'user': user.id})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['streak'], 0)
+
+
+class ScoreAggregateTests(TransactionTestCase):
+    """保存・削除のたびに差分で更新される平均スコアの集計が、Score から求めた値と一致し続けることを確認する"""
+
+    def setUp(self):
+        self.challenges = [Challenge.objects.create(name=f'challenge {i}', description='') for i in range(2)]
+        self.users = [User.objects.create(name=f'walker {i}') for i in range(3)]
+        self.scores = []
+        for i in range(9):
+            chart_data = {'symmetry': 10.0 + i, 'trunk_uprightness': 20.0 - i}
+            if i % 3:
+                # 項目が欠けたスコアは、その項目の件数に含めない
+                chart_data['walking_speed'] = 5.0 + i
+            self.scores.append(Score.objects.create(
+                user=self.users[i % 3], challenge=self.challenges[i % 2], overall_score=40.0 + i, chart_data=chart_data,
+            ))
+
+    def test_saves_and_deletes_keep_aggregates_in_step(self):
+        self.assertEqual(find_drift(), [])
+        first = self.challenges[0]
+        aggregate = ChallengeScoreAggregate.objects.get(challenge=first)
+        in_first = [score for score in self.scores if score.challenge_id == first.id]
+        self.assertEqual(aggregate.count, len(in_first))
+        self.assertAlmostEqual(aggregate.overall_average, sum(score.overall_score for score in in_first) / len(in_first))
+        self.assertEqual(aggregate.walking_speed_count, sum('walking_speed' in score.chart_data for score in in_first))
+        self.assertEqual(aggregate.gravity_stability_count, 0)
+
+        score = self.scores[0]
+        score.chart_data = {**score.chart_data, 'gravity_stability': 12.0}
+        score.save(update_fields=['chart_data'])
+        self.assertEqual(find_drift(), [])
+        self.assertEqual(ChallengeScoreAggregate.objects.get(challenge=first).gravity_stability_count, 1)
+
+        # ユーザー・チャレンジの付け替えは元と先の両方の集計に反映される
+        score.challenge = self.challenges[1]
+        score.save()
+        moved = self.scores[4]
+        moved.user = self.users[0]
+        moved.save()
+        self.scores[3].delete()
+        self.assertEqual(find_drift(), [])
+        self.assertEqual(check_best_scores(), [])
+        self.assertEqual(find_stats_drift(), [])
+
+        self.users[1].delete()
+        Score.objects.filter(challenge=self.challenges[1]).delete()
+        self.assertEqual(find_drift(), [])
+        self.assertEqual(ChallengeScoreAggregate.objects.get(challenge=self.challenges[1]).count, 0)
+
+    def test_apply_score(self):
+        user, challenge = self.users[0], self.challenges[0]
+        before = UserChallengeScoreAggregate.objects.get(user=user, challenge=challenge)
+        apply_score(user.id, challenge.id, 80.0, {'symmetry': 25.0, 'walking_speed': None})
+        after = UserChallengeScoreAggregate.objects.get(user=user, challenge=challenge)
+        self.assertEqual((after.count, after.symmetry_count, after.walking_speed_count),
+                         (before.count + 1, before.symmetry_count + 1, before.walking_speed_count))
+        self.assertAlmostEqual(after.overall_sum, before.overall_sum + 80.0)
+
+        apply_score(user.id, challenge.id, 80.0, {'symmetry': 25.0}, sign=-1)
+        self.assertEqual(find_drift(), [])
+        # 減算では行を作らない
+        other = User.objects.create(name='newcomer')
+        apply_score(other.id, challenge.id, 10.0, {}, sign=-1)
+        self.assertFalse(UserChallengeScoreAggregate.objects.filter(user=other).exists())
+
+    def test_drift_repair(self):
+        first, second = self.challenges
+        # 一括更新はシグナルを通らないため、集計がずれる
+        Score.objects.filter(challenge=first, user=self.users[0]).update(overall_score=99.0)
+        Score.objects.filter(challenge=second).update(symmetry=0.0)
+        drift = find_drift()
+        self.assertEqual(
+            {(name, field) for name, _, field, _, _ in drift},
+            {('ChallengeScoreAggregate', 'overall_sum'), ('UserChallengeScoreAggregate', 'overall_sum'),
+             ('ChallengeScoreAggregate', 'symmetry_sum'), ('UserChallengeScoreAggregate', 'symmetry_sum')},
+        )
+        self.assertTrue(find_drift(challenge_id=first.id))
+
+        recompute_aggregates(self.users[0].id, first.id)
+        self.assertEqual(find_drift(challenge_id=first.id), [])
+
+        rebuild_aggregates(challenge_id=second.id)
+        self.assertEqual(find_drift(), [])
+        UserChallengeScoreAggregate.objects.all().delete()
+        rebuild_aggregates()
+        self.assertEqual(find_drift(), [])
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_average_comparison(self):
+        user, challenge = self.users[1], self.challenges[1]
+        mine = [score for score in self.scores if score.user_id == user.id and score.challenge_id == challenge.id]
+        everyone = [score for score in self.scores if score.challenge_id == challenge.id]
+        response = self.client.get('/api/scores/average_comparison/', {'user': user.id, 'challenge': challenge.id}).json()
+        self.assertEqual(response['user_average'], round(sum(score.overall_score for score in mine) / len(mine), 3))
+        self.assertEqual(response['overall_average'], round(sum(score.overall_score for score in everyone) / len(everyone), 3))
+        with_speed = [score.chart_data['walking_speed'] for score in everyone if 'walking_speed' in score.chart_data]
+        self.assertEqual(response['overall_chart_data_averages']['walking_speed'], round(sum(with_speed) / len(with_speed), 3))
+        self.assertEqual(response['overall_chart_data_averages']['gravity_stability'], 0)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class MetricColumnTests(TransactionTestCase):
+    """chart_data の各項目が型付きの列に同期され、一覧の絞り込み・並べ替えに使えることを確認する"""
+
+    def setUp(self):
+        self.user = User.objects.create(name='walker')
+        self.challenge = Challenge.objects.create(name='runway', description='')
+        self.scores = [
+            self._create({'symmetry': 10.0 + 3 * i, 'trunk_uprightness': 20.0 - i, 'walking_speed': 5.0 * i})
+            for i in range(5)
+        ]
+        # 項目が欠けたスコアの列は NULL
+        self.partial = self._create({'symmetry': 14.0})
+
+    def _create(self, chart_data):
+        return Score.objects.create(user=self.user, challenge=self.challenge, overall_score=50, chart_data=chart_data)
+
+    def _columns(self, score):
+        return Score.objects.filter(pk=score.pk).values_list(*Score.METRIC_FIELDS).get()
+
+    def _ids(self, params):
+        response = self.client.get('/api/scores/', params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_columns_follow_chart_data(self):
+        self.assertEqual(self._columns(self.scores[1]), (13.0, 19.0, None, 5.0))
+        self.assertEqual(self._columns(self.partial), (14.0, None, None, None))
+
+        score = self.scores[1]
+        score.chart_data = {'symmetry': 1, 'gravity_stability': '2.5'}
+        score.save(update_fields=['chart_data'])
+        self.assertEqual(self._columns(score), (1.0, None, 2.5, None))
+
+        # chart_data を含まない保存では列を書き換えない
+        Score.objects.filter(pk=score.pk).update(symmetry=99.0)
+        score.feedback_text = 'advice'
+        score.save(update_fields=['feedback_text'])
+        self.assertEqual(self._columns(score)[0], 99.0)
+
+    def test_migration_copies_existing_chart_data(self):
+        copy_chart_data_to_columns = importlib.import_module('api.migrations.0010_score_metric_columns').copy_chart_data_to_columns
+        expected = {score.pk: self._columns(score) for score in self.scores + [self.partial]}
+        Score.objects.update(**dict.fromkeys(Score.METRIC_FIELDS, None))
+
+        copy_chart_data_to_columns(django_apps, connection.schema_editor())
+        self.assertEqual({score.pk: self._columns(score) for score in self.scores + [self.partial]}, expected)
+
+    def test_filters_and_ordering(self):
+        ids = [score.id for score in self.scores]
+        self.assertEqual(sorted(self._ids({'symmetry__gte': 16, 'symmetry__lte': 19})), ids[2:4])
+        self.assertEqual(sorted(self._ids({'walking_speed__gte': 10})), ids[2:])
+        # 項目のないスコアは範囲指定に一致しない
+        self.assertEqual(sorted(self._ids({'trunk_uprightness__lte': 100})), ids)
+        self.assertEqual(sorted(self._ids({'symmetry__gte': 13, 'trunk_uprightness__gte': 18})), ids[1:3])
+
+        self.assertEqual(self._ids({'ordering': '-symmetry', 'walking_speed__gte': 0}), ids[::-1])
+        self.assertEqual(self._ids({'ordering': 'trunk_uprightness', 'walking_speed__gte': 0}), ids[::-1])
+        self.assertEqual(self._ids({'ordering': 'walking_speed', 'walking_speed__gte': 0, 'page_size': 2}), ids[:2])
+
+
+class UserStatsBackfillTests(TransactionTestCase):
+    """UserStats の行がない利用者（マイグレーション前からの利用者）の統計が既存のスコアから求められることを確認する"""
+
+    def setUp(self):
+        self.challenges = [Challenge.objects.create(name=f'challenge {i}', description='') for i in range(2)]
+        self.users = [User.objects.create(name=f'walker {i}') for i in range(3)]
+        now = timezone.now()
+        for i, user in enumerate(self.users):
+            for day in (0, 1, 3, 3, 4, 6, 9)[i:]:
+                score = Score.objects.create(
+                    user=user, challenge=self.challenges[day % 2], overall_score=70 - 2 * day + i, chart_data={},
+                )
+                Score.objects.filter(pk=score.pk).update(created_at=now - timedelta(days=day, minutes=i))
+        # マイグレーション前の状態
+        UserStats.objects.all().delete()
+
+    def test_migration_backfill(self):
+        backfill_user_stats = importlib.import_module('api.migrations.0011_userstats').backfill_user_stats
+        self.assertEqual(len(find_stats_drift()), 5 * len(self.users))
+
+        backfill_user_stats(django_apps, connection.schema_editor())
+        self.assertEqual(UserStats.objects.count(), len(self.users))
+        self.assertEqual(find_stats_drift(), [])
+        self.assertEqual(
+            list(UserStats.objects.order_by('user_id').values_list('total_plays', 'current_streak')),
+            [(7, 2), (6, 1), (5, 2)],
+        )
+
+    def test_first_play_without_a_row_counts_earlier_scores(self):
+        user = self.users[0]
+        Score.objects.create(user=user, challenge=self.challenges[0], overall_score=12.5, chart_data={})
+
+        stats = UserStats.objects.get(user=user)
+        self.assertEqual((stats.total_plays, stats.high_score), (8, 70))
+        self.assertEqual(find_stats_drift([user.id]), [])
+        # 以降のプレイは差分で更新する
+        Score.objects.create(user=user, challenge=self.challenges[1], overall_score=80, chart_data={})
+        self.assertEqual(UserStats.objects.get(user=user).total_plays, 9)
+        self.assertEqual(find_stats_drift([user.id]), [])
+
+
+class RescoreRebuildTests(TransactionTestCase):
+
+    def setUp(self):
+        self.challenges = [Challenge.objects.create(name=f'challenge {i}', description='') for i in range(2)]
+        self.users = [User.objects.create(name=f'walker {i}') for i in range(4)]
+        now = timezone.now()
+        for i, user in enumerate(self.users):
+            # 連続した日・間の空いた日・同じ日の複数プレイを混ぜる
+            for day in (0, 1, 2, 4, 4, 7)[:i + 3]:
+                score = Score.objects.create(
+                    user=user, challenge=self.challenges[day % 2], overall_score=40 + 3 * day + i,
+                    chart_data={'symmetry': 10.0 + day, 'walking_speed': 5.0 + i},
+                )
+                Score.objects.filter(pk=score.pk).update(created_at=now - timedelta(days=day, minutes=i))
+
+    def test_set_based_stats_match_per_user_stats(self):
+        expected = {user.id: compute_user_stats(user.id) for user in self.users}
+        # クエリ数はユーザー数によらない
+        query_counts = []
+        for users in (self.users[:1], self.users):
+            with CaptureQueriesContext(connection) as queries, transaction.atomic():
+                self.assertEqual(refresh_stats_for_users([user.id for user in users]), len(users))
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        for stats in UserStats.objects.all():
+            self.assertEqual({field: getattr(stats, field) for field in expected[stats.user_id]}, expected[stats.user_id])
+
+    def test_rebuild_repairs_every_derived_table(self):
+        # bulk_update はシグナルを通らないため、派生テーブルは古いまま残る
+        Score.objects.filter(user=self.users[0]).update(overall_score=99, symmetry=1.0)
+        self.assertTrue(check_best_scores())
+        self.assertTrue(find_drift())
+
+        _rebuild_derived(SimpleNamespace(challenge_id=None))
+        self.assertEqual(check_best_scores(), [])
+        self.assertEqual(find_drift(), [])
+        self.assertEqual(find_stats_drift(), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'LOCK TABLE is only issued on PostgreSQL')
+    def test_score_writes_wait_for_the_rebuild(self):
+        def write():
+            try:
+                Score.objects.create(user=self.users[0], challenge=self.challenges[0], overall_score=100, chart_data={})
+            finally:
+                connection.close()
+
+        writer = threading.Thread(target=write)
+        with transaction.atomic():
+            _lock_out_score_writers()
+            writer.start()
+            writer.join(timeout=1)
+            self.assertTrue(writer.is_alive())
+            self.assertFalse(Score.objects.filter(overall_score=100).exists())
+        writer.join(timeout=10)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(check_best_scores(), [])
+        self.assertEqual(find_drift(), [])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SQLite allows a single writer at a time')
+class ConcurrentScoreWriteTests(TransactionTestCase):
+    """同時に届いたスコア送信が並行して保存され、取りこぼしも重複もないことを確認する"""
+
+    def setUp(self):
+        self.challenge = Challenge.objects.create(name='runway', description='')
+        self.users = [User.objects.create(name=f'walker {i}') for i in range(6)]
+        self.in_flight = self.peak = 0
+        self.lock = threading.Lock()
+
+        from .services import save_scored
+
+        def counting_save(*args, **kwargs):
+            with self.lock:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            try:
+                # DB の往復時間の代わり。共有スレッドで順番に保存していれば同時に1件しか入らない
+                time.sleep(0.05)
+                return save_scored(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+        executor = ScoringExecutor('thread', workers=4, queue_depth=32, retry_after=1)
+        self.addCleanup(lambda: executor._executor and executor._executor.shutdown())
+        for target, value in (
+            ('api.views.save_scored', counting_save),
+            ('api.views.scoring_executor', executor),
+            ('api.services.enqueue_feedback', lambda score_id: None),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def _post_all(self, payloads):
+        client = AsyncClient()
+        return await asyncio.gather(*(
+            client.post('/api/score/', data=json.dumps(payload), content_type='application/json')
+            for payload in payloads
+        ))
+
+    def test_concurrent_posts_overlap_without_lost_or_duplicate_rows(self):
+        payloads = []
+        for i, user in enumerate(self.users):
+            payload = {
+                'user': user.id, 'challenge': self.challenge.id, 'video_duration': 2.0,
+                'raw_landmarks': array_to_landmarks(generate_walk(60, seed=i)),
+            }
+            # 各ユーザーが同じ内容を2回（再送）送る
+            payloads += [payload, payload]
+
+        responses = async_to_sync(self._post_all)(payloads)
+
+        self.assertGreater(self.peak, 1)
+        self.assertEqual(sorted(response.status_code for response in responses), [200] * 6 + [201] * 6)
+        ids_by_user = {}
+        for payload, response in zip(payloads, responses):
+            ids_by_user.setdefault(payload['user'], set()).add(response.json()['id'])
+        self.assertEqual([len(ids) for ids in ids_by_user.values()], [1] * 6)
+        self.assertEqual(
+            sorted(Score.objects.values_list('user_id', flat=True)), sorted(user.id for user in self.users),
+        )
+        self.assertEqual(check_best_scores(), [])
+        self.assertEqual(find_drift(), [])
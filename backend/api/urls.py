@@ -5,11 +5,17 @@ from .views import (
     ChallengeViewSet, 
     ScoreCreateAPIView, 
     ScoreViewSet, 
+    ScoreFeedbackStreamView,
+    ScoringSessionViewSet,
+    RescoreJobViewSet,
     RankingAPIView,
     ScoreHistoryView,
     ScoreAverageComparisonView,
     DashboardAPIView,
-    ResultPageDataView
+    ResultPageDataView,
+    CacheStatsAPIView,
+    LeaderboardConsistencyAPIView,
+    MetricsAPIView,
 )
 
 router = DefaultRouter()
@@ -17,6 +23,8 @@ router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'challenges', ChallengeViewSet, basename='challenge')
 router.register(r'scores', ScoreViewSet, basename='score')
+router.register(r'sessions', ScoringSessionViewSet, basename='scoring-session')
+router.register(r'rescore_jobs', RescoreJobViewSet, basename='rescore-job')
 
 # 手動で定義するURLを先に記述
 urlpatterns = [
@@ -25,7 +33,11 @@ urlpatterns = [
     path('ranking/', RankingAPIView.as_view(), name='ranking-list'),
     path('scores/history/', ScoreHistoryView.as_view(), name='score-history'),
     path('scores/average_comparison/', ScoreAverageComparisonView.as_view(), name='score-average-comparison'),
+    path('scores/<int:pk>/feedback/stream/', ScoreFeedbackStreamView.as_view(), name='score-feedback-stream'),
     path('result/<int:pk>/', ResultPageDataView.as_view(), name='result-page-data'),
+    path('cache_stats/', CacheStatsAPIView.as_view(), name='cache-stats'),
+    path('leaderboard/consistency/', LeaderboardConsistencyAPIView.as_view(), name='leaderboard-consistency'),
+    path('metrics/', MetricsAPIView.as_view(), name='metrics'),
     
     # routerが生成するURLを後に記述
     path('', include(router.urls)),
@@ -0,0 +1,183 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, F, Max, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Score, UserStats
+
+LEVEL_PLAYS = 5
+
+
+def activity_entry(score, challenge_name):
+    return {
+        "id": score.id,
+        "challengeName": challenge_name,
+        "overall_score": float(score.overall_score),
+        "date": score.created_at.strftime('%Y-%m-%d'),
+    }
+
+
+def _streak(unique_dates):
+    """連続プレイ日数: 最新のプレイ日から1日ずつ遡って途切れるまで数える（unique_dates は新しい順）"""
+    current_streak = 1 if unique_dates else 0
+    for newer, older in zip(unique_dates, unique_dates[1:]):
+        if (newer - older).days != 1:
+            break
+        current_streak += 1
+    return current_streak
+
+
+def compute_user_stats(user_id):
+    """
+    Derives the stats from the Score table (the algorithm the dashboard used to run per request).
+    Returns a dict with the UserStats fields.
+    """
+    scores = Score.objects.filter(user_id=user_id).order_by('-created_at', '-id')
+    totals = scores.aggregate(total_plays=Count('id'), high_score=Max('overall_score'))
+
+    unique_dates = sorted(set(scores.values_list('created_at__date', flat=True)), reverse=True)
+    current_streak = _streak(unique_dates)
+
+    recent = scores.select_related('challenge').only(
+        'id', 'overall_score', 'created_at', 'challenge__name',
+    )[:UserStats.RECENT_ACTIVITY_LIMIT]
+
+    return {
+        'total_plays': totals['total_plays'],
+        'high_score': totals['high_score'] or 0,
+        'last_play_date': unique_dates[0] if unique_dates else None,
+        'current_streak': current_streak,
+        'recent_activities': [activity_entry(score, score.challenge.name) for score in recent],
+    }
+
+
+def refresh_user_stats(user_id):
+    """Recomputes and stores one user's stats from scratch."""
+    stats, _ = UserStats.objects.update_or_create(user_id=user_id, defaults=compute_user_stats(user_id))
+    return stats
+
+
+def refresh_stats_for_users(users):
+    """
+    Recomputes and stores the stats of many users with a fixed number of queries (one per field group,
+    whatever the number of users), e.g. after a rescore. `users` is a queryset of user ids or an iterable.
+    Same values as refresh_user_stats (users without scores lose their row; the dashboard recreates it).
+    Call it inside a transaction so readers never see the rows missing.
+    """
+    scores = Score.objects.filter(user_id__in=users)
+    totals = scores.order_by().values('user_id').annotate(total_plays=Count('id'), high_score=Max('overall_score'))
+
+    dates = defaultdict(list)
+    rows = scores.order_by('user_id', '-created_at__date').values_list('user_id', 'created_at__date').distinct()
+    for user_id, play_date in rows.iterator(chunk_size=5000):
+        dates[user_id].append(play_date)
+
+    # ユーザーごとに新しい順の先頭 RECENT_ACTIVITY_LIMIT 件
+    recent = defaultdict(list)
+    latest = scores.select_related('challenge').only(
+        'id', 'user_id', 'overall_score', 'created_at', 'challenge__name',
+    ).annotate(
+        position=Window(RowNumber(), partition_by=F('user_id'), order_by=[F('created_at').desc(), F('id').desc()]),
+    ).filter(position__lte=UserStats.RECENT_ACTIVITY_LIMIT).order_by('user_id', 'position')
+    for score in latest.iterator(chunk_size=5000):
+        recent[score.user_id].append(activity_entry(score, score.challenge.name))
+
+    stats = [
+        UserStats(
+            user_id=row['user_id'],
+            total_plays=row['total_plays'],
+            high_score=row['high_score'] or 0,
+            last_play_date=dates[row['user_id']][0] if dates[row['user_id']] else None,
+            current_streak=_streak(dates[row['user_id']]),
+            recent_activities=recent[row['user_id']],
+        )
+        for row in totals
+    ]
+    UserStats.objects.filter(user_id__in=users).delete()
+    UserStats.objects.bulk_create(stats, batch_size=1000)
+    return len(stats)
+
+
+def record_play(score):
+    """Folds a newly created score into the user's stats (row locked for the update)."""
+    with transaction.atomic():
+        _, created = UserStats.objects.get_or_create(user_id=score.user_id)
+        if created:
+            # 行がなかった場合は、このスコアだけでなく既存のスコアも含めて集計する
+            refresh_user_stats(score.user_id)
+            return
+        stats = UserStats.objects.select_for_update().get(user_id=score.user_id)
+
+        play_date = timezone.localdate(score.created_at)
+        if stats.last_play_date is not None and play_date < stats.last_play_date:
+            # 過去日付のスコア（取り込み等）は連続日数の増分計算ができないので再計算する
+            refresh_user_stats(score.user_id)
+            return
+
+        if stats.last_play_date is None or (play_date - stats.last_play_date).days > 1:
+            stats.current_streak = 1
+        elif (play_date - stats.last_play_date).days == 1:
+            stats.current_streak += 1
+        stats.last_play_date = play_date
+
+        stats.total_plays += 1
+        stats.high_score = max(stats.high_score, score.overall_score)
+        stats.recent_activities = (
+            [activity_entry(score, score.challenge.name)] + stats.recent_activities
+        )[:UserStats.RECENT_ACTIVITY_LIMIT]
+        stats.save()
+
+
+def rename_challenge_in_activities(challenge_id, challenge_name):
+    """Rewrites the challenge's name in the stored recent activities (after a challenge is renamed)."""
+    candidates = list(
+        UserStats.objects.filter(user__scores__challenge_id=challenge_id).distinct()
+    )
+    score_ids = {activity['id'] for stats in candidates for activity in stats.recent_activities}
+    in_challenge = set(
+        Score.objects.filter(pk__in=score_ids, challenge_id=challenge_id).values_list('id', flat=True)
+    )
+    changed = []
+    for stats in candidates:
+        renamed = False
+        for activity in stats.recent_activities:
+            if activity['id'] in in_challenge and activity['challengeName'] != challenge_name:
+                activity['challengeName'] = challenge_name
+                renamed = True
+        if renamed:
+            changed.append(stats)
+    UserStats.objects.bulk_update(changed, ['recent_activities'], batch_size=500)
+    return len(changed)
+
+
+def displayed_streak(stats, today=None):
+    """The streak shown on the dashboard: only counts while the last play was today or yesterday."""
+    if stats.last_play_date is None:
+        return 0
+    today = today or timezone.localdate()
+    return stats.current_streak if (today - stats.last_play_date).days <= 1 else 0
+
+
+def level_for(total_plays):
+    return (total_plays // LEVEL_PLAYS) + 1
+
+
+def find_stats_drift(user_ids=None):
+    """Returns (user_id, field, expected, stored) for every stored value that differs from the derived one."""
+    users = Score.objects.values_list('user_id', flat=True).distinct()
+    stored_users = UserStats.objects.values_list('user_id', flat=True)
+    if user_ids is not None:
+        users = users.filter(user_id__in=user_ids)
+        stored_users = stored_users.filter(user_id__in=user_ids)
+
+    stored = {stats.user_id: stats for stats in UserStats.objects.filter(user_id__in=set(users) | set(stored_users))}
+    drift = []
+    for user_id in sorted(set(users) | set(stored_users)):
+        expected = compute_user_stats(user_id)
+        stats = stored.get(user_id)
+        for field, value in expected.items():
+            actual = getattr(stats, field) if stats else None
+            if actual != value:
+                drift.append((user_id, field, value, actual))
+    return drift
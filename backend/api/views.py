@@ -1,13 +1,55 @@
+import asyncio
+import os
 from django.shortcuts import render
-from rest_framework import viewsets, status, filters
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from rest_framework import viewsets, mixins, status, filters
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.views import APIView
 from adrf.views import APIView as AsyncAPIView  # 非同期サポート版
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from asgiref.sync import sync_to_async
-from .models import User, Challenge, Score
-from .serializers import UserSerializer, ChallengeSerializer, ScoreSerializer
-from .services import ScoringService
+from .models import User, Challenge, Score, ScoringSession, RescoreJob, ChallengeScoreAggregate, UserChallengeScoreAggregate, UserStats
+from .serializers import (
+    UserSerializer,
+    ChallengeSerializer,
+    ScoreSerializer,
+    ScoreFeedbackSerializer,
+    ScoreSummarySerializer,
+    ScoreDetailSerializer,
+    ScoreLandmarksQuerySerializer,
+    ScoreStreamHeaderSerializer,
+    ScoringSessionSerializer,
+    SessionFramesSerializer,
+    SessionFinalizeSerializer,
+    RescoreJobSerializer,
+)
+from .parsers import LandmarkNDJSONParser, LandmarkStream, ORJSONParser, PackedLandmarkParser
+from .landmarks import LandmarkShapeError, array_to_landmarks
+from .scoring_executor import scoring_executor
+from .rescoring import start_rescore_job
+from .pagination import ScoreCursorPagination
+from .renderers import EventStreamRenderer, ORJSONRenderer, sse_event
+from .services import ScoringService, append_session_frames, finalize_session, save_scored
+from .db_executor import run_db
+from .idempotency import (
+    PayloadHasher,
+    REPLAYED_HEADER,
+    SCORE_DEDUPLICATED,
+    check_same_payload,
+    find_duplicate,
+    idempotency_key,
+    payload_hash,
+    score_flights,
+)
+from .feedback import worker_pool
+from .leaderboard import leaderboard_backend, attach_user_names
+from .user_stats import displayed_streak, level_for, refresh_user_stats
+from .response_cache import cached_response, cache_stats, score_scopes
+from .instrumentation import registry, span
+from .feedback_cache import feedback_cache
+from django.shortcuts import get_object_or_404
 from django.db.models import Max
 from rest_framework.decorators import action
 # Create your views here.
@@ -22,10 +64,59 @@ class ChallengeViewSet(viewsets.ModelViewSet):
     
 
 class ScoreViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    一覧は軽量な表現（ScoreSummarySerializer）、詳細はランドマークを除いた表現を返す。
+    ランドマークは /api/scores/<id>/landmarks/ からのみ取得する。
+    """
     queryset = Score.objects.all().order_by('-created_at')
-    serializer_class = ScoreSerializer
-    filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['user', 'challenge']
+    serializer_class = ScoreDetailSerializer
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    # 項目別スコアは型付きの列なので、範囲指定や並べ替えもインデックス／列の比較で行える
+    filterset_fields = {
+        'user': ['exact'],
+        'challenge': ['exact'],
+        'overall_score': ['gte', 'lte'],
+        'symmetry': ['gte', 'lte'],
+        'trunk_uprightness': ['gte', 'lte'],
+        'gravity_stability': ['gte', 'lte'],
+        'walking_speed': ['gte', 'lte'],
+    }
+    ordering_fields = ['created_at', 'overall_score', *Score.METRIC_FIELDS]
+    pagination_class = ScoreCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return queryset.only(*ScoreSummarySerializer.Meta.fields)
+        if self.action == 'landmarks':
+            return queryset.only('id', 'raw_landmarks', 'landmarks_blob')
+        return queryset.defer('raw_landmarks', 'landmarks_blob')
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ScoreSummarySerializer
+        return super().get_serializer_class()
+
+    @action(detail=True, methods=['get'])
+    def landmarks(self, request, pk=None):
+        """
+        ランドマークを raw_landmarks と同じJSON構造で返す。
+        GET /api/scores/<score_id>/landmarks/?start=<a>&stop=<b>&step=<n>
+        """
+        query = ScoreLandmarksQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        start, stop, step = query.validated_data['start'], query.validated_data['stop'], query.validated_data['step']
+
+        score = self.get_object()
+        frames = score.landmark_frames(start, stop)[::step]
+        return Response({
+            'id': score.id,
+            'frame_count': score.landmark_frame_count,
+            'start': start,
+            'stop': start + len(frames) * step if stop is None else stop,
+            'step': step,
+            'raw_landmarks': array_to_landmarks(frames),
+        })
     
     @action(detail=True, methods=['get'])
     def ranking(self, request, pk=None):
@@ -34,49 +125,336 @@ class ScoreViewSet(viewsets.ReadOnlyModelViewSet):
         except Score.DoesNotExist:
             return Response({"error": "Score not found"}, status=status.HTTP_404_NOT_FOUND)
         
-        leaderboard = Score.objects.filter(challenge=target_score.challenge).values('user').annotate(max_score=Max('overall_score')).order_by('-max_score')
-    
-        my_rank = 0
-        for i, entry in enumerate(leaderboard):
-            if entry['user'] == target_score.user_id:
-                my_rank = i + 1
-                break
-            
-        total_participants = leaderboard.count()
+        my_entry = leaderboard_backend.rank(target_score.user_id, target_score.challenge_id)
+        my_rank = my_entry['rank'] if my_entry else 0
+        total_participants = leaderboard_backend.total_participants(target_score.challenge_id)
         
         return Response({
             'rank': my_rank,
             'total_participants': total_participants
         })
+
+    @action(detail=True, methods=['get'])
+    def feedback(self, request, pk=None):
+        """
+        AIフィードバックの生成状況と本文を返す（逐次表示は /feedback/stream/ を使う）。
+        GET /api/scores/<score_id>/feedback/
+        """
+        score = get_object_or_404(Score.objects.only('id', 'feedback_status', 'feedback_text'), pk=pk)
+        if score.feedback_status in (Score.FeedbackStatus.PENDING, Score.FeedbackStatus.RUNNING):
+            # このプロセスでワーカーが未起動でもジョブが処理されるようにする
+            worker_pool.start()
+        return Response(ScoreFeedbackSerializer(score).data)
     
 class ScoreCreateAPIView(AsyncAPIView):
-    """非同期API View（adrf使用）- AI生成中も他のリクエストを処理可能"""
+    """
+    非同期API View（adrf使用）
+    数値スコアを計算・保存して即座に返し、AIアドバイスはジョブキュー経由でバックグラウンド生成する。
+
+    Content-Type: application/x-ndjson の場合はフレームを1行ずつ読み込みながら採点・圧縮保存するため、
+    録画の長さに関わらずメモリ使用量が一定に収まる。application/x-runway-landmarks（量子化したバイナリ形式、
+    api/packed_landmarks.py）も同様にチャンクごとに展開して採点する。いずれも Content-Encoding: gzip / deflate に対応。
+
+    再送（同じ Idempotency-Key、または同じ内容の送信）には採点し直さずに最初のスコアを 200 で返す
+    （レスポンスヘッダー Idempotent-Replayed: true）。同じキーで内容が異なる場合は 422。
+    """
+    parser_classes = [ORJSONParser, LandmarkNDJSONParser, PackedLandmarkParser]
+
     async def post(self, request, *args, **kwargs):
-        serializer = ScoreSerializer(data=request.data, context={'request': request})
-        # バリデーションにDBアクセスが含まれる可能性があるため、sync_to_async でラップ
-        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        key = idempotency_key(request)
+        # 各段階の所要時間はスパンとして記録され、/api/metrics/ と遅いリクエストのログに出る
+        with span('parse_body'):
+            data = request.data
+        # 配列などオブジェクト以外の本文は、下のシリアライザが通常どおり 400 で弾く
+        if isinstance(data, dict) and isinstance(data.get('raw_landmarks'), LandmarkStream):
+            return await self.post_streaming(request, key)
+
+        serializer = ScoreSerializer(data=data, context={'request': request})
+        # user / challenge の存在確認でDBにアクセスするため、DB用のスレッドプールで実行する。
+        # raw_landmarks の形状の検証と配列への変換もここで行われる
+        with span('validate'):
+            await run_db(serializer.is_valid, raise_exception=True)
         
-        raw_landmarks = serializer.validated_data['raw_landmarks']
+        landmark_array = serializer.validated_data.pop('landmark_array')
         video_duration = serializer.validated_data.get('video_duration', 5.0)
-        
-        service = ScoringService(raw_landmarks, video_duration=video_duration)
-        # サービスの計算を非同期実行（AI生成中も他のリクエストを処理可能）
-        result = await sync_to_async(service.calculate_all, thread_sensitive=False)()
-        
-        # DB保存も非同期実行
-        instance = await sync_to_async(serializer.save, thread_sensitive=True)(**result)
+        user_id = serializer.validated_data['user'].pk
+
+        digest = payload_hash(user_id, serializer.validated_data['challenge'].pk, video_duration, landmark_array)
+
+        # 再送は採点し直さず、保存済みのスコアを返す
+        duplicate = await run_db(find_duplicate, user_id, digest, key)
+        if duplicate is not None:
+            return await self._replay(request, duplicate, ScoreSerializer, key, digest, 'stored')
+
+        async def score_and_save():
+            # 採点ワーカーが埋まっている場合は 503 (Retry-After) を返す
+            scoring_executor.check_capacity()
+            # 数値スコアの計算のみ行う（AIアドバイスはここでは待たない）。CPU負荷の高い処理は別プロセスで実行する
+            chart_data, detailed_results, overall_score = await scoring_executor.run(landmark_array, video_duration)
+            # DB保存も共有スレッドを通さずに並行して行う。フィードバックは pending としてキューに積む
+            with span('db_save'):
+                return await run_db(
+                    save_scored,
+                    serializer,
+                    payload_hash=digest,
+                    idempotency_key=key,
+                    landmark_array=landmark_array,
+                    chart_data=chart_data,
+                    detailed_results=detailed_results,
+                    overall_score=overall_score,
+                )
+
+        # 採点中の同じ送信がある場合は、その結果を待って共有する
+        (instance, created), shared = await score_flights.run(('payload', digest), score_and_save)
+        if shared or not created:
+            return await self._replay(request, instance, ScoreSerializer, key, digest, 'inflight' if shared else 'stored')
         
         response_serializer = ScoreSerializer(instance, context={'request': request})
         # adrfの .adata を使用して非同期でシリアライズ結果を取得
-        return Response(await response_serializer.adata, status=status.HTTP_201_CREATED)
+        with span('serialize_response'):
+            response_data = await response_serializer.adata
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+    async def post_streaming(self, request, key):
+        header = {name: value for name, value in request.data.items() if name != 'raw_landmarks'}
+        serializer = ScoreStreamHeaderSerializer(data=header, context={'request': request})
+        with span('validate'):
+            await run_db(serializer.is_valid, raise_exception=True)
+        user_id = serializer.validated_data['user'].pk
+        video_duration = serializer.validated_data.get('video_duration', 5.0)
 
+        if key is not None:
+            # キー付きの再送は本文を読まずに返す（内容の照合はできないため、キーのみで判定する）
+            duplicate = await run_db(find_duplicate, user_id, None, key)
+            if duplicate is not None:
+                return await self._replay(request, duplicate, ScoreDetailSerializer, key, None, 'stored')
+
+        async def score_and_save():
+            service = ScoringService(None, video_duration=video_duration)
+            hasher = PayloadHasher(user_id, serializer.validated_data['challenge'].pk, video_duration)
+            # フレームはチャンク単位でハッシュ・採点パイプライン・バイナリエンコーダに流し込む（常にバイナリ形式で保存）
+            encoder = Score.landmark_encoder()
+            frame_chunks = map(hasher.update, request.data['raw_landmarks'].chunks(max_frames=settings.SCORE_UPLOAD_MAX_FRAMES))
+            # ボディの読み込み・パース・検証も採点と並行して進むため、このスパンに含まれる
+            with span('stream_scoring'):
+                try:
+                    await sync_to_async(service.calculate_metrics_streaming, thread_sensitive=False)(frame_chunks, encoder.feed)
+                except LandmarkShapeError as exc:
+                    raise ValidationError({'raw_landmarks': [str(exc)]})
+
+            digest = hasher.hexdigest()
+            with span('db_save'):
+                instance, created = await run_db(
+                    save_scored,
+                    serializer,
+                    payload_hash=digest,
+                    idempotency_key=key,
+                    landmarks_blob=encoder.finish(),
+                    chart_data=service.chart_data,
+                    detailed_results=service.detailed_results,
+                    overall_score=service.overall_score,
+                )
+            return instance, created, digest
+
+        if key is None:
+            (instance, created, digest), shared = await score_and_save(), False
+        else:
+            # 内容のハッシュは読み終えるまで分からないため、同時の再送はキーでまとめる
+            (instance, created, digest), shared = await score_flights.run(('key', user_id, key), score_and_save)
+        if shared or not created:
+            return await self._replay(request, instance, ScoreDetailSerializer, key, digest, 'inflight' if shared else 'stored')
+
+        response_serializer = ScoreDetailSerializer(instance, context={'request': request})
+        with span('serialize_response'):
+            response_data = await response_serializer.adata
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+    async def _replay(self, request, score, serializer_class, key, digest, reason):
+        """Answers a retried submission with the score saved by the first one (200, Idempotent-Replayed: true)."""
+        check_same_payload(score, key, digest)
+        SCORE_DEDUPLICATED.inc(reason=reason)
+        with span('serialize_response'):
+            response_data = await run_db(lambda: serializer_class(score, context={'request': request}).data)
+        response = Response(response_data, status=status.HTTP_200_OK)
+        response[REPLAYED_HEADER] = 'true'
+        return response
+
+
+class ScoreFeedbackStreamView(AsyncAPIView):
+    """
+    数値スコアとAIアドバイスを Server-Sent Events で返す。
+    GET /api/scores/<score_id>/feedback/stream/
+
+    event: score     数値結果（接続直後に送る）
+    event: token     生成済みアドバイスの差分 {"text": "..."}
+    event: done      確定したフィードバック {"feedback_status": "done" | "failed", "feedback_text": "..."}
+    event: timeout   FEEDBACK_STREAM_TIMEOUT 秒以内に完了しなかった（/feedback/ で再取得できる）
+    アドバイスはワーカーが途中経過を Score.feedback_text に書き込み、このビューはその差分を中継する。
+    """
+    renderer_classes = [EventStreamRenderer, ORJSONRenderer]
+    # 送信するものがない間もプロキシに切断されないよう、この間隔でコメント行を送る
+    heartbeat_interval = 15
+
+    async def get(self, request, pk, *args, **kwargs):
+        score = await Score.objects.only(
+            'id', 'overall_score', 'chart_data', 'detailed_results', 'feedback_status', 'feedback_text',
+        ).filter(pk=pk).afirst()
+        if score is None:
+            raise Http404
+        if score.feedback_status in (Score.FeedbackStatus.PENDING, Score.FeedbackStatus.RUNNING):
+            worker_pool.start()
+
+        response = StreamingHttpResponse(self._events(score), content_type='text/event-stream; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+        # nginx のバッファリングを無効にし、届いた順に送る
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def _events(self, score):
+        yield sse_event('score', {
+            'id': score.id,
+            'overall_score': score.overall_score,
+            'chart_data': score.chart_data,
+            'detailed_results': score.detailed_results,
+        })
 
-class RankingAPIView(APIView):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.FEEDBACK_STREAM_TIMEOUT
+        heartbeat_at = loop.time() + self.heartbeat_interval
+        status_, text, sent = score.feedback_status, score.feedback_text or '', ''
+        while True:
+            if status_ in (Score.FeedbackStatus.DONE, Score.FeedbackStatus.FAILED):
+                yield sse_event('done', {'feedback_status': status_, 'feedback_text': text})
+                return
+            # 途中経過は前回送った本文の続きとして届く。失敗時などに置き換わった場合は done で全文を送り直す
+            if len(text) > len(sent) and text.startswith(sent):
+                yield sse_event('token', {'text': text[len(sent):]})
+                sent = text
+                heartbeat_at = loop.time() + self.heartbeat_interval
+            elif loop.time() >= heartbeat_at:
+                yield ': keep-alive\n\n'
+                heartbeat_at = loop.time() + self.heartbeat_interval
+            if loop.time() >= deadline:
+                yield sse_event('timeout', {'feedback_status': status_})
+                return
+
+            await asyncio.sleep(settings.FEEDBACK_STREAM_POLL_INTERVAL)
+            row = await Score.objects.filter(pk=score.id).values_list('feedback_status', 'feedback_text').afirst()
+            if row is None:
+                return
+            status_, text = row[0], row[1] or ''
+
+
+class ScoringSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     """
-    チャレンジごとの総合ランキングと、指定されたユーザーの順位を返すAPIビュー。
+    録画中にフレームを少しずつ送るライブ採点セッション。
+    POST /api/sessions/                      {"user": 1, "challenge": 1}
+    POST /api/sessions/<id>/frames/          {"sequence": 0, "frames": [...], "elapsed_seconds": 1.0}
+    POST /api/sessions/<id>/finalize/        {"video_duration": 8.2}
+    フレームの追記ごとに途中経過のスコアを返し、確定時は集計済みの状態からスコアを作るだけで済む。
+    """
+    queryset = ScoringSession.objects.all()
+    serializer_class = ScoringSessionSerializer
+
+    @action(detail=True, methods=['post'])
+    def frames(self, request, pk=None):
+        session = get_object_or_404(ScoringSession.objects.only('id'), pk=pk)
+        serializer = SessionFramesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        session, pipeline = append_session_frames(
+            session.id,
+            serializer.validated_data['sequence'],
+            serializer.validated_data['frames'],
+        )
+        chart_data, detailed_results, overall_score = pipeline.results(serializer.validated_data['elapsed_seconds'])
+
+        return Response({
+            'id': session.id,
+            'frame_count': session.frame_count,
+            'next_sequence': session.next_sequence,
+            'overall_score': overall_score,
+            'chart_data': chart_data,
+            'detailed_results': detailed_results,
+        })
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = get_object_or_404(ScoringSession.objects.only('id'), pk=pk)
+        serializer = SessionFinalizeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        score, created = finalize_session(session.id, serializer.validated_data['video_duration'])
+        return Response(
+            ScoreDetailSerializer(score, context={'request': request}).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+
+class RescoreJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    既存スコアを現在の採点ロジックで再採点するバッチジョブ。
+    POST /api/rescore_jobs/                  {"challenge": 1, "dry_run": true, "chunk_size": 500}
+    GET  /api/rescore_jobs/<id>/             進捗（last_score_id）と差分レポート
+    POST /api/rescore_jobs/<id>/resume/      失敗・中断したジョブをチェックポイントから再開
+    ジョブはこのプロセスのバックグラウンドスレッドで実行される（大量の再採点は manage.py rescore 推奨）。
+    """
+    queryset = RescoreJob.objects.all().order_by('-created_at')
+    serializer_class = RescoreJobSerializer
+
+    def _conflicting_job_exists(self):
+        return RescoreJob.objects.filter(status=RescoreJob.Status.RUNNING, dry_run=False).exists()
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data.get('dry_run') and self._conflicting_job_exists():
+            return Response({"error": "Another rescore job is already running."}, status=status.HTTP_409_CONFLICT)
+        job = serializer.save()
+        start_rescore_job(job)
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        job = self.get_object()
+        if job.status in (RescoreJob.Status.RUNNING, RescoreJob.Status.DONE):
+            return Response({"error": f"Job is {job.status}."}, status=status.HTTP_409_CONFLICT)
+        start_rescore_job(job)
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+def _query_scopes(*params, extra=()):
+    """Scope function for cached_response: one scope per required query parameter (None if any is missing)."""
+    def scopes(request, **kwargs):
+        values = [request.query_params.get(param) for param in params]
+        if not all(values):
+            return None
+        return [f'{param}:{value}' for param, value in zip(params, values)] + list(extra)
+    return scopes
+
+
+def _result_page_scopes(request, pk=None):
+    # ランキング（チャレンジ全体）と履歴（ユーザー）にも依存する
+    row = Score.objects.filter(pk=pk).values_list('user_id', 'challenge_id').first()
+    if row is None:
+        return None
+    return score_scopes(row[0], row[1], pk)
+
+
+def _my_position(user_id, challenge_id):
+    my_rank_data = leaderboard_backend.rank(user_id, challenge_id)
+    if my_rank_data is None:
+        return None, []
+    return my_rank_data, leaderboard_backend.neighborhood(user_id, challenge_id, radius=2)
+
+
+class RankingAPIView(AsyncAPIView):
+    """
+    チャレンジごとの総合ランキングと、指定されたユーザーの順位・前後の順位を返すAPIビュー。
     GET /api/ranking/?challenge=<challenge_id>&user=<user_id>
     """
-    def get(self, request, *args, **kwargs):
+    @cached_response('ranking', _query_scopes('challenge', extra=['users']))
+    async def get(self, request, *args, **kwargs):
         # 1. クエリパラメータから challenge_id を取得
         challenge_id = request.query_params.get('challenge')
         user_id = request.query_params.get('user') # user_idも取得（後で使います）
@@ -87,45 +465,35 @@ class RankingAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # 2. リーダーボードの元データをデータベースから取得
-        leaderboard_query = Score.objects.filter(challenge=challenge_id).values('user', 'user__name').annotate(max_score=Max('overall_score')).order_by('-max_score')
-
-        # 3. 取得したデータを、ランキング形式のリストに変換（上位10名）
-        leaderboard_data = []
-        for i, entry in enumerate(leaderboard_query[:10]):
-            leaderboard_data.append({
-                "rank": i + 1,
-                "user_id": entry['user'],
-                "user_name": entry['user__name'],
-                "score": entry['max_score']
-            })
-        
-        my_rank_data = None
+        # 2. リーダーボードから上位10名を取得（同点は同順位）
+        # 結果はキャッシュされるため、他のワーカーでの更新をここで取り込んでおく
+        await run_db(leaderboard_backend.refresh, challenge_id)
+        # user_idがURLで指定されている場合のみ、自分の順位と前後の順位を上位10名と並行して求める
+        top = run_db(leaderboard_backend.top, challenge_id, limit=10)
         if user_id:
-            # user_idがURLで指定されている場合のみ、自分の順位を探す
-            for i, entry in enumerate(leaderboard_query):
-                # user_idは文字列なので、比較のために整数(int)に変換する
-                if entry['user'] == int(user_id):
-                    my_rank_data = {
-                        "rank": i + 1,
-                        "user_id": entry['user'],
-                        "user_name": entry['user__name'],
-                        "score": entry['max_score']
-                    }
-                    break # 自分の順位が見つかったら、ループを終了する
+            leaderboard_data, (my_rank_data, neighborhood_data) = await asyncio.gather(
+                top, run_db(_my_position, user_id, challenge_id),
+            )
+        else:
+            leaderboard_data, my_rank_data, neighborhood_data = await top, None, []
+
+        # 3. ユーザー名をまとめて付与
+        await run_db(attach_user_names, leaderboard_data + neighborhood_data + ([my_rank_data] if my_rank_data else []))
         
         # 4. 生成したリーダーボードをレスポンスとして返す
         return Response({
             "leaderboard": leaderboard_data,
             "my_rank": my_rank_data,
+            "neighborhood": neighborhood_data,
         })
 
-class ScoreHistoryView(APIView):
+class ScoreHistoryView(AsyncAPIView):
     """
     特定ユーザーの、特定チャレンジにおけるスコアの時系列データを返す。
     GET /api/scores/history/?user=<user_id>&challenge=<challenge_id>
     """
-    def get(self, request, *args, **kwargs):
+    @cached_response('score_history', _query_scopes('user', 'challenge'))
+    async def get(self, request, *args, **kwargs):
         user_id = request.query_params.get('user')
         challenge_id = request.query_params.get('challenge')
 
@@ -141,7 +509,7 @@ class ScoreHistoryView(APIView):
         ).order_by('created_at')
 
         # 4. 必要なデータだけを抽出・整形 (idを追加)
-        data = list(history_query.values('id', 'created_at', 'overall_score'))
+        data = await run_db(list, history_query.values('id', 'created_at', 'overall_score'))
 
         # 5. フロントエンドが使いやすいように最終調整
         for item in data:
@@ -151,17 +519,14 @@ class ScoreHistoryView(APIView):
 
         return Response(data)
 
-from django.db.models import Avg, FloatField, Case, When
-from django.db.models.functions import Cast
-from django.db.models.fields.json import KeyTextTransform
-from datetime import date, timedelta
 
-class ScoreAverageComparisonView(APIView):
+class ScoreAverageComparisonView(AsyncAPIView):
     """
     特定チャレンジにおける「自分の平均スコア」と「全ユーザーの平均スコア」を返す。
     GET /api/scores/average_comparison/?user=<user_id>&challenge=<challenge_id>
     """
-    def get(self, request, *args, **kwargs):
+    @cached_response('average_comparison', _query_scopes('user', 'challenge'))
+    async def get(self, request, *args, **kwargs):
         user_id = request.query_params.get('user')
         challenge_id = request.query_params.get('challenge')
 
@@ -172,49 +537,44 @@ class ScoreAverageComparisonView(APIView):
             )
             
         
-        chart_data_keys = [
-            'symmetry',
-            'trunk_uprightness',
-            'gravity_stability',
-            'walking_speed',
-        ]
-        
-        aggregations = {
-            'overall_average': Avg('overall_score'),
-            'user_average': Avg(Case(When(user_id=user_id, then='overall_score'), output_field=FloatField()))
-        }
-        
-        for key in chart_data_keys:
-            aggregations[f'overall_{key}_avg'] = Avg(Cast(KeyTextTransform(key, 'chart_data'), FloatField()))
-            
-            aggregations[f'user_{key}_avg'] = Avg(Case(When(user_id=user_id, then=Cast(KeyTextTransform(key, 'chart_data'), FloatField())), output_field=FloatField()))
-
-        
-        all_averages = Score.objects.filter(challenge_id=challenge_id).aggregate(**aggregations)
-        user_chart_data_averages = {
-            key: round(all_averages.get(f'user_{key}_avg') or 0, 3) for key in chart_data_keys
-        }
-        overall_chart_data_averages = {
-            key: round(all_averages.get(f'overall_{key}_avg') or 0, 3) for key in chart_data_keys
-        }
+        # 保存時に更新される集計テーブルから、主キー / 一意キーで1行ずつ（並行して）取得する
+        overall, mine = await asyncio.gather(
+            run_db(ChallengeScoreAggregate.objects.filter(challenge_id=challenge_id).first),
+            run_db(UserChallengeScoreAggregate.objects.filter(user_id=user_id, challenge_id=challenge_id).first),
+        )
 
-        # 全体の平均スコアを計算
-        overall_scores = Score.objects.filter(challenge_id=challenge_id)
-        overall_average = overall_scores.aggregate(Avg('overall_score'))['overall_score__avg'] or 0
+        def chart_averages(aggregate):
+            if aggregate is None:
+                return {key: 0 for key in ChallengeScoreAggregate.CHART_KEYS}
+            return {key: round(value, 3) for key, value in aggregate.chart_data_averages().items()}
 
         return Response({
-            "user_average": round(all_averages.get('user_average') or 0, 3),
-            "overall_average": round(all_averages.get('overall_average') or 0, 3),
-            "user_chart_data_averages": user_chart_data_averages,
-            "overall_chart_data_averages": overall_chart_data_averages,
+            "user_average": round(mine.overall_average, 3) if mine else 0,
+            "overall_average": round(overall.overall_average, 3) if overall else 0,
+            "user_chart_data_averages": chart_averages(mine),
+            "overall_chart_data_averages": chart_averages(overall),
         })
 
-class DashboardAPIView(APIView):
+
+def _dashboard_stats(user_id):
+    # 保存時に更新されるユーザー統計を1回の読み取りで取得する
+    stats = UserStats.objects.select_related('user').filter(user_id=user_id).first()
+    if stats is None:
+        if not User.objects.filter(pk=user_id).exists():
+            return None
+        # まだ統計が作られていないユーザー（プレイ前・バックフィル前）はここで作成する
+        stats = refresh_user_stats(user_id)
+    return stats
+
+
+class DashboardAPIView(AsyncAPIView):
     """
     ダッシュボードに必要なデータをまとめて返すAPIビュー。
     GET /api/dashboard/?user=<user_id>
     """
-    def get(self, request, *args, **kwargs):
+    # 最近のアクティビティにチャレンジ名を含み、連続プレイ日数は今日の日付で変わる
+    @cached_response('dashboard', _query_scopes('user', extra=['challenges']), daily=True)
+    async def get(self, request, *args, **kwargs):
         user_id = request.query_params.get('user')
         if not user_id:
             return Response(
@@ -222,122 +582,79 @@ class DashboardAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            user = User.objects.get(pk=user_id)
-        except User.DoesNotExist:
+        stats = await run_db(_dashboard_stats, user_id)
+        if stats is None:
             return Response(
                 {"error": "User not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # ユーザーの全スコアを取得
-        scores = Score.objects.filter(user=user).order_by('-created_at')
-
-        # --- 統計データの計算 ---
-
-        # 1. レベル
-        total_plays = scores.count()
-        level = (total_plays // 5) + 1
-
-        # 2. ハイスコア (より効率的な方法)
-        high_score_data = scores.aggregate(max_score=Max('overall_score'))
-        high_score = high_score_data['max_score'] or 0
-
-        # 3. 連続プレイ日数
-        streak = 0
-        if total_plays > 0:
-            # ユニークなプレイ日を取得
-            unique_dates = sorted(list(set(scores.values_list('created_at__date', flat=True))), reverse=True)
-            
-            today = date.today()
-            
-            # 最新のプレイが今日か昨日かチェック
-            if (today - unique_dates[0]).days <= 1:
-                streak = 1
-                for i in range(len(unique_dates) - 1):
-                    # 日付の差が1日なら連続とみなす
-                    if (unique_dates[i] - unique_dates[i+1]).days == 1:
-                        streak += 1
-                    else:
-                        break # 連続が途切れたら終了
-
-        # 4. 最近のアクティビティ (N+1問題を回避)
-        recent_activities_query = scores.select_related('challenge')[:5]
-        recent_activities = [
-            {
-                "id": score.id,
-                "challengeName": score.challenge.name,
-                "overall_score": score.overall_score,
-                "date": score.created_at.strftime('%Y-%m-%d')
-            }
-            for score in recent_activities_query
-        ]
-
         # --- レスポンスを構築 ---
         response_data = {
-            "userName": user.name,
-            "level": level,
-            "highScore": high_score,
-            "streak": streak,
-            "recentActivities": recent_activities
+            "userName": stats.user.name,
+            "level": level_for(stats.total_plays),
+            "highScore": stats.high_score,
+            "streak": displayed_streak(stats),
+            "recentActivities": stats.recent_activities
         }
 
         return Response(response_data)
 
 
-class ResultPageDataView(APIView):
+def _score_history(related_scores):
+    return [
+        {
+            "overall_score": overall_score,
+            "date": created_at.strftime('%m/%d') # 日付フォーマットをMM/DDに
+        }
+        for overall_score, created_at in related_scores.values_list('overall_score', 'created_at')
+    ]
+
+
+def _challenge_rank(user_id, challenge_id):
+    # 結果はキャッシュされるため、他のワーカーでの更新を先に取り込む
+    leaderboard_backend.refresh(challenge_id)
+    my_entry = leaderboard_backend.rank(user_id, challenge_id)
+    return my_entry['rank'] if my_entry else 0, leaderboard_backend.total_participants(challenge_id)
+
+
+class ResultPageDataView(AsyncAPIView):
     """
     リザルトページに必要なすべてのデータを集約して返すAPIビュー。
     GET /api/result/<score_id>/
     """
-    def get(self, request, pk=None, *args, **kwargs):
+    @cached_response('result_page', _result_page_scopes)
+    async def get(self, request, pk=None, *args, **kwargs):
         try:
             # 1. メインとなるスコアを取得
-            main_score = Score.objects.select_related('user', 'challenge').get(pk=pk)
+            main_score = await run_db(
+                Score.objects.select_related('user', 'challenge').defer('raw_landmarks', 'landmarks_blob').get, pk=pk,
+            )
         except Score.DoesNotExist:
             return Response({"error": "Score not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # メインスコアのシリアライズ
-        serialized_main_score = ScoreSerializer(main_score, context={'request': request}).data
-
-        # 2. 関連スコア（同じユーザー、同じチャレンジ）をすべて取得
+        # 2. 関連スコア（同じユーザー、同じチャレンジ）
         related_scores = Score.objects.filter(
-            user=main_score.user,
-            challenge=main_score.challenge
+            user_id=main_score.user_id,
+            challenge_id=main_score.challenge_id
         ).order_by('created_at')
 
-        # 3. スコア履歴を作成
-        score_history = [
-            {
-                "overall_score": score.overall_score,
-                "date": score.created_at.strftime('%m/%d') # 日付フォーマットをMM/DDに
-            }
-            for score in related_scores
-        ]
-
-        # 4. 自己ベストを計算 (今回のスコアを除く)
-        past_scores = related_scores.exclude(pk=pk)
-        personal_best_score = past_scores.aggregate(max_score=Max('overall_score'))['max_score'] or 0
-
-        # 5. ランキングを計算
-        leaderboard = Score.objects.filter(challenge=main_score.challenge)\
-            .values('user')\
-            .annotate(max_score=Max('overall_score'))\
-            .order_by('-max_score')
-
-        my_rank = 0
-        for i, entry in enumerate(leaderboard):
-            if entry['user'] == main_score.user_id:
-                my_rank = i + 1
-                break
-        
-        total_participants = leaderboard.count()
+        # メインスコアのシリアライズ（外部キーは ID のみのため DB にはアクセスしない）
+        serialized_main_score = ScoreDetailSerializer(main_score, context={'request': request}).data
+
+        # 3〜5. 互いに独立したスコア履歴・自己ベスト（今回のスコアを除く）・ランキングは
+        # それぞれ別の接続で並行して取得する
+        score_history, personal_best, (my_rank, total_participants) = await asyncio.gather(
+            run_db(_score_history, related_scores),
+            run_db(related_scores.exclude(pk=pk).aggregate, max_score=Max('overall_score')),
+            run_db(_challenge_rank, main_score.user_id, main_score.challenge_id),
+        )
 
         # 6. すべてのデータを結合してレスポンス
         response_data = {
             "main_score": serialized_main_score,
             "score_history": score_history,
-            "personal_best": personal_best_score,
+            "personal_best": personal_best['max_score'] or 0,
             "ranking": {
                 "rank": my_rank,
                 "total_participants": total_participants
@@ -345,3 +662,47 @@ class ResultPageDataView(APIView):
         }
 
         return Response(response_data)
+
+
+class CacheStatsAPIView(APIView):
+    """
+    このプロセスのキャッシュのヒット率（エンドポイント別）を返す。
+    GET /api/cache_stats/
+    """
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "responses": cache_stats.snapshot(),
+            "feedback_advice": feedback_cache.stats(),
+        })
+
+
+class LeaderboardConsistencyAPIView(APIView):
+    """
+    このプロセスがメモリ上に持つリーダーボードと自己ベスト集計（UserChallengeBest）のずれを返す。
+    GET /api/leaderboard/consistency/?challenge=<challenge_id>
+    uvicorn ワーカーごとに別のボードを持つため、応答したワーカーの状態だけを確認する（worker にプロセスIDを返す）。
+    """
+    def get(self, request, *args, **kwargs):
+        challenge_id = request.query_params.get('challenge')
+        if challenge_id is not None and not challenge_id.isdigit():
+            return Response({"error": "challenge must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        mismatches = leaderboard_backend.check_consistency(challenge_id)
+        return Response({
+            "worker": os.getpid(),
+            "consistent": not mismatches,
+            "mismatches": [
+                {"challenge_id": cid, "user_id": user_id, "expected": expected, "actual": actual}
+                for cid, user_id, expected, actual in mismatches
+            ],
+        })
+
+
+class MetricsAPIView(APIView):
+    """
+    このプロセスのメトリクス（エンドポイント別レイテンシ、クエリ数、採点の各段階、LLM、キャッシュ）を
+    Prometheus のテキスト形式で返す。
+    GET /api/metrics/
+    """
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -14,3 +14,17 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# 採点用のワーカープロセスをサーバー起動時に立ち上げておく
+from api.scoring_executor import scoring_executor  # noqa: E402
+scoring_executor.start()
+
+# 再起動前に残った生成待ち・生成中のフィードバックを、次のスコア送信を待たずに処理する
+from api.feedback import worker_pool  # noqa: E402
+worker_pool.start()
+
+# メモリ版リーダーボードを起動時に（バックグラウンドで）読み込み、最初のランキング表示で全件の読み込みを待たせない
+from django.conf import settings  # noqa: E402
+if settings.LEADERBOARD_WARM_ON_START:
+    from api.leaderboard import leaderboard_backend  # noqa: E402
+    leaderboard_backend.warm_in_background()
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -92,6 +93,160 @@ DATABASES = {
     }
 }
 
+# Bounded Postgres connection pool per process (psycopg 3). Connections are checked out per request / per
+# database call and returned afterwards, so at most DB_POOL_MAX_SIZE are open per uvicorn worker
+DB_POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', 'true').lower() == 'true'
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 12))
+# Seconds to wait for a free connection before the request fails
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+if DB_POOL_ENABLED:
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {'min_size': DB_POOL_MIN_SIZE, 'max_size': DB_POOL_MAX_SIZE, 'timeout': DB_POOL_TIMEOUT},
+    }
+else:
+    # Without the pool, keep each thread's connection open for DB_CONN_MAX_AGE seconds instead of
+    # reconnecting for every call (Django does not allow both together)
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Threads that run the database work of the async views (see api/db_executor.py).
+# Keep it below DB_POOL_MAX_SIZE to leave connections for the sync views and the feedback workers
+DB_WORKERS = int(os.environ.get('DB_WORKERS', max(1, DB_POOL_MAX_SIZE // 2)))
+
+
+# AI feedback generation
+# LLM_BACKEND: 'gemini' (Google Gemini API) or 'fake' (offline stand-in for development/tests)
+
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')
+
+# The static part of the advice prompt (instructions + expert_knowledge.md) is stored as a Gemini context cache
+# for LLM_CONTEXT_CACHE_TTL seconds, so only the per-score results are sent with each request
+LLM_CONTEXT_CACHE = os.environ.get('LLM_CONTEXT_CACHE', 'true').lower() == 'true'
+LLM_CONTEXT_CACHE_TTL = int(os.environ.get('LLM_CONTEXT_CACHE_TTL', 3600))
+# How often (seconds) expert_knowledge.md is checked for changes
+EXPERT_KNOWLEDGE_CHECK_INTERVAL = float(os.environ.get('EXPERT_KNOWLEDGE_CHECK_INTERVAL', 5))
+
+# Number of concurrent feedback jobs per process, and how often idle workers poll the queue (seconds)
+FEEDBACK_WORKERS = int(os.environ.get('FEEDBACK_WORKERS', 4))
+FEEDBACK_POLL_INTERVAL = float(os.environ.get('FEEDBACK_POLL_INTERVAL', 10))
+# A job still running this many seconds after it was claimed is assumed lost (e.g. the worker restarted)
+# and is queued again
+FEEDBACK_JOB_TIMEOUT = int(os.environ.get('FEEDBACK_JOB_TIMEOUT', 600))
+
+# Streaming feedback (/api/scores/<id>/feedback/stream/): how often the worker writes the partial advice,
+# how often the stream checks for new text, and when an open stream gives up (seconds)
+FEEDBACK_STREAM_FLUSH_INTERVAL = float(os.environ.get('FEEDBACK_STREAM_FLUSH_INTERVAL', 0.3))
+FEEDBACK_STREAM_POLL_INTERVAL = float(os.environ.get('FEEDBACK_STREAM_POLL_INTERVAL', 0.25))
+FEEDBACK_STREAM_TIMEOUT = float(os.environ.get('FEEDBACK_STREAM_TIMEOUT', 180))
+
+# Advice cache keyed by the quantized analysis results
+# FEEDBACK_CACHE_BACKEND: 'local' (in-process LRU/TTL), 'database' (shared between workers) or 'none'
+FEEDBACK_CACHE_BACKEND = os.environ.get('FEEDBACK_CACHE_BACKEND', 'local')
+FEEDBACK_CACHE_MAXSIZE = int(os.environ.get('FEEDBACK_CACHE_MAXSIZE', 1024))
+FEEDBACK_CACHE_TTL = int(os.environ.get('FEEDBACK_CACHE_TTL', 7 * 24 * 60 * 60))
+# Width (in points) of the per-metric score buckets used in the cache key
+FEEDBACK_CACHE_SCORE_STEP = float(os.environ.get('FEEDBACK_CACHE_SCORE_STEP', 2))
+
+
+# Landmark storage
+# LANDMARK_STORAGE_FORMAT: 'binary' (packed arrays, see api/landmark_codec.py) or 'json' (legacy JSONField)
+
+LANDMARK_STORAGE_FORMAT = os.environ.get('LANDMARK_STORAGE_FORMAT', 'binary')
+LANDMARK_STORAGE_DTYPE = os.environ.get('LANDMARK_STORAGE_DTYPE', 'float32')
+LANDMARK_STORAGE_COMPRESSION = os.environ.get('LANDMARK_STORAGE_COMPRESSION', 'zlib')
+
+
+# CPU-bound scoring of uploaded sessions
+# SCORING_EXECUTOR: 'process' (worker processes, scales with cores) or 'thread' (in-process, shares the GIL)
+SCORING_EXECUTOR = os.environ.get('SCORING_EXECUTOR', 'process')
+# Worker processes per uvicorn worker (the compose setup runs 2 uvicorn workers)
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+# Jobs that may wait for a free worker before new uploads are rejected with 503
+SCORING_QUEUE_DEPTH = int(os.environ.get('SCORING_QUEUE_DEPTH', SCORING_WORKERS * 2))
+# Retry-After (seconds) sent with the 503
+SCORING_RETRY_AFTER = int(os.environ.get('SCORING_RETRY_AFTER', 5))
+# A retried upload (same Idempotency-Key, or the same user / challenge / duration / frames) within this many
+# seconds gets the score saved by the first one instead of being scored again (0 disables; see api/idempotency.py)
+SCORE_DEDUP_WINDOW = int(os.environ.get('SCORE_DEDUP_WINDOW', 600))
+# Upload limits: larger bodies are rejected with 413 before being parsed, longer sessions with 400
+# (18000 frames = 10 minutes at 30 fps)
+SCORE_UPLOAD_MAX_BYTES = int(os.environ.get('SCORE_UPLOAD_MAX_BYTES', 64 * 1024 * 1024))
+SCORE_UPLOAD_MAX_FRAMES = int(os.environ.get('SCORE_UPLOAD_MAX_FRAMES', 18000))
+
+
+# Leaderboard queries
+# LEADERBOARD_BACKEND: 'memory' (per-process order-statistics index) or 'database' (indexed SQL)
+
+LEADERBOARD_BACKEND = os.environ.get('LEADERBOARD_BACKEND', 'memory')
+# How often (seconds) the memory backend picks up best scores saved by other workers, and reloads a whole board
+LEADERBOARD_SYNC_INTERVAL = float(os.environ.get('LEADERBOARD_SYNC_INTERVAL', 1))
+LEADERBOARD_RESYNC_INTERVAL = float(os.environ.get('LEADERBOARD_RESYNC_INTERVAL', 300))
+# Load every board when a server process starts (in the background) instead of on the first ranking request
+LEADERBOARD_WARM_ON_START = os.environ.get('LEADERBOARD_WARM_ON_START', 'true').lower() == 'true'
+
+
+# Response cache for the read APIs (ranking, history, average comparison, dashboard, result page)
+# RESPONSE_CACHE_BACKEND: 'file' or 'db' (shared between workers; 'db' needs `manage.py createcachetable`),
+# or 'locmem' (per process, so each worker fills its own copy). The scope versions used for invalidation
+# are always kept in the database (ResponseCacheVersion), so every backend sees invalidations from all workers
+
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'file')
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+RESPONSE_CACHE_ALIAS = 'responses'
+
+_RESPONSE_CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'runway-responses'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', os.environ.get('RESPONSE_CACHE_LOCATION', '/tmp/runway-response-cache')),
+    'db': ('django.core.cache.backends.db.DatabaseCache', os.environ.get('RESPONSE_CACHE_LOCATION', 'response_cache')),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    RESPONSE_CACHE_ALIAS: {
+        'BACKEND': _RESPONSE_CACHE_BACKENDS[RESPONSE_CACHE_BACKEND][0],
+        'LOCATION': _RESPONSE_CACHE_BACKENDS[RESPONSE_CACHE_BACKEND][1],
+        'TIMEOUT': RESPONSE_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 10000))},
+    },
+}
+
+
+# JSON is parsed and rendered with orjson (api/parsers.py, api/renderers.py)
+REST_FRAMEWORK = {
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
+# Request metrics (exposed at /api/metrics/) and logging
+# Requests slower than METRICS_SLOW_REQUEST_SECONDS are logged at WARNING with their span breakdown
+METRICS_SLOW_REQUEST_SECONDS = float(os.environ.get('METRICS_SLOW_REQUEST_SECONDS', 5))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
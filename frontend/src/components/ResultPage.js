@@ -175,7 +175,7 @@ const PerformanceAnalysis = ({ chartData }) => {
 };
 
 // AIコーチの視点コンポーネント
-const AiCoachView = ({ feedbackText }) => {
+const AiCoachView = ({ feedbackText, isGenerating }) => {
   const theme = useTheme();
   return (
     <Box sx={{ width: '100%', height: '100%', p: 4, display: 'flex', flexDirection: 'column' }}>
@@ -215,7 +215,19 @@ const AiCoachView = ({ feedbackText }) => {
             color: theme.palette.secondary.dark,
         }
       }}>
-        <ReactMarkdown remarkPlugins={[remarkGfm]}>{feedbackText}</ReactMarkdown>
+        {isGenerating && !feedbackText ? (
+          <Box sx={{ display: 'flex', flexDirection: 'column', alignItems: 'center', justifyContent: 'center', py: 4, gap: 2 }}>
+            <CircularProgress size={40} />
+            <Typography variant="body2" sx={{ color: theme.palette.grey[600] }}>
+              AIコーチがアドバイスを作成しています...
+            </Typography>
+          </Box>
+        ) : (
+          <>
+            <ReactMarkdown remarkPlugins={[remarkGfm]}>{feedbackText}</ReactMarkdown>
+            {isGenerating && <CircularProgress size={20} sx={{ mt: 1 }} />}
+          </>
+        )}
       </Box>
     </Box>
   );
@@ -492,6 +504,7 @@ function ResultPage() {
   const [isBestScore, setIsBestScore] = useState(false);
   const [rank, setRank] = useState(null);
   const [totalParticipants, setTotalParticipants] = useState(null);
+  const [feedback, setFeedback] = useState({ status: 'done', text: '' });
 
   // --- データ取得ロジック ---
   useEffect(() => {
@@ -514,6 +527,7 @@ function ResultPage() {
 
         // APIからのレスポンスを元に各stateを更新
         setResultData(data.main_score);
+        setFeedback({ status: data.main_score.feedback_status, text: data.main_score.feedback_text });
         const isBest = data.main_score.overall_score > data.personal_best;
         setIsBestScore(isBest);
         setRank(data.ranking.rank);
@@ -535,6 +549,37 @@ function ResultPage() {
     fetchResultData();
   }, [scoreId]);
 
+  // --- AIフィードバックの逐次表示（バックグラウンドで生成中の場合は SSE で受け取る） ---
+  const isFeedbackPending = ['pending', 'running'].includes(feedback.status);
+  useEffect(() => {
+    if (!scoreId || !isFeedbackPending) return;
+    const source = new EventSource(`/api/scores/${scoreId}/feedback/stream/`);
+    let streamedText = '';
+    source.addEventListener('token', (event) => {
+      streamedText += JSON.parse(event.data).text;
+      setFeedback({ status: 'running', text: streamedText });
+    });
+    source.addEventListener('done', (event) => {
+      const data = JSON.parse(event.data);
+      setFeedback({ status: data.feedback_status, text: data.feedback_text });
+      source.close();
+    });
+    const refreshFeedback = async () => {
+      source.close();
+      try {
+        const response = await fetch(`/api/scores/${scoreId}/feedback/`);
+        if (!response.ok) return;
+        const data = await response.json();
+        setFeedback({ status: data.feedback_status, text: data.feedback_text });
+      } catch (err) {
+        console.error(err);
+      }
+    };
+    source.addEventListener('timeout', refreshFeedback);
+    source.onerror = refreshFeedback;
+    return () => source.close();
+  }, [scoreId, isFeedbackPending]);
+
   // --- スコア表示のアニメーション ---
   useEffect(() => {
     if (!resultData) return;
@@ -709,7 +754,10 @@ function ResultPage() {
           <Divider sx={{ display: { xs: 'block', md: 'none' } }} />
           
           <Box sx={{ flex: { md: 6 }, width: '100%' }}>
-            <AiCoachView feedbackText={resultData.feedback_text} />
+            <AiCoachView
+              feedbackText={feedback.text}
+              isGenerating={['pending', 'running'].includes(feedback.status)}
+            />
           </Box>
         </Box>
       </Paper>
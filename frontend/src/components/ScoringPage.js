@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useRef } from 'react';
+import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { Typography, Box, CircularProgress, Button, Paper, IconButton, ToggleButtonGroup, ToggleButton, Tooltip } from '@mui/material';
 import CloseIcon from '@mui/icons-material/Close';
@@ -9,6 +9,9 @@ import { useUser } from '../contexts/UserContext';
 
 // 採点時間は手動で終了するため、定数は不要
 
+// ライブ採点セッションへ一度に送るフレーム数（30fpsで約1秒分）
+const FRAMES_PER_CHUNK = 30;
+
 // --- Metric Definitions ---
 const METRIC_DEFINITIONS = {
   trunkAngle: {
@@ -114,7 +117,6 @@ function ScoringPage() {
   const [poseLandmarker, setPoseLandmarker] = useState(null);
   const [isModelLoading, setIsModelLoading] = useState(true);
   const [scoringStatus, setScoringStatus] = useState('idle'); // 'idle', 'countdown', 'scoring', 'finished'
-  const [recordedLandmarks, setRecordedLandmarks] = useState([]);
   const [message, setMessage] = useState('');
   
   const [realtimeMetrics, setRealtimeMetrics] = useState({});
@@ -130,6 +132,48 @@ function ScoringPage() {
   const hasSubmittedRef = useRef(false);
   const scoringStartTimeRef = useRef(null); // 採点開始時刻を記録
 
+  // ライブ採点セッション: フレームは一定数たまるごとにサーバーへ送信し、終了時は確定のみ行う
+  const sessionIdPromiseRef = useRef(null);
+  const pendingFramesRef = useRef([]);
+  const nextSequenceRef = useRef(0);
+  const recordedFrameCountRef = useRef(0);
+  const uploadChainRef = useRef(Promise.resolve());
+
+  const flushFrames = useCallback(() => {
+    const frames = pendingFramesRef.current;
+    if (frames.length === 0 || !sessionIdPromiseRef.current) return uploadChainRef.current;
+    pendingFramesRef.current = [];
+    const sequence = nextSequenceRef.current++;
+    const elapsedSeconds = scoringStartTimeRef.current ? (Date.now() - scoringStartTimeRef.current) / 1000 : 0;
+
+    // チャンクは送信順を保つため直列に送る（同じsequenceの再送はサーバー側で無視される）
+    uploadChainRef.current = uploadChainRef.current.then(async () => {
+      const sessionId = await sessionIdPromiseRef.current;
+      const body = JSON.stringify({ sequence, frames, elapsed_seconds: elapsedSeconds });
+      // 再送するのは通信エラーとサーバーエラー (5xx) のみ。4xx（409 の順番違い・確定済みなど）は再送しても結果が変わらない
+      for (let attempt = 0; attempt < 3; attempt++) {
+        if (attempt > 0) await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+        let response;
+        try {
+          response = await fetch(`/api/sessions/${sessionId}/frames/`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body,
+          });
+        } catch (err) {
+          console.error("フレームの送信に失敗しました:", err);
+          continue;
+        }
+        if (response.ok) return;
+        if (response.status < 500) {
+          throw new Error(`フレームの送信に失敗しました（${response.status}）。`);
+        }
+      }
+      throw new Error('フレームの送信に失敗しました。');
+    });
+    return uploadChainRef.current;
+  }, []);
+
   // チャレンジ情報を取得
   useEffect(() => {
     if (!challengeId) return;
@@ -209,8 +253,23 @@ function ScoringPage() {
     } else if (scoringStatus === 'scoring') {
       setMessage('');
       scoringStartTimeRef.current = Date.now(); // 採点開始時刻を記録
+      pendingFramesRef.current = [];
+      nextSequenceRef.current = 0;
+      recordedFrameCountRef.current = 0;
+      uploadChainRef.current = Promise.resolve();
+      sessionIdPromiseRef.current = fetch('/api/sessions/', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ user: currentUser.id, challenge: parseInt(challengeId, 10) }),
+      }).then(async (response) => {
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.detail || '採点セッションの開始に失敗しました。');
+        return data.id;
+      });
+      // 未処理のrejectionにならないよう、エラーは送信・確定時にまとめて扱う
+      sessionIdPromiseRef.current.catch(() => {});
     }
-  }, [scoringStatus]);
+  }, [scoringStatus, currentUser, challengeId]);
 
   // Reset submitted ref when status changes to idle
   useEffect(() => {
@@ -226,7 +285,7 @@ function ScoringPage() {
       hasSubmittedRef.current = true;
 
       const submitData = async () => {
-        if (recordedLandmarks.length === 0) {
+        if (recordedFrameCountRef.current === 0) {
           alert('データが記録されませんでした。もう一度お試しください。');
           setScoringStatus('idle');
           return;
@@ -234,15 +293,14 @@ function ScoringPage() {
         try {
           await new Promise(resolve => setTimeout(resolve, 1000)); // FINISH表示を見せる
           setMessage('AIがフォームを解析しています...');
-          const response = await fetch('/api/score/', {
+          const videoDuration = scoringStartTimeRef.current ? (Date.now() - scoringStartTimeRef.current) / 1000 : 0; // 実際の経過時間（秒）
+          // 残りのフレームを送信してからセッションを確定する
+          await flushFrames();
+          const sessionId = await sessionIdPromiseRef.current;
+          const response = await fetch(`/api/sessions/${sessionId}/finalize/`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-              user: currentUser.id,
-              challenge: parseInt(challengeId, 10),
-              raw_landmarks: recordedLandmarks,
-              video_duration: scoringStartTimeRef.current ? (Date.now() - scoringStartTimeRef.current) / 1000 : 0, // 実際の経過時間（秒）
-            })
+            body: JSON.stringify({ video_duration: videoDuration })
           });
           const resultData = await response.json();
           if (!response.ok) throw new Error(resultData.detail || 'APIリクエストに失敗しました。');
@@ -255,7 +313,7 @@ function ScoringPage() {
       };
       submitData();
     }
-  }, [scoringStatus, challengeId, recordedLandmarks, navigate, currentUser]);
+  }, [scoringStatus, navigate, flushFrames]);
 
   // scoringStatusの最新値をrefに同期
   useEffect(() => {
@@ -284,7 +342,11 @@ function ScoringPage() {
             setRealtimeMetrics(metrics);
             
             if (scoringStatusRef.current === 'scoring') {
-              setRecordedLandmarks(prev => [...prev, results.landmarks]);
+              pendingFramesRef.current.push(results.landmarks);
+              recordedFrameCountRef.current += 1;
+              if (pendingFramesRef.current.length >= FRAMES_PER_CHUNK) {
+                flushFrames().catch(() => {});
+              }
             }
 
             canvasCtx.save();